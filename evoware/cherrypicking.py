@@ -19,10 +19,21 @@ import copy
 import collections
 import unittest
 import tempfile
+import logging
+import os
+import glob
+import hashlib
+import pickle
+import concurrent.futures
+import csv
+import re
+import sys
 
 from . import fileutil as F
 from . import worklist as W
 from . import plates
+from . import optimize as O
+from . import costmodel
 
 import xlrd as X
 
@@ -31,6 +42,109 @@ class IndexFileError(Exception):
     pass
 
 
+class SourceShortageError(IndexFileError):
+    """
+    Raised by SourceAllocator.check; shortages holds one line per part
+    that can not be served from its source wells.
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        IndexFileError.__init__(self, 'insufficient source volume:\n%s'
+                                % '\n'.join(shortages))
+
+
+class IndexEntry(tuple):
+    """
+    Compact, read-only table row with dict-like access:
+
+    >>> d = IndexEntry.fromDict({'id': 'sb0101', 'plate': 'SB10'})
+    >>> d['plate'], d.get('pos', 'A1')
+    ('SB10', 'A1')
+    >>> dict(d)
+    {'id': 'sb0101', 'plate': 'SB10'}
+
+    Entries only store their values in a tuple. Column names and positions
+    are held by a subclass that is created once per column layout (schema)
+    and shared by all rows with this layout. Together with shared (interned)
+    values, this takes a fraction of the memory of one dict per row.
+    Entries compare equal to dicts with the same content.
+    """
+    __slots__ = ()
+
+    #: column names of this schema
+    _keys = ()
+    #: column name -> tuple index
+    _index = {}
+
+    _schemas = {}  ## (column names) -> IndexEntry subclass
+
+    @classmethod
+    def schema(cls, keys):
+        """@return IndexEntry subclass for given column names"""
+        keys = tuple(keys)
+        r = cls._schemas.get(keys)
+        if r is None:
+            r = type(cls.__name__, (cls,), {
+                '__slots__': (), '_keys': keys,
+                '_index': dict((k, i) for i, k in enumerate(keys))})
+            cls._schemas[keys] = r
+        return r
+
+    @classmethod
+    def fromDict(cls, d):
+        """
+        @return IndexEntry with content of dict d; str values are interned
+                so that repeated values (plate IDs, volumes) are shared
+        """
+        return cls.schema(d.keys())(
+            sys.intern(v) if type(v) is str else v for v in d.values())
+
+    def __getitem__(self, key, _get=tuple.__getitem__):
+        return _get(self, self._index[key])
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return tuple(tuple.__iter__(self))
+
+    def items(self):
+        return list(zip(self._keys, tuple.__iter__(self)))
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, IndexEntry)):
+            return dict(self.items()) == dict(other.items())
+        return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return _indexEntry, (self._keys, self.values())
+
+
+def _indexEntry(keys, values):
+    """unpickle IndexEntry"""
+    return IndexEntry.schema(keys)(values)
+
+
 class BaseIndex(object):
     """
     Common base for Table (Excel) parsing.
@@ -55,7 +169,8 @@ class BaseIndex(object):
     versions are equally valid. 
     
     The content of each row is parsed into a dictionary {column-title:value,}
-    which is then mapped to the index key (ID or ID#subID).
+    which is then mapped to the index key (ID or ID#subID). Entries are
+    stored as IndexEntry, a compact read-only version of this dictionary.
     
     The complete dictionary of each row can be accessed in two ways:
     
@@ -96,6 +211,10 @@ class BaseIndex(object):
     * param    volume    130    ul
     ... is converted into 
     >>> parser._params['volume'] = 130
+
+    Tables are read row by row. If the constructor is given a list of
+    columns, only those (and the KEY_COLUMNS) are kept in the entry
+    dictionaries; other columns (notes, sequences) are never loaded.
     """
 
     #: identify header row if first column has this value 
@@ -103,17 +222,24 @@ class BaseIndex(object):
 
     _header0 = HEADER_FIRST_VALUE.lower()
 
-    def __init__(self, plateformat=plates.PlateFormat(96),
-                 relaxedId=True):
+    #: columns that are always kept
+    KEY_COLUMNS = ('id', 'sub-id', 'plate', 'pos')
+
+    def __init__(self, plateformat=None, relaxedId=True, columns=None):
         """
         @param plateformat: plates.PlateFormat, default microplate format
+                            [PlateFormat(96)]
         @param relaxedId: bool, fall back to matching by main ID only if sub-ID 
                           is not given, for example:
                               parts['Bba001'] may return parts['Bba001#a']
+        @param columns: [str], additional table columns to keep, e.g.
+                        ['volume']; None keeps all columns [None]
         """
+        self.columns = columns
         self._params = {}
         self._index = {}
-        self._plates = {'default': plateformat}
+        self._mainindex = {}  ## main ID -> [index keys], in order of addition
+        self._plates = {'default': plateformat or plates.PlateFormat(96)}
 
         self.relaxedId = relaxedId
 
@@ -197,7 +323,8 @@ class BaseIndex(object):
         if not type(ids) in [list, tuple]:
             ids = [ids]
 
-        ids = [str(self.intfloat2int(x)).lower().strip() for x in ids]
+        ids = [(x if type(x) is str else str(self.intfloat2int(x))
+                ).lower().strip() for x in ids]
         ids = [x for x in ids if x]  ## filter out empty strings but not '0'
         if len(ids) > 1:
             return '#'.join(ids)
@@ -208,43 +335,246 @@ class BaseIndex(object):
             return True
         return False
 
-    def readExcel(self, fname):
+    def usedColumns(self):
+        """
+        @return [str] | None, lower case names of the table columns kept in
+                entries, None for all columns
+        """
+        if self.columns is None:
+            return None
+        r = list(self.KEY_COLUMNS)
+        r += [str(c).lower().strip() for c in self.columns if c not in r]
+        return r
+
+    def readExcel(self, fname, cache=None):
         """
         @param fname: str, excel file name including path
+        @param cache: IndexCache, re-use table content parsed in an earlier
+                      run if the file has not changed since [None]
+        @return int, number of table entries read
         @raise IOError, if file cannot be found (presumably)
         @raise IndexFileError, if header row cannot be found or interpreted
         """
-        book = X.open_workbook(F.absfile(fname))
-        sheet = book.sheets()[0]
+        if cache is not None:
+            return cache.read(self, fname)
+
+        return self.loadTable(*self.iterExcel(fname))
+
+    def parseExcel(self, fname):
+        """
+        Parse Excel table without modifying the index.
+        @param fname: str, excel file name including path
+        @return ([[any]], [dict]), rows before the table header and one
+                cleaned dictionary per table entry
+        @raise IOError, if file cannot be found (presumably)
+        @raise IndexFileError, if header row cannot be interpreted
+        """
+        preheader, entries = self.iterExcel(fname)
+        return preheader, list(entries)
+
+    def iterExcel(self, fname):
+        """
+        Start reading an Excel table. Only the first sheet is loaded; table
+        rows are parsed one at a time while the returned iterator is
+        consumed and only the columns listed by usedColumns() are kept.
+        @param fname: str, excel file name including path
+        @return ([[any]], iterator of dict), rows before the table header
+                and a generator of cleaned table entries
+        @raise IOError, if file cannot be found (presumably)
+        @raise IndexFileError, if header row cannot be interpreted
+        """
+        book = X.open_workbook(F.absfile(fname), on_demand=True)
+        sheet = book.sheet_by_index(0)
 
         try:
             row = 0
             values = []
+            preheader = []
             ## iterate until there is a row starting with HEADER_FIRST_VALUE
             ## capture any "param, <key>, <value>" entries until then
             while not self.detectHeader(values):
                 values = [v for v in sheet.row_values(row) if v]
-                self.parsePreHeader(values)
+                preheader.append(values)
                 row += 1
 
             ## parse table "header"
             keys = self.parseHeader(values)
 
-            i = 0
-            for row in range(row, sheet.nrows):
-                values = sheet.row_values(row)
+        except IndexError as why:
+            book.release_resources()
+            raise IndexError('Invalid Index file (could not find header).')
+        except:
+            book.release_resources()
+            raise
+
+        used = self.usedColumns()
+        columns = [(i, k) for i, k in enumerate(keys)
+                   if used is None or k in used]
+
+        rows = self._iterRows(book, sheet, row, columns)
+        next(rows)
+        return preheader[:-1], rows
 
+    def _iterRows(self, book, sheet, first, columns):
+        """
+        generate cleaned entries from table rows (see iterExcel); the
+        generator is primed by iterExcel with one empty step so that
+        close() releases the workbook even before the first entry is read
+        """
+        try:
+            yield
+            for row in range(first, sheet.nrows):
                 ## ignore rows with empty first column
-                if values[0]:
-                    d = dict(zip(keys, values))
+                if sheet.cell_value(row, 0):
+                    d = dict((k, sheet.cell_value(row, i))
+                             for i, k in columns)
                     self.cleanEntry(d)
-                    self.addEntry(d)
-                    i += 1
+                    yield d
+        finally:
+            book.release_resources()
 
-            return i
+    #: file name extensions read by readTable as Excel file
+    EXCEL_EXTENSIONS = ('.xls', '.xlsx')
 
-        except IndexError as why:
-            raise IndexError('Invalid Index file (could not find header).')
+    def readTable(self, fname, cache=None, delimiter=None):
+        """
+        Read Excel or CSV table, depending on the file name extension.
+        @param fname: str, file name, '-' for standard input (CSV)
+        @param cache: IndexCache, cache for parsed Excel files [None]
+        @param delimiter: str, CSV column delimiter (see readCSV) [None]
+        @return int, number of table entries read
+        """
+        if os.path.splitext(str(fname))[1].lower() in self.EXCEL_EXTENSIONS:
+            return self.readExcel(fname, cache=cache)
+        return self.readCSV(fname, delimiter=delimiter)
+
+    def readCSV(self, source, delimiter=None):
+        """
+        Read table from comma or tab separated text with the same layout as
+        Excel tables (see readExcel).
+        @param source: str | file, file name, '-' for standard input, or
+                       open text file / pipe
+        @param delimiter: str, column delimiter [tab for .tsv and .txt
+                          files, else comma]
+        @return int, number of table entries read
+        @raise IndexFileError, if header row cannot be interpreted
+        """
+        return self.loadTable(*self.iterCSV(source, delimiter=delimiter))
+
+    #: plain decimal numbers (no 'nan', 'inf' or exponents)
+    ex_number = re.compile(r'^\s*[+-]?(\d+\.?\d*|\.\d+)\s*$')
+
+    @classmethod
+    def _number(cls, x):
+        """convert numeric strings to float (as xlrd does for number cells)"""
+        if cls.ex_number.match(x):
+            return float(x)
+        return x
+
+    def iterCSV(self, source, delimiter=None):
+        """
+        Start reading a CSV table (see iterExcel).
+        @param source: str | file, file name, '-' for standard input, or
+                       open text file / pipe
+        @param delimiter: str, column delimiter (see readCSV) [None]
+        @return ([[any]], iterator of dict), rows before the table header
+                and a generator of cleaned table entries
+        @raise IndexFileError, if header row cannot be interpreted
+        """
+        if source == '-':
+            f, close = sys.stdin, False
+        elif isinstance(source, str):
+            f, close = open(F.absfile(source), newline=''), True
+        else:
+            f, close = source, False
+
+        if delimiter is None:
+            name = source if isinstance(source, str) else ''
+            delimiter = '\t' if name.lower().endswith(('.tsv', '.txt')) \
+                else ','
+
+        reader = csv.reader(f, delimiter=delimiter)
+
+        values = []
+        preheader = []
+        for row in reader:
+            values = [self._number(v) for v in row if v.strip()]
+            if self.detectHeader(values):
+                break
+            preheader.append(values)
+        else:
+            if close:
+                f.close()
+            raise IndexFileError('Invalid Index file (could not find header).')
+
+        try:
+            keys = self.parseHeader(values)
+        except:
+            if close:
+                f.close()
+            raise
+
+        used = self.usedColumns()
+        columns = [(i, k) for i, k in enumerate(keys)
+                   if used is None or k in used]
+
+        rows = self._iterCSVRows(reader, f if close else None, columns,
+                                 len(keys))
+        next(rows)
+        return preheader, rows
+
+    def _iterCSVRows(self, reader, f, columns, width):
+        """
+        generate cleaned entries from CSV rows (see iterCSV); numbers are
+        converted like xlrd number cells and then cleaned like Excel values,
+        e.g. '12.0' => '12'. Primed like _iterRows.
+        """
+        number = self._number
+        try:
+            yield
+            for row in reader:
+                ## ignore rows with empty first column
+                if row and row[0].strip():
+                    if len(row) < width:
+                        row += [''] * (width - len(row))
+                    d = dict((k, number(row[i])) for i, k in columns)
+                    self.cleanEntry(d)
+                    yield d
+        finally:
+            if f is not None:
+                f.close()
+
+    def loadTable(self, preheader, entries):
+        """
+        Add parsed table content (see parseExcel) to the index.
+        @param preheader: [[any]], rows before the table header
+        @param entries: [dict], table entries
+        @return int, number of entries added
+        """
+        try:
+            for values in preheader:
+                self.parsePreHeader(values)
+
+            i = 0
+            for d in entries:
+                self.addEntry(d)
+                i += 1
+
+        finally:
+            self.closeEntries(entries)
+
+        return i
+
+    @staticmethod
+    def closeEntries(entries):
+        """
+        Close entry generator returned by iterExcel or iterCSV, releasing the
+        input file even if the table has not been read (completely).
+        @param entries: iterator of dict | [dict], table entries
+        """
+        close = getattr(entries, 'close', None)
+        if close is not None:
+            close()
 
     def addEntry(self, d):
         """
@@ -252,22 +582,41 @@ class BaseIndex(object):
         @param d: dict, {'id':str|int, 'sub-id':str|int, ... }
         """
         part_id = self.convertId((d['id'], d.get('sub-id', '')))
+        if type(d) is dict:
+            d = IndexEntry.fromDict(d)
+        self._addKey(part_id)
         self._index[part_id] = d
 
+    def _addKey(self, key):
+        """register new index key in main ID index (for relaxed lookups)"""
+        if key not in self._index:
+            self._mainindex.setdefault(key.split('#')[0], []).append(key)
+
+    def _reindex(self):
+        """rebuild main ID index after replacing self._index"""
+        self._mainindex = {}
+        for key in self._index:
+            self._mainindex.setdefault(key.split('#')[0], []).append(key)
+
     def __getitem__(self, item):
         """
         PartIndex[partID] -> [ {'plate':str, 'pos':str, 'barcode':str } ]
         @raise KeyError, if given ID doesn't match any registered part
         """
-        try:
-            id = self.convertId(item)
-            return self._index[id]
-        except KeyError:
-            if self.relaxedId:
-                for key, value in self._index.items():
-                    if key.split('#')[0] == id:
-                        return value
-                raise
+        return self._index[self._key(item)]
+
+    def _key(self, item):
+        """
+        @return str, index key matching ID or (ID, sub-ID)
+        @raise KeyError, if given ID doesn't match any registered part
+        """
+        id = self.convertId(item)
+        if id in self._index:
+            return id
+        if self.relaxedId and id in self._mainindex:
+            ## first key registered for this main ID
+            return self._mainindex[id][0]
+        raise KeyError(id)
 
     def __len__(self):
         """len(PickList) -> int, number of samples to pick"""
@@ -315,8 +664,40 @@ class PartIndex(BaseIndex):
     
     The filterByPlate() method returns a new PartIndex containing only 
     entries from a given plate.
+
+    Entries are additionally indexed by plate and well so that plate
+    filters and the entryAt() query ("what is in plate X, well Y") do not
+    need to scan the whole index.
     """
 
+    def __init__(self, plateformat=None, relaxedId=True, columns=None):
+        super(PartIndex, self).__init__(plateformat=plateformat,
+                                        relaxedId=relaxedId, columns=columns)
+        self._plateindex = {}  ## plate -> {part key -> [entries]}
+        self._wellindex = {}  ## (plate, position) -> first entry
+
+    @staticmethod
+    def _wellkey(plate, pos):
+        return plate, sys.intern(str(pos).strip().upper())
+
+    def _addToPlate(self, part_id, d):
+        """register entry in plate and well index"""
+        plate = d.get('plate', '')
+        parts = self._plateindex.get(plate)
+        if parts is None:
+            parts = self._plateindex[plate] = collections.OrderedDict()
+        parts.setdefault(part_id, []).append(d)
+        self._wellindex.setdefault(self._wellkey(plate, d.get('pos', '')), d)
+
+    def _reindex(self):
+        """rebuild all secondary indices after replacing self._index"""
+        super(PartIndex, self)._reindex()
+        self._plateindex = {}
+        self._wellindex = {}
+        for key, entries in self._index.items():
+            for d in entries:
+                self._addToPlate(key, d)
+
     def addEntry(self, d):
         """
         Add new entry to part index.
@@ -324,11 +705,60 @@ class PartIndex(BaseIndex):
                          'position':str|int, 'barcode':str|int }
         """
         part_id = self.convertId((d['id'], d['sub-id']))
+        if type(d) is dict:
+            d = IndexEntry.fromDict(d)
 
         if not part_id in self._index:
+            self._addKey(part_id)
             self._index[part_id] = []
 
         self._index[part_id] += [d]
+        self._addToPlate(part_id, d)
+
+    def readMany(self, files, workers=None):
+        """
+        Read several Excel files, parsing them in parallel processes. The
+        result is the same as calling readExcel for each file in the given
+        order (later 'param' values take precedence) except that
+        conflicting plate format declarations in different files (or in a
+        file and the index itself) are an error.
+
+        Note: on Windows, worker processes re-import the main module, so
+        scripts calling readMany with several workers need an
+        "if __name__ == '__main__':" guard.
+        @param files: [str], excel file names
+        @param workers: int, number of processes [number of CPUs]
+        @return int, number of table entries read
+        @raise IndexFileError, if files declare different formats for the
+               same plate
+        """
+        files = [F.absfile(f) for f in files]
+        workers = min(workers or os.cpu_count() or 1, len(files))
+
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                n = len(files)
+                tables = list(pool.map(_parseExcel, [type(self)] * n,
+                                       [self.columns] * n, files))
+        else:
+            tables = [self.parseExcel(f) for f in files]
+
+        declared = dict((k, ('index', v)) for k, v in self._plates.items()
+                        if k != 'default')
+        for fname, (preheader, entries) in zip(files, tables):
+            for values in preheader:
+                for plate, f in self.parsePlateformat(values).items():
+                    ## within one file, the last declaration wins (as in
+                    ## readExcel); only different sources can conflict
+                    source, other = declared.get(plate, (fname, f))
+                    declared[plate] = (fname, f)
+                    if other is not f and source != fname:
+                        raise IndexFileError(
+                            'conflicting formats for plate %s: %i wells '
+                            '(%s) and %i wells (%s)'
+                            % (plate, other.n, source, f.n, fname))
+
+        return sum(self.loadTable(*table) for table in tables)
 
     def __len__(self):
         """len(partindex) -> int, number of registered positions"""
@@ -348,16 +778,22 @@ class PartIndex(BaseIndex):
         if default is not None and not id in self._index:
             return default
 
-        r = self[id]
+        key = self._key(id)
 
         if plate:
             if not type(plate) in [list, tuple]:
                 plate = [plate]
             plate = [self.clean2str(x) for x in plate]
 
-            for d in r:
-                if d['plate'] in plate:
-                    return d['plate'], d['pos']
+            if len(plate) == 1:
+                r = self._plateindex.get(plate[0], {}).get(key)
+                if r:
+                    return r[0]['plate'], r[0]['pos']
+            else:
+                plate = set(plate)
+                for d in self._index[key]:
+                    if d['plate'] in plate:
+                        return d['plate'], d['pos']
 
             if default:
                 return default
@@ -365,8 +801,35 @@ class PartIndex(BaseIndex):
             raise KeyError('no entry found for ID %s in plate(s) %r'
                            % (id, plate))
 
+        r = self._index[key]
         return r[0]['plate'], r[0]['pos']
 
+    def entryAt(self, plate, pos, default=None):
+        """
+        Look up which part is stored in a given well.
+        @param plate: str, plate ID
+        @param pos: str | int, well position, e.g. 'A1' or 1
+        @param default: optional default return value
+        @return dict, (first) entry registered for this well
+        @raise KeyError, if there is no such entry and no default is given
+        """
+        plate = self.clean2str(plate)
+        r = self._wellindex.get(self._wellkey(plate, pos))
+
+        if r is None and isinstance(pos, int):  ## table may use 'A1' style
+            pos = self.plateFormat(plate).int2human(pos)
+            r = self._wellindex.get(self._wellkey(plate, pos))
+
+        r = default if r is None else r
+        if r is None:
+            raise KeyError('no entry found in plate %s, well %s'
+                           % (plate, pos))
+        return r
+
+    def plateIDs(self):
+        """@return [str], IDs of all plates with entries"""
+        return list(self._plateindex.keys())
+
     def filterByPlate(self, plateID):
         """
         @return PartIndex, sub-index of all partIDs assigned to given plate
@@ -374,18 +837,178 @@ class PartIndex(BaseIndex):
         plateID = self.clean2str(plateID)
 
         r = {}
-        for key, entries in self._index.items():
-            entries = [e for e in entries if e['plate'] == plateID]
-            if entries:
-                r[key] = entries
+        for key, entries in self._plateindex.get(plateID, {}).items():
+            r[key] = list(entries)
 
-        p = PartIndex()
+        p = PartIndex(relaxedId=self.relaxedId, columns=self.columns)
         p._index = r
+        p._reindex()
         p._params = copy.copy(self._params)
+        p._plates = copy.copy(self._plates)
+
+        ## keep first-match order of relaxed lookups
+        for main, keys in p._mainindex.items():
+            if len(keys) > 1:
+                keys.sort(key=self._mainindex[main].index)
 
         return p
 
 
+def _parseExcel(cls, columns, fname):
+    """parse Excel file in worker process (see PartIndex.readMany)"""
+    parser = cls.__new__(cls)
+    parser.columns = columns
+    return parser.parseExcel(fname)
+
+
+class SourceAllocator(object):
+    """
+    Choose source wells for a PartIndex with several locations (replicas)
+    per part and keep track of the volume remaining in each of them.
+
+    >>> allocator = SourceAllocator(parts, defaultVolume=50, deadVolume=5)
+    >>> allocator.allocate('sb0101', volume=10)
+    ('SB10', 'A1')
+    >>> allocator.check()
+
+    The initial volume of a source well is taken from the 'volume' column of
+    the part table (if there is one and the cell is not empty), otherwise from
+    defaultVolume; None means unlimited. The dead volume can not be drawn.
+
+    Each draw goes to the well with the most volume left among all replicas
+    that hold enough liquid, plates that have been used before are preferred.
+    If no replica has enough volume left, the draw is recorded as shortage
+    (and served from the fullest well anyway). check() then raises a
+    SourceShortageError listing all affected parts and undoes all draws since
+    the last successful check -- CherryWorklist calls it before anything is
+    written to the worklist.
+    """
+
+    def __init__(self, partIndex, defaultVolume=None, deadVolume=0,
+                 volumeColumn='volume'):
+        """
+        @param partIndex: PartIndex, source locations
+        @param defaultVolume: float, initial volume of wells without volume
+                              entry, None for unlimited [None]
+        @param deadVolume: float, volume that remains in each well [0]
+        @param volumeColumn: str, header of the volume column ['volume']
+        """
+        self.parts = partIndex
+        self.defaultVolume = defaultVolume
+        self.deadVolume = deadVolume
+        self.volumeColumn = volumeColumn
+
+        self._remaining = {}  ## (plate, pos) -> volume left or None
+        self._used = set()  ## plates used so far
+        self._demand = collections.OrderedDict()  ## part -> [volume, draws]
+        self._short = set()  ## parts with insufficient volume
+        self._saved = ({}, set())
+
+    def _initial(self, d):
+        """@return float | None, usable volume of source well entry d"""
+        v = d.get(self.volumeColumn, '')
+        if v in ('', None):
+            v = self.defaultVolume
+        if v is None:
+            return None
+        try:
+            return float(v) - self.deadVolume
+        except ValueError:
+            raise IndexFileError('invalid volume %r for %s in %s:%s' %
+                                 (v, d.get('id'), d['plate'], d['pos']))
+
+    def remaining(self, plate, pos):
+        """
+        @return float | None, volume left in source well (None if unlimited)
+        @raise KeyError, if the well has not been used yet
+        """
+        return self._remaining[(self.parts.clean2str(plate),
+                                self.parts.clean2str(pos))]
+
+    def _left(self, d):
+        key = (d['plate'], d['pos'])
+        if key not in self._remaining:
+            self._remaining[key] = self._initial(d)
+        return self._remaining[key]
+
+    def allocate(self, id, subid='', volume=0):
+        """
+        Draw volume from one of the locations of a part.
+        @param id [, subid]: str, ID and optional sub-ID
+        @param volume: float, volume to draw [0]
+        @return (str, str), tuple of (plateID, position)
+        @raise KeyError, if given ID doesn't match any registered part
+        """
+        part = self.parts.convertId((id, subid))
+        entries = self.parts[part]
+        volume = volume or 0
+
+        def rank(d):
+            left = self._left(d)
+            return (d['plate'] not in self._used,
+                    -(float('inf') if left is None else left))
+
+        candidates = sorted(entries, key=rank)
+        ok = [d for d in candidates
+              if self._left(d) is None or self._left(d) >= volume - 1e-9]
+        if not ok:
+            self._short.add(part)
+            ok = sorted(candidates, key=lambda d: rank(d)[1])
+        d = ok[0]
+
+        key = (d['plate'], d['pos'])
+        if self._remaining[key] is not None:
+            self._remaining[key] -= volume
+        self._used.add(d['plate'])
+
+        demand = self._demand.setdefault(part, [0, 0])
+        demand[0] += volume
+        demand[1] += 1
+
+        return d['plate'], d['pos']
+
+    def shortages(self):
+        """
+        @return [str], description of all parts with insufficient volume
+                since the last successful check
+        """
+        r = []
+        remaining, used = self._saved
+        for part in self._demand:
+            if part not in self._short:
+                continue
+            volume, draws = self._demand[part]
+            wells = []
+            for d in self.parts[part]:
+                key = (d['plate'], d['pos'])
+                left = remaining.get(key, self._initial(d))
+                wells.append('%s:%s %g ul' % (key[0], key[1], left))
+            r.append('%s: %g ul needed in %i draws, available: %s'
+                     % (part, volume, draws, ', '.join(wells)))
+        return r
+
+    def check(self):
+        """
+        Confirm all draws since the last check.
+        @raise SourceShortageError, if any part ran out of volume; all draws
+               since the last successful check are undone
+        """
+        shortages = self.shortages()
+        if shortages:
+            self.rollback()
+            raise SourceShortageError(shortages)
+
+        self._saved = (dict(self._remaining), set(self._used))
+        self._demand.clear()
+
+    def rollback(self):
+        """undo all draws since the last successful check"""
+        self._remaining = dict(self._saved[0])
+        self._used = set(self._saved[1])
+        self._demand.clear()
+        self._short.clear()
+
+
 class TargetIndex(BaseIndex):
     """
     Index extension for a target table mapping constructs with a certain
@@ -410,12 +1033,15 @@ class TargetIndex(BaseIndex):
     "template".
     """
 
-    def __init__(self, srccolumns=None, volume=None):
+    def __init__(self, srccolumns=None, volume=None, columns=None):
         """
         @param srccolumns: [str] | [(str,str),str], list of column headers
         @param volume: int, default volume for transfer
+        @param columns: [str], table columns to keep in addition to ID,
+                        sub-ID, plate, pos and the source columns; None
+                        keeps all columns [None]
         """
-        super(TargetIndex, self).__init__()
+        super(TargetIndex, self).__init__(columns=columns)
         self._index = collections.OrderedDict()  ## replace unordered dict
 
         if srccolumns is None:
@@ -428,16 +1054,27 @@ class TargetIndex(BaseIndex):
         r = []
         for v in values:
             if type(v) in [list, tuple]:
-                r += [self._clean_headers(v)]
+                r += [tuple(self._clean_headers(v))]
             else:
                 r += [str(v).lower().strip()]
         return r
 
+    def usedColumns(self):
+        if self.columns is None:
+            return None
+        r = super(TargetIndex, self).usedColumns()
+        for col in self.source_cols:
+            r += [c for c in (col if type(col) is tuple else [col])
+                  if c not in r]
+        return r
+
     def parsePreHeader(self, values):
         super(TargetIndex, self).parsePreHeader(values)
 
         r = self.parseParam(values, keyword='volume')
-        if r and not list(r.keys())[0] in self.source_cols + ['default']:
+        ## (ID, sub-ID) columns take their volume from the ID column
+        allowed = [c[0] if type(c) is tuple else c for c in self.source_cols]
+        if r and not list(r.keys())[0] in allowed + ['default']:
             raise IndexFileError(
                 'volume definition "%s" does not match any source column'
                 % list(r.keys())[0])
@@ -446,15 +1083,162 @@ class TargetIndex(BaseIndex):
 
     def volume(self, srcol, default=None):
         """
-        @param srcol - str, source column name
+        @param srcol - str | (str, str), source column name or (ID, sub-ID)
+                       column names; the latter use the volume of the ID
+                       column
         @param default - int | float, default volume if none registered for
                          given column AND if there is no default volume for
                          the table.
         @return int | float | None, volume registered for given source column
         """
+        if type(srcol) in [list, tuple]:
+            srcol = srcol[0]
         return self._volume.get(srcol, self._volume['default']) or default
 
 
+class IndexCache(object):
+    """
+    On-disk cache of parsed index tables:
+
+    >>> cache = IndexCache()
+    >>> parts = PartIndex()
+    >>> parts.readExcel('freezer.xls', cache=cache)
+
+    The first call parses the Excel file and saves its content (the rows
+    before the table header and the cleaned table entries) as pickle file;
+    later calls load the pickle instead of opening the workbook, as long as
+    path, size, modification time and content (SHA1) of the file as well as
+    index class, header keyword and selected columns are unchanged. Cached
+    content is added to the index through parsePreHeader and addEntry
+    exactly like freshly parsed content, so parameters, plate formats and
+    volumes are restored, too.
+
+    A changed file replaces its previous cache entry. The least recently
+    used entries are removed once the cache grows beyond maxSize.
+    """
+
+    #: file name extension of cache entries
+    EXTENSION = '.pickle'
+
+    def __init__(self, folder=None, maxSize=100 * 2**20):
+        """
+        @param folder: str, cache directory
+                       [$XDG_CACHE_HOME or ~/.cache, + /evowarepy]
+        @param maxSize: int, maximum total size of the cache in bytes [100MB]
+        """
+        if folder is None:
+            folder = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                  os.path.join('~', '.cache'), 'evowarepy')
+        self.folder = F.absfile(folder)
+        self.maxSize = maxSize
+
+    def _prefix(self, fname):
+        """@return str, cache file name prefix shared by versions of fname"""
+        return hashlib.sha1(fname.encode('utf-8')).hexdigest()[:16]
+
+    def key(self, index, fname):
+        """
+        @param index: BaseIndex, index that will read the file
+        @param fname: str, absolute file name
+        @return str, cache file name for the current version of fname
+        """
+        stat = os.stat(fname)
+        h = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+
+        version = '%s|%i|%r|%s|%s.%s|%s|%r' % (
+            fname, stat.st_size, stat.st_mtime, h.hexdigest(),
+            type(index).__module__, type(index).__name__,
+            index.HEADER_FIRST_VALUE, index.usedColumns())
+        version = hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.folder, '%s-%s%s' % (
+            self._prefix(fname), version, self.EXTENSION))
+
+    def read(self, index, fname):
+        """
+        Add content of Excel file to index, from cache if possible.
+        @param index: BaseIndex
+        @param fname: str, excel file name including path
+        @return int, number of table entries read
+        """
+        fname = F.absfile(fname)
+        key = self.key(index, fname)
+
+        table = self._load(key)
+        if table is None:
+            table = index.parseExcel(fname)
+            self._save(fname, key, table)
+
+        return index.loadTable(*table)
+
+    def _load(self, key):
+        """@return ([[any]], [dict]) | None, cached table content"""
+        try:
+            with open(key, 'rb') as f:
+                r = pickle.load(f)
+            os.utime(key, None)  ## mark as recently used
+            return r
+        except (IOError, OSError):
+            return None
+        except Exception as why:
+            logging.warning('ignoring unreadable cache file %s: %r'
+                            % (key, why))
+            return None
+
+    def _save(self, fname, key, table):
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+
+            self.invalidate(fname)
+
+            tmp = '%s.%i.tmp' % (key, os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(table, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, key)
+
+            self.evict()
+
+        except (IOError, OSError) as why:
+            logging.warning('could not write index cache %s: %r' % (key, why))
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.folder, '*' + self.EXTENSION))
+
+    def invalidate(self, fname):
+        """
+        Remove all cached versions of a given file.
+        @param fname: str, excel file name including path
+        """
+        pattern = '%s-*%s' % (self._prefix(F.absfile(fname)), self.EXTENSION)
+        for f in glob.glob(os.path.join(self.folder, pattern)):
+            F.tryRemove(f)
+
+    def clear(self):
+        """Remove all cache entries"""
+        for f in self._entries():
+            F.tryRemove(f)
+
+    def size(self):
+        """@return int, total size of all cache entries in bytes"""
+        return sum(os.path.getsize(f) for f in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until cache fits into maxSize"""
+        entries = [(os.stat(f), f) for f in self._entries()]
+        entries.sort(key=lambda x: x[0].st_mtime)
+
+        total = sum(stat.st_size for stat, f in entries)
+        for stat, f in entries:
+            if total <= self.maxSize:
+                break
+            F.tryRemove(f)
+            total -= stat.st_size
+
+
 class CherryWorklist(object):
     """
     Usage:
@@ -483,31 +1267,54 @@ class CherryWorklist(object):
     the target Excel table (see TargetIndex).
     """
 
-    def __init__(self, fh, targetIndex, sourceIndex, reportErrors=False):
+    def __init__(self, fh, targetIndex, sourceIndex, reportErrors=False,
+                 allocator=None):
+        """
+        @param fh - file handle or name of output worklist (or None)
+        @param targetIndex - TargetIndex, targets to pipet into
+        @param sourceIndex - PartIndex, source locations
+        @param allocator - SourceAllocator, choose between several source
+                           locations by remaining volume; without allocator,
+                           the first location of each part is used [None]
+        """
         self.iTargets = targetIndex
         self.iParts = sourceIndex
+        self.allocator = allocator
         self.iProcessed = TargetIndex()
         self.wl = W.Worklist(fh, reportErrors=reportErrors)
+        self.report = {}
 
     def close(self):
         """close the internal worklist file handle"""
         self.wl.close()
 
-    def toWorklist(self, srccolumns=[], volume=None, byLabel=False):
+    def estimate(self, model=None):
         """
-        @param srccolumns - [str], source columns to be processed [all]
-        @param volume - int, transfer volume if none is specified in table [None]
-        @param byLabel - bool, use labware labels as IDs rather than 
-                         ID/barcode [False]
+        Predict the execution time of the worklist generated so far.
+        @param model - costmodel.CostModel, cost model [default CostModel()]
+        @return costmodel.Estimate, total seconds with breakdown per source
+                column (worklist comment) and cost category
         """
-        srccolumns = [s.strip() for s in
-                      srccolumns] or self.iTargets.source_cols
+        return (model or costmodel.CostModel()).estimate(self.wl)
+
+    def resolve(self, srccolumns=[], volume=None):
+        """
+        Look up source and target locations of all transfers.
+        @param srccolumns - [str | (str, str)], source columns or (ID, sub-ID)
+                            column pairs to be processed [all]
+        @param volume - int, transfer volume if none is given in table [None]
+        @return [optimize.Transfer], one transfer per target and source column,
+                grouped by source column and in the order of the target table
+        @raise IndexFileError, if a well position can not be interpreted
+        @raise SourceShortageError, if the allocator runs out of volume
+        """
+        srccolumns = self.iTargets._clean_headers(srccolumns) or \
+            self.iTargets.source_cols
+        r = []
 
         for col in srccolumns:
             V = self.iTargets.volume(col, volume)
 
-            self.wl.comment('Processing source column %s' % col)
-
             for target, d in self.iTargets.items():
 
                 try:
@@ -515,20 +1322,215 @@ class CherryWorklist(object):
 
                     if type(col) in [tuple, list]:
                         src_id = [d[s] for s in col]
-                    src_id = d[col]
+                    else:
+                        src_id = [d[col]]
+
+                    if not src_id[0]:
+                        continue
 
-                    if src_id:
-                        src_plate, src_pos = self.iParts.position(src_id)
+                    if self.allocator:
+                        src_plate, src_pos = self.allocator.allocate(
+                            *src_id, volume=V)
+                    else:
+                        src_plate, src_pos = self.iParts.position(*src_id)
 
-                        dst_format = self.iTargets.plateFormat(dst_plate)
-                        src_format = self.iParts.plateFormat(src_plate)
+                    dst_format = self.iTargets.plateFormat(dst_plate)
+                    src_format = self.iParts.plateFormat(src_plate)
 
-                        dst_pos = dst_format.human2int(dst_pos)
-                        src_pos = src_format.human2int(src_pos)
+                    dst_pos = dst_format.human2int(dst_pos)
+                    src_pos = src_format.human2int(src_pos)
 
-                        self.wl.transfer(src_plate, src_pos, dst_plate, dst_pos,
-                                         V, byLabel=byLabel)
+                    r.append(O.Transfer(src_plate, src_pos, dst_plate,
+                                        dst_pos, V, column=col,
+                                        target=target))
                 except plates.PlateError as why:
+                    if self.allocator:
+                        self.allocator.rollback()
                     raise IndexFileError(
                         'Error processing target record "%s":\n%s'
                         % (target, why))
+                except KeyError:
+                    if self.allocator:
+                        self.allocator.rollback()
+                    raise
+
+        if self.allocator:
+            self.allocator.check()
+        return r
+
+    def toWorklist(self, srccolumns=[], volume=None, byLabel=False,
+                   optimize=False, phases=None, channels=1, tipVolume=None,
+                   distribute=False, maxPlates=None, fixedPlates=()):
+        """
+        @param srccolumns - [str | (str, str)], source columns or (ID, sub-ID)
+                            column pairs to be processed [all]
+        @param volume - int, transfer volume if none is given in table [None]
+        @param byLabel - bool, use labware labels as IDs rather than 
+                         ID/barcode [False]
+        @param optimize - bool, reorder transfers to minimize plate changes
+                          (see optimize.reorder) [False]
+        @param phases - [[str]], with optimize: groups of source columns that
+                        need to be completed one after the other [None]
+        @param channels - int, number of channels of the pipetting arm; with
+                          channels > 1, transfers between matching rows are
+                          pipetted in parallel (see optimize.batchTips) [1]
+        @param tipVolume - int, if given, combine transfers from the same
+                           source well into multi-dispense steps with at most
+                           this volume per aspiration (see
+                           Worklist.transferMulti); can not be combined with
+                           channels > 1 [None]
+        @param distribute - bool | dict, replace transfers from one source
+                            well into a range of destination wells by a
+                            reagent distribution command; a dict is passed
+                            on as options to optimize.distributeRuns, e.g.
+                            {'nMultiDisp': 4}; remaining transfers are
+                            processed as usual [False]
+        @param maxPlates - int, number of source plates that fit on the deck;
+                           if given, the work is split into batches that
+                           each use at most maxPlates source plates (see
+                           optimize.deckBatches); batches are separated by
+                           a break command (B;) and start with a comment
+                           listing the plates to load [None]
+        @param fixedPlates - [str], source plates that stay on the deck for
+                             all batches and count towards maxPlates [()]
+        @raise optimize.DeckError, if a target needs more source plates than
+               there is space on the deck
+
+        With optimize=True, the number of source and destination plate changes
+        before and after reordering is recorded in self.report. With
+        channels > 1, the number of transfers and of (parallel) pipetting
+        steps is recorded in self.report['tip batches']. With tipVolume, the
+        number of aspirations with and without multi-dispensing is recorded in
+        self.report['aspirations']. With distribute, the number of worklist
+        lines and the estimated duration (in seconds) with and without R
+        commands are recorded in self.report['lines'] and
+        self.report['seconds']. With maxPlates, self.report['deck batches']
+        lists the source plates of each batch. Numbers are summed up over
+        all batches.
+        """
+        if channels > 1 and tipVolume:
+            raise W.WorklistException(
+                'multi-dispense can not be combined with parallel channels')
+
+        srccolumns = self.iTargets._clean_headers(srccolumns) or \
+            self.iTargets.source_cols
+        transfers = self.resolve(srccolumns, volume)
+        options = dict(byLabel=byLabel, optimize=optimize, phases=phases,
+                       channels=channels, tipVolume=tipVolume,
+                       distribute=distribute)
+
+        if not maxPlates:
+            self._writeTransfers(transfers, srccolumns, **options)
+            return
+
+        batches = O.deckBatches(transfers, maxPlates, fixedPlates)
+        self.report['deck batches'] = [b.plates for b in batches]
+
+        for i, batch in enumerate(batches):
+            if i:
+                self.wl.B()
+            self.wl.comment('Batch %i of %i: load source plates %s'
+                            % (i + 1, len(batches), ', '.join(batch.plates)))
+            self._writeTransfers(batch.transfers, srccolumns, **options)
+
+    def _count(self, key, before, after):
+        """add before / after numbers to self.report[key]"""
+        old = self.report.get(key, (0, 0))
+        self.report[key] = (old[0] + before, old[1] + after)
+
+    def _writeTransfers(self, transfers, srccolumns, byLabel, optimize,
+                        phases, channels, tipVolume, distribute):
+        """write transfers to worklist, see toWorklist"""
+        if not optimize:
+            groups = [(col, [t for t in transfers if t.column == col])
+                      for col in srccolumns]
+        else:
+            before = O.labwareSwitches(transfers)
+            transfers = O.reorder(transfers, phases)
+            after = O.labwareSwitches(transfers)
+            self._count('labware switches', before, after)
+            logging.info('reordering changed labware switches from %i to %i',
+                         before, after)
+
+            groups = []
+            for group in O.splitPhases(transfers, phases):
+                columns = []
+                for t in group:
+                    if t.column not in columns:
+                        columns.append(t.column)
+                groups.append((', '.join(map(str, columns)), group))
+
+        if distribute:
+            options = distribute if isinstance(distribute, dict) else {}
+            compiled = [(col, O.distributeRuns(group, **options))
+                        for col, group in groups]
+            items = [t for col, group in compiled for t in group]
+            self._count('lines', O.lineCount(transfers), O.lineCount(items))
+            self._count('seconds', O.estimateSeconds(transfers),
+                        O.estimateSeconds(items))
+        else:
+            compiled = groups
+
+        ## R commands stay as they are and where they are; the transfers
+        ## between them are processed run by run
+        groups = []
+        for col, group in compiled:
+            segments = []
+            for t in group:
+                if not isinstance(t, O.Transfer):
+                    segments.append(t)
+                elif segments and isinstance(segments[-1], list):
+                    segments[-1].append(t)
+                else:
+                    segments.append([t])
+            groups.append((col, segments))
+
+        remaining = [t for col, segments in groups for seg in segments
+                     if isinstance(seg, list) for t in seg]
+
+        if channels > 1:
+            formats = {}
+            for t in remaining:
+                formats[t.srcID] = self.iParts.plateFormat(t.srcID)
+                formats[t.dstID] = self.iTargets.plateFormat(t.dstID)
+
+            groups = [(col, [O.batchTips(seg, formats, channels)
+                             if isinstance(seg, list) else seg
+                             for seg in segments])
+                      for col, segments in groups]
+            self._count('tip batches', len(remaining),
+                        sum(len(seg) for col, segments in groups
+                            for seg in segments if isinstance(seg, list)))
+
+        if tipVolume:
+            groups = [(col, [O.multiDispense(seg)
+                             if isinstance(seg, list) else seg
+                             for seg in segments])
+                      for col, segments in groups]
+            aspirations = 0
+
+        for col, segments in groups:
+            self.wl.comment('Processing source column %s' % (col,))
+
+            for seg in segments:
+                if not isinstance(seg, list):
+                    self.wl.distribute(**seg._asdict())
+                    continue
+
+                for t in seg:
+                    if channels > 1:  ## t is a batch of parallel transfers
+                        self.wl.transferBatch(t)
+                    elif tipVolume:  ## t is a group of transfers from a well
+                        aspirations += self.wl.transferMulti(t, tipVolume)
+                    else:
+                        self.wl.transfer(t.srcID, t.srcPos, t.dstID,
+                                         t.dstPos, t.volume,
+                                         liquidClass=t.liquidClass,
+                                         byLabel=byLabel)
+
+        if tipVolume:
+            self._count('aspirations',
+                        sum(len(t) for col, segments in groups
+                            for seg in segments if isinstance(seg, list)
+                            for t in seg),
+                        aspirations)
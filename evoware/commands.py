@@ -0,0 +1,548 @@
+##  evoware/py -- python modules for Evoware scripting
+##   Copyright 2014 Raik Gruenberg
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+
+"""Columnar (numpy) storage of Evoware worklist commands"""
+
+import collections
+import numbers
+import operator
+
+import numpy as np
+
+#: worklist command codes, stored as ASCII code of the command letter
+OP_TEXT = 0  ## custom line without further interpretation
+OP_A = ord('A')
+OP_D = ord('D')
+OP_W = ord('W')
+OP_F = ord('F')
+OP_B = ord('B')
+OP_C = ord('C')
+OP_R = ord('R')
+
+#: one record per worklist line; string fields are indices into
+#: CommandBuffer.strings (0 == empty string)
+CMD_DTYPE = np.dtype([('op', 'u1'),
+                      ('label', 'i4'),
+                      ('rackid', 'i4'),
+                      ('racktype', 'i4'),
+                      ('pos', 'i4'),
+                      ('tube', 'i4'),
+                      ('volume', 'f8'),
+                      ('intvol', '?'),  ## volume was given as integer
+                      ('f4vol', '?'),  ## volume was given as numpy.float32
+                      ('liquid', 'i4'),
+                      ('tipmask', 'i4'),  ## -1 == no tip mask
+                      ('text', 'i4')])  ## raw line (C, R, custom), 0 == none
+
+
+class CommandBuffer(object):
+    """
+    Growable, columnar store of worklist commands. Each command occupies one
+    record of a numpy structured array (see CMD_DTYPE); labware labels,
+    IDs, liquid classes and other strings are interned into a shared string
+    table and only referenced by index. Rendering into GWL text happens in
+    one bulk pass over the whole array (or slices of it).
+
+    Usage:
+
+    >>> cb = CommandBuffer()
+    >>> cb.transfer(OP_A, 'src1', '', '', 1, '', 25, 'Water')
+    >>> cb.transfer(OP_D, 'dst1', '', '', 96, '', 25, 'Water')
+    >>> cb.command(OP_W)
+    >>> cb.render()
+    'A;src1;;;1;;25;Water\\nD;dst1;;;96;;25;Water\\nW;\\n'
+
+    New commands are staged in a short Python list and moved into the
+    pre-allocated numpy array in blocks, which keeps the cost per appended
+    command low. The records are available (read-only by convention) as:
+
+    >>> cb.records['pos']
+    array([ 1, 96,  0], dtype=int32)
+    """
+
+    #: number of staged commands that are moved into the array at once
+    BLOCKSIZE = 4096
+
+    def __init__(self, capacity=1024):
+        """
+        @param capacity: int, initial number of pre-allocated records
+        """
+        self._data = np.zeros(capacity, CMD_DTYPE)
+        self._n = 0
+        self._staged = []
+        self.strings = ['']
+        self._stringindex = {'': 0}
+
+    def intern(self, s):
+        """
+        @param s: str, any string value
+        @return int, index of s in the string table
+        """
+        if type(s) is not str:
+            s = str(s)
+        r = self._stringindex.get(s)
+        if r is None:
+            r = self._stringindex[s] = len(self.strings)
+            self.strings.append(s)
+        return r
+
+    def _reserve(self, n=1):
+        """make room for n more records"""
+        if self._n + n > len(self._data):
+            capacity = max(2 * len(self._data), self._n + n)
+            data = np.zeros(capacity, CMD_DTYPE)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def _commit(self):
+        """move staged commands into record array"""
+        if self._staged:
+            n = len(self._staged)
+            self._reserve(n)
+            self._data[self._n:self._n + n] = self._staged
+            self._n += n
+            self._staged = []
+
+    def _stage(self, record):
+        """queue one record, committing full blocks to the array"""
+        self._staged.append(record)
+        if len(self._staged) >= self.BLOCKSIZE:
+            self._commit()
+
+    def transfer(self, op, rackLabel='', rackID='', rackType='', position=1,
+                 tubeID='', volume=0, liquidClass='', tipMask=None, text=''):
+        """
+        Append aspirate (OP_A) or dispense (OP_D) command.
+        @param text: str, original line to render instead of the fields ['']
+        """
+        if type(volume) is int:
+            intvol, f4vol = True, False
+        elif type(volume) is float:
+            intvol, f4vol = False, False
+        else:
+            value, intvol, f4vol, exact = volumeType(volume)
+            if not exact and not text:  ## keep str(volume) as text mode does
+                cmd = (Aspirate if op == OP_A else Dispense)(
+                    rackLabel, rackID, rackType, position, tubeID, volume,
+                    liquidClass, tipMask)
+                text = str(cmd)
+            volume = value
+
+        tipMask = -1 if tipMask is None else tipMask
+        index = self._stringindex
+
+        try:  ## fast path for strings that are already known
+            r = (op, index[rackLabel], index[rackID], index[rackType],
+                 position, index[tubeID], volume, intvol, f4vol,
+                 index[liquidClass], tipMask, index[text])
+        except (KeyError, TypeError):
+            intern = self.intern
+            r = (op, intern(rackLabel), intern(rackID), intern(rackType),
+                 position, intern(tubeID), volume, intvol, f4vol,
+                 intern(liquidClass), tipMask, intern(text))
+
+        self._stage(r)
+
+    def command(self, op, text=''):
+        """
+        Append command without transfer fields (W, F, B) or a text line that
+        is rendered as is (C, R, custom lines).
+        """
+        self._stage((op, 0, 0, 0, 0, 0, 0., False, False, 0, -1,
+                     self.intern(text) if text else 0))
+
+    def _record(self, cmd, line=None):
+        """@return tuple, record for typed command (see append)"""
+        line = line or str(cmd)
+        intern = self.intern
+
+        if cmd.op in (OP_A, OP_D):
+            volume, intvol, f4vol, exact = volumeType(cmd.volume)
+            return (cmd.op, intern(cmd.rackLabel), intern(cmd.rackID),
+                    intern(cmd.rackType), cmd.position, intern(cmd.tubeID),
+                    volume, intvol, f4vol, intern(cmd.liquidClass),
+                    -1 if cmd.tipMask is None else cmd.tipMask,
+                    0 if exact and line == str(cmd) else intern(line))
+
+        if cmd.op in (OP_W, OP_F, OP_B) and line == chr(cmd.op) + ';':
+            line = ''
+
+        return (cmd.op, 0, 0, 0, 0, 0, 0., False, False, 0, -1,
+                intern(line))
+
+    def append(self, cmd, line=None):
+        """
+        Append typed command (Aspirate, Dispense, Wash, ..., see parseLine).
+        @param cmd: Aspirate | Dispense | Distribute | Wash | Flush | Break |
+                    Comment | Line
+        @param line: str, original worklist line; kept for rendering if it
+                     differs from the canonical form of cmd [None]
+        """
+        self._stage(self._record(cmd, line))
+
+    def internArray(self, values):
+        """
+        @param values: [str], many (typically repetitive) strings
+        @return numpy.ndarray of int, string table indices of values
+        """
+        index = self._stringindex
+        intern = self.intern
+        return np.array([index[x] if x in index else intern(x)
+                         for x in values], int)
+
+    def extendLines(self, lines):
+        """
+        Parse and append many worklist lines in one go. The common A / D / W
+        / F / B records are converted column-wise; only other lines are
+        parsed one by one with parseLine. Empty lines are skipped.
+        @param lines: [str], worklist lines without line breaks
+        @return int, number of records added
+        @raise ValueError, if an A, D or R line has invalid or missing fields;
+               the message starts with the (1-based) index of the line
+        """
+        lines = list(lines)
+        n = len(lines)
+
+        length = np.fromiter(map(len, lines), int, n)
+        nfields = np.fromiter(map(operator.methodcaller('count', ';'), lines),
+                              int, n) + 1
+        head = np.array([l[:2] for l in lines])
+        keep = np.fromiter(map(bool, map(str.strip, lines)), bool, n)
+
+        r = np.zeros(n, CMD_DTYPE)
+        r['tipmask'] = -1
+
+        simple = (length == 2) & np.isin(head, ['W;', 'F;', 'B;'])
+        r['op'][simple] = [ord(x[0]) for x in head[simple]]
+
+        other = keep & ~simple
+        transfer = (head == 'A;') | (head == 'D;')
+
+        for nf in (8, 9):
+            index = np.flatnonzero(transfer & (nfields == nf))
+            try:
+                self._transferColumns(r, index, nf, lines)
+                other[index] = False
+            except ValueError:
+                pass  ## fall back to line by line parsing for details
+
+        for i in np.flatnonzero(other):
+            try:
+                r[i] = self._record(parseLine(lines[i]), lines[i])
+            except ValueError as why:
+                raise ValueError('%i: %s' % (i + 1, why))
+
+        self.extend(r[keep])
+        return int(keep.sum())
+
+    def _transferColumns(self, r, index, nfields, lines):
+        """
+        Convert A / D lines with the same number of fields column-wise into
+        records r[index]. All lines are split in one go.
+        @raise ValueError, if any position, volume or tip mask is invalid
+        """
+        n = len(index)
+        if not n:
+            return
+
+        items = ';'.join([lines[i] for i in index]).split(';')
+        columns = [items[k::nfields] for k in range(nfields)]
+
+        position = np.fromiter(map(int, columns[4]), int, n)
+        volume = np.fromiter(map(float, columns[6]), float, n)
+        intvol = np.fromiter(map(str.isdigit, columns[6]), bool, n)
+
+        ## lines that would not render back identically keep their text
+        vol = [str(int(v)) if i else str(v)
+               for v, i in zip(volume.tolist(), intvol.tolist())]
+        canonical = np.fromiter(map(operator.eq, vol, columns[6]), bool, n)
+        canonical &= np.fromiter(map(operator.eq, map(str, position.tolist()),
+                                     columns[4]), bool, n)
+
+        tipmask = np.full(n, -1)
+        if nfields == 9:
+            tipmask = np.fromiter(map(int, columns[8]), int, n)
+            canonical &= np.fromiter(map(operator.eq,
+                                         map(str, tipmask.tolist()),
+                                         columns[8]), bool, n)
+
+        rec = r[index]
+        rec['op'] = [ord(x) for x in columns[0]]
+        rec['label'] = self.internArray(columns[1])
+        rec['rackid'] = self.internArray(columns[2])
+        rec['racktype'] = self.internArray(columns[3])
+        rec['pos'] = position
+        rec['tube'] = self.internArray(columns[5])
+        rec['volume'] = volume
+        rec['intvol'] = intvol
+        rec['liquid'] = self.internArray(columns[7])
+        rec['tipmask'] = tipmask
+        rec['text'][~canonical] = [self.intern(lines[i])
+                                   for i in index[~canonical]]
+        r[index] = rec
+
+    def extend(self, records):
+        """
+        Append many records at once.
+        @param records: numpy.ndarray of CMD_DTYPE, referencing this buffer's
+                        string table
+        """
+        self._commit()
+        self._reserve(len(records))
+        self._data[self._n:self._n + len(records)] = records
+        self._n += len(records)
+
+    def __len__(self):
+        return self._n + len(self._staged)
+
+    def _get_records(self):
+        self._commit()
+        return self._data[:self._n]
+
+    records = property(_get_records,
+                       doc='structured numpy array (view) of all commands')
+
+    def render(self, start=0, stop=None):
+        """
+        Render commands into worklist text.
+        @param start: int, first record to render [0]
+        @param stop: int, end of record range [all]
+        @return str, worklist lines including trailing line break
+        """
+        rec = self.records[start:stop]
+        if not len(rec):
+            return ''
+
+        strings = np.array(self.strings, dtype=object)
+        lines = np.full(len(rec), '', dtype=object)
+
+        op = rec['op']
+        text = rec['text']
+
+        for code in (OP_W, OP_F, OP_B):
+            lines[(op == code) & (text == 0)] = chr(code) + ';'
+
+        lines[text > 0] = strings[text[text > 0]]
+
+        m = (text == 0) & ((op == OP_A) | (op == OP_D))
+        if m.any():
+            r = rec[m]
+            columns = [np.where(r['op'] == OP_A, 'A', 'D').tolist(),
+                       strings[r['label']].tolist(),
+                       strings[r['rackid']].tolist(),
+                       strings[r['racktype']].tolist(),
+                       r['pos'].tolist(),
+                       strings[r['tube']].tolist(),
+                       self._volumes(r),
+                       strings[r['liquid']].tolist(),
+                       self._tipmasks(r)]
+
+            lines[m] = ['%s;%s;%s;%s;%s;%s;%s;%s%s' % x for x in zip(*columns)]
+
+        return '\n'.join(lines.tolist()) + '\n'
+
+    def _volumes(self, r):
+        """
+        @return [int|str], volumes formatted like the original input, i.e.
+                like str(volume) in text-mode worklists
+        """
+        if r['intvol'].all():
+            return r['volume'].astype(np.int64).tolist()
+
+        return ['%i' % v if i else str(np.float32(v)) if f4 else '%s' % v
+                for v, i, f4 in zip(r['volume'].tolist(), r['intvol'].tolist(),
+                                    r['f4vol'].tolist())]
+
+    def _tipmasks(self, r):
+        """@return [str], ';<tipmask>' or empty string if there is none"""
+        t = r['tipmask']
+        if (t < 0).all():
+            return [''] * len(r)
+
+        return np.where(t < 0, '', np.char.add(';', t.astype(str))).tolist()
+
+    def chunks(self, size=10000):
+        """
+        Render all commands in chunks of size records.
+        @param size: int, number of records (lines) per chunk
+        @return generator of str
+        """
+        for start in range(0, len(self), size):
+            yield self.render(start, start + size)
+
+
+def _field(s):
+    """render field value, None as empty string"""
+    return '' if s is None else str(s)
+
+
+def volumeType(volume):
+    """
+    Classify transfer volume for columnar storage (see CMD_DTYPE). Volumes
+    are written as str(volume); CommandBuffer renders them from the stored
+    float64 value, as integer or as numpy.float32 if so flagged.
+    @param volume: int | float | numpy number
+    @return (float, bool, bool, bool) - volume, integer flag, float32 flag,
+            True if rendering from these gives back str(volume)
+    """
+    value = float(volume)
+    if isinstance(volume, numbers.Integral):
+        return value, True, False, str(volume) == '%i' % value
+    if type(volume) is np.float32:
+        return value, False, True, True
+    return value, False, False, str(volume) == '%s' % value
+
+
+class Aspirate(collections.namedtuple('Aspirate',
+                                      'rackLabel rackID rackType position '
+                                      'tubeID volume liquidClass tipMask')):
+    """aspirate command (A)"""
+    __slots__ = ()
+    op = OP_A
+
+    def __str__(self):
+        r = ';'.join([chr(self.op)] + [_field(x) for x in self[:7]])
+        if self.tipMask is not None:
+            r += ';%s' % self.tipMask
+        return r
+
+
+class Dispense(Aspirate):
+    """dispense command (D)"""
+    __slots__ = ()
+    op = OP_D
+
+
+class Distribute(collections.namedtuple(
+    'Distribute', 'srcRackLabel srcRackID srcRackType srcPosStart srcPosEnd '
+                  'dstRackLabel dstRackID dstRackType dstPosStart dstPosEnd '
+                  'volume liquidClass nDitiReuses nMultiDisp direction '
+                  'excludeWells')):
+    """reagent distribution command (R), fields as in Worklist.distribute"""
+    __slots__ = ()
+    op = OP_R
+
+    def __str__(self):
+        return ';'.join(['R'] + [_field(x) for x in self[:15]] +
+                        [str(x) for x in self.excludeWells])
+
+
+class Wash(collections.namedtuple('Wash', 'scheme')):
+    """wash / tip replacement (W;), with optional wash scheme (W1; .. W4;)"""
+    __slots__ = ()
+    op = OP_W
+
+    def __str__(self):
+        return 'W%s;' % _field(self.scheme)
+
+
+class Flush(collections.namedtuple('Flush', '')):
+    """tip flushing (F;)"""
+    __slots__ = ()
+    op = OP_F
+
+    def __str__(self):
+        return 'F;'
+
+
+class Break(collections.namedtuple('Break', '')):
+    """break command (B;)"""
+    __slots__ = ()
+    op = OP_B
+
+    def __str__(self):
+        return 'B;'
+
+
+class Comment(collections.namedtuple('Comment', 'text')):
+    """worklist comment (C;)"""
+    __slots__ = ()
+    op = OP_C
+
+    def __str__(self):
+        return 'C; %s' % self.text
+
+
+class Line(collections.namedtuple('Line', 'text')):
+    """any other worklist line, kept as is"""
+    __slots__ = ()
+    op = OP_TEXT
+
+    def __str__(self):
+        return self.text
+
+
+def _number(s):
+    """parse int or float from worklist field; empty field is 0"""
+    s = s.strip()
+    if not s:
+        return 0
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+def parseLine(line):
+    """
+    Parse a single worklist line into a typed command.
+
+    >>> parseLine('A;src1;;;12;;25;Water')
+    Aspirate(rackLabel='src1', rackID='', rackType='', position=12, \
+tubeID='', volume=25, liquidClass='Water', tipMask=None)
+    >>> str(parseLine('D;dst1;;;1;;2.5;;3'))
+    'D;dst1;;;1;;2.5;;3'
+
+    A and D lines may either carry the tip mask as 9th field (as written by
+    Worklist) or follow the full Evoware format with tip type and tip mask as
+    9th and 10th field (the tip type is not kept).
+
+    @param line: str, one worklist line without line break
+    @return Aspirate | Dispense | Distribute | Wash | Flush | Break |
+            Comment | Line
+    @raise ValueError, if an A, D or R line has invalid or missing fields
+    """
+    code = line[:1]
+    f = line.split(';')
+
+    if code in ('A', 'D') and len(f) >= 8 and len(f[0]) == 1:
+        tipMask = f[9] if len(f) >= 10 else (f[8] if len(f) == 9 else '')
+        cls = Aspirate if code == 'A' else Dispense
+        return cls(f[1], f[2], f[3], int(f[4]), f[5], _number(f[6]), f[7],
+                   int(tipMask) if tipMask.strip() else None)
+
+    if code == 'R' and len(f) >= 16 and len(f[0]) == 1:
+        return Distribute(f[1], f[2], f[3], int(f[4]), int(f[5]),
+                          f[6], f[7], f[8], int(f[9]), int(f[10]),
+                          _number(f[11]), f[12], int(f[13]), int(f[14]),
+                          int(f[15]), [int(x) for x in f[16:] if x.strip()])
+
+    if code == 'W' and len(f) == 2 and not f[1].strip() \
+            and f[0][1:] in ('', '1', '2', '3', '4'):
+        return Wash(f[0][1:])
+
+    if line.strip() == 'F;':
+        return Flush()
+
+    if line.strip() == 'B;':
+        return Break()
+
+    if code == 'C' and line[1:2] == ';':
+        return Comment(line[2:].lstrip())
+
+    if code in ('A', 'D', 'R') and line[1:2] == ';':
+        raise ValueError('invalid %s record: %r' % (code, line))
+
+    return Line(line)
@@ -0,0 +1,214 @@
+##  evoware/py -- python modules for Evoware scripting
+##   Copyright 2014 Raik Gruenberg
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+
+"""Runtime cost model and duration estimates for worklists"""
+
+import math
+
+import numpy as np
+
+from . import commands as C
+
+#: cost categories of an Estimate
+CATEGORIES = ('aspirate', 'dispense', 'wash', 'flush', 'labware switch',
+              'distribute')
+
+
+def commandBuffer(source):
+    """
+    @param source: Worklist | commands.CommandBuffer | [str] | [commands.*],
+                   worklist, worklist lines or typed commands
+    @return commands.CommandBuffer
+    """
+    if isinstance(source, C.CommandBuffer):
+        return source
+    if hasattr(source, 'commands'):  ## worklist.Worklist
+        if source.commands is not None:
+            return source.commands
+        source = str(source).splitlines()
+
+    r = C.CommandBuffer()
+    r.extendLines([x if isinstance(x, str) else str(x) for x in source])
+    return r
+
+
+class Estimate(object):
+    """
+    Predicted duration of a worklist (see CostModel.estimate).
+    total - float, seconds
+    phases - [(str, float)], seconds per worklist section; a new section
+             starts with every comment (labelled with the comment text) and
+             every break command
+    categories - {str: float}, seconds per cost category (see CATEGORIES)
+    """
+
+    def __init__(self, total, phases, categories):
+        self.total = total
+        self.phases = phases
+        self.categories = categories
+
+    def __float__(self):
+        return float(self.total)
+
+    def report(self):
+        """@return str, total duration with breakdown by section / category"""
+        r = ['total: %.1f s' % self.total]
+        r += ['  %s: %.1f s' % (label or '(start)', t)
+              for label, t in self.phases]
+        r += ['  [%s]: %.1f s' % (c, self.categories[c]) for c in CATEGORIES
+              if self.categories[c]]
+        return '\n'.join(r)
+
+
+class CostModel(object):
+    """
+    Configurable model of robot execution time:
+
+    >>> model = CostModel(wash=15, liquidClasses={'Glycerol': 2.0})
+    >>> estimate = model.estimate(worklist)
+    >>> print(estimate.report())
+
+    Costs (in seconds) are:
+    * aspirate / dispense: fixed time plus time per ul, multiplied by a
+      factor for slow liquid classes (liquidClasses)
+    * wash (W): tip change or wash; flush (F)
+    * labware switch: every time an A or D command addresses another labware
+      than the one before
+    * consecutive A (or D) commands on the same labware with disjoint tip
+      masks are done in parallel and cost as much as the slowest of them
+    * R commands are pipetted with all channels in parallel; their number of
+      aspirations and tip changes follows nMultiDisp and nDitiReuses
+
+    The estimate is vectorized (numpy) except for tip-masked and R commands.
+    It is meant as objective function for comparing the output of
+    optimization passes rather than as precise prediction.
+    """
+
+    def __init__(self, aspirate=3.0, dispense=2.5, perUl=0.01, wash=10.0,
+                 flush=3.0, labwareSwitch=1.5, channels=8, liquidClasses=None):
+        """
+        @param aspirate: float, fixed time per aspiration [3.0]
+        @param dispense: float, fixed time per dispense [2.5]
+        @param perUl: float, additional aspirate / dispense time per ul [0.01]
+        @param wash: float, time per tip wash or replacement [10.0]
+        @param flush: float, time per flush [3.0]
+        @param labwareSwitch: float, arm movement to another labware [1.5]
+        @param channels: int, number of channels used for R commands [8]
+        @param liquidClasses: {str: float}, time factor for aspirate and
+                              dispense by liquid class, default 1.0 [None]
+        """
+        self.aspirate = aspirate
+        self.dispense = dispense
+        self.perUl = perUl
+        self.wash = wash
+        self.flush = flush
+        self.labwareSwitch = labwareSwitch
+        self.channels = channels
+        self.liquidClasses = liquidClasses or {}
+
+    def _distribute(self, r):
+        """@return (aspirate, dispense, wash) time of a single R command"""
+        n = r.dstPosEnd - r.dstPosStart + 1 - len(r.excludeWells)
+        n_asp = math.ceil(n / float(max(r.nMultiDisp, 1)))
+        n_wash = math.ceil(n_asp / float(max(r.nDitiReuses, 1)))
+        factor = self.liquidClasses.get(r.liquidClass, 1.0)
+        volume = float(r.volume) * n / n_asp if n_asp else 0.
+
+        steps = lambda k: math.ceil(k / float(self.channels))
+        return (steps(n_asp) * (self.aspirate + self.perUl * volume) * factor,
+                steps(n) * (self.dispense + self.perUl * float(r.volume)) *
+                factor,
+                steps(n_wash) * self.wash)
+
+    def _parallel(self, rec, time):
+        """merge tip-masked A / D commands that run in parallel"""
+        group = None  ## [op, labware, tip mask, first, max time, last]
+        for i in np.flatnonzero(rec['tipmask'] >= 0):
+            op, mask = rec['op'][i], rec['tipmask'][i]
+            lab = rec['label'][i] or rec['rackid'][i]
+
+            if group and i == group[5] + 1 and op == group[0] \
+                    and lab == group[1] and not (mask & group[2]):
+                group[2] |= mask
+                group[4] = max(group[4], time[i])
+                group[5] = i
+                time[group[3]] = group[4]
+                time[i] = 0.
+            else:
+                group = [op, lab, mask, i, time[i], i]
+
+    def estimate(self, source):
+        """
+        @param source: Worklist | commands.CommandBuffer | [str] | [commands.*]
+        @return Estimate
+        """
+        cb = commandBuffer(source)
+        rec = cb.records
+        op = rec['op']
+        n = len(rec)
+
+        factor = np.ones(len(cb.strings))
+        for name, f in self.liquidClasses.items():
+            if name in cb.strings:
+                factor[cb.strings.index(name)] = f
+        factor = factor[rec['liquid']]
+
+        isA, isD = op == C.OP_A, op == C.OP_D
+        volume = rec['volume'] * self.perUl
+        cost = dict((c, np.zeros(n)) for c in CATEGORIES)
+
+        cost['aspirate'][isA] = ((self.aspirate + volume) * factor)[isA]
+        cost['dispense'][isD] = ((self.dispense + volume) * factor)[isD]
+        cost['wash'][op == C.OP_W] = self.wash
+        cost['flush'][op == C.OP_F] = self.flush
+
+        transfer = np.flatnonzero(isA | isD)
+        lab = np.where(rec['label'] != 0, rec['label'], rec['rackid'])[transfer]
+        switch = np.zeros(len(transfer), bool)
+        switch[1:] = lab[1:] != lab[:-1]
+        cost['labware switch'][transfer[switch]] = self.labwareSwitch
+
+        self._parallel(rec, cost['aspirate'])
+        self._parallel(rec, cost['dispense'])
+
+        for i in np.flatnonzero(op == C.OP_R):
+            r = C.parseLine(cb.strings[rec['text'][i]])
+            a, d, w = self._distribute(r)
+            cost['distribute'][i] = a + d + w
+
+        time = sum(cost.values())
+
+        ## sections start with comments and breaks
+        marker = (op == C.OP_C) | (op == C.OP_B)
+        phase = np.cumsum(marker)
+        labels = [''] + [cb.strings[rec['text'][i]][2:].strip()
+                         if op[i] == C.OP_C else 'B;'
+                         for i in np.flatnonzero(marker)]
+        seconds = np.bincount(phase, weights=time, minlength=len(labels))
+        phases = [(labels[i], float(seconds[i])) for i in range(len(labels))
+                  if i or seconds[i]]
+
+        return Estimate(float(time.sum()), phases,
+                        dict((c, float(v.sum())) for c, v in cost.items()))
+
+
+def estimate(source, **options):
+    """
+    Estimate worklist duration (see CostModel).
+    @param source: Worklist | commands.CommandBuffer | [str] | [commands.*]
+    @param options: keyword arguments for CostModel
+    @return Estimate
+    """
+    return CostModel(**options).estimate(source)
@@ -0,0 +1,644 @@
+##  evoware/py -- python modules for Evoware scripting
+##   Copyright 2014 Raik Gruenberg
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+
+"""Optimization passes over lists of resolved liquid transfers"""
+
+import collections
+
+from . import plates
+from . import commands as C
+from . import costmodel
+
+
+class Transfer(collections.namedtuple(
+    'Transfer', 'srcID srcPos dstID dstPos volume liquidClass column target')):
+    """
+    A single resolved source -> destination transfer.
+    srcID, dstID - str, plate ID or label
+    srcPos, dstPos - int, well position (Tecan numbering)
+    volume - int | float, transfer volume
+    liquidClass - str, liquid class or None for the worklist default
+    column - str, source column of the target table the transfer belongs to
+    target - str, ID of the target (reaction) record
+    """
+    __slots__ = ()
+
+    def __new__(cls, srcID, srcPos, dstID, dstPos, volume, liquidClass=None,
+                column='', target=''):
+        return super(Transfer, cls).__new__(cls, srcID, srcPos, dstID, dstPos,
+                                            volume, liquidClass, column,
+                                            target)
+
+
+def labwareSwitches(transfers):
+    """
+    Count how often the robot has to move on to a different source or
+    destination plate between consecutive transfers.
+    @param transfers: [Transfer]
+    @return int, number of source plate plus destination plate changes
+    """
+    r = 0
+    for prev, t in zip(transfers, transfers[1:]):
+        r += (prev.srcID != t.srcID) + (prev.dstID != t.dstID)
+    return r
+
+
+def splitPhases(transfers, phases):
+    """
+    Split transfers into groups of source columns.
+    @param transfers: [Transfer]
+    @param phases: [[str]], groups of source columns (see reorder) [None]
+    @return [[Transfer]], one list per (non-empty) phase, original order is
+            kept within each phase
+    """
+    if not phases:
+        return [list(transfers)]
+
+    index = {}
+    for i, cols in enumerate(phases):
+        for c in ([cols] if isinstance(cols, str) else cols):
+            index.setdefault(c, i)
+
+    r = [[] for i in range(len(phases) + 1)]
+    for t in transfers:
+        r[index.get(t.column, len(phases))].append(t)
+    return [group for group in r if group]
+
+
+def reorder(transfers, phases=None):
+    """
+    Reorder transfers so that all draws from one source plate into one
+    destination plate are done in one go, sorted by source well and then
+    destination well (repeated draws from one well become consecutive).
+    Plates are visited in order of their first appearance; if a plate was
+    already in use at the end of the previous phase, it is visited first.
+
+    By default, transfers of all source columns are freely mixed. If the
+    order of additions matters for each target (e.g. template before primers),
+    pass the source columns as consecutive phases, for example
+    phases=[['template'], ['primer1', 'primer2']].
+    All transfers of one phase are completed before the next phase starts.
+    Transfers from columns not listed in any phase form a last phase.
+
+    @param transfers: [Transfer], transfers in their original order
+    @param phases: [[str]], consecutive groups of source columns [None]
+    @return [Transfer], the same transfers in optimized order
+    """
+    r = []
+    for group in splitPhases(transfers, phases):
+        srcindex, dstindex = {}, {}
+        if r:
+            srcindex[r[-1].srcID] = -1
+            dstindex[r[-1].dstID] = -1
+        for t in group:
+            srcindex.setdefault(t.srcID, len(srcindex))
+            dstindex.setdefault(t.dstID, len(dstindex))
+
+        r += sorted(group, key=lambda t: (srcindex[t.srcID],
+                                          dstindex[t.dstID],
+                                          t.srcPos, t.dstPos))
+    return r
+
+
+def _channel(plateformat, pos, channels):
+    """
+    @return (column, offset, channel), position of the well relative to the
+            tip spacing of an n-channel arm; or None if the plate rows can
+            not be reached by several channels at once
+    """
+    ny = plateformat.ny
+    if ny < channels or ny % channels:
+        return None
+    spacing = ny // channels
+    row, col = (pos - 1) % ny, (pos - 1) // ny
+    return col, row % spacing, row // spacing
+
+
+def batchTips(transfers, plateformats=None, channels=8, phases=None):
+    """
+    Pack transfers into groups that can be pipetted in parallel by a
+    multi-channel arm. Members of one group share source and destination
+    plate, source and destination column, volume and liquid class; and each
+    of them is served by a different channel which reaches the same row
+    (in units of tip spacing) on source and destination plate. On a 96 well
+    plate, A1 -> A5 and B1 -> B5 can therefore be batched while A1 -> B5
+    can not. Channel i is selected by bit i of the tip mask (1, 2, 4, .. 128).
+    Transfers that do not fit into any group are returned as single-channel
+    batches without tip mask (default tip handling of Evoware).
+
+    Transfers are only combined within the same phase (see reorder); batches
+    are returned in the order of their first transfer.
+
+    @param transfers: [Transfer]
+    @param plateformats: {str: plates.PlateFormat}, format of each plate ID,
+                         missing plates are assumed to be 96 well [None]
+    @param channels: int, number of channels (tips) of the pipetting arm [8]
+    @param phases: [[str]], consecutive groups of source columns [None]
+    @return [[(int, Transfer)]], list of batches, each a list of
+            (tip mask, transfer) tuples; tip mask is None for single transfers
+    """
+    plateformats = plateformats or {}
+    default = plates.PlateFormat(96)
+    r = []
+
+    for group in splitPhases(transfers, phases):
+        batches = []
+        open_batches = {}
+
+        for t in group:
+            src = _channel(plateformats.get(t.srcID, default), t.srcPos,
+                           channels)
+            dst = _channel(plateformats.get(t.dstID, default), t.dstPos,
+                           channels)
+
+            if src is None or dst is None or src[2] != dst[2]:
+                batches.append({None: t})
+                continue
+
+            key = (t.srcID, src[:2], t.dstID, dst[:2], t.volume,
+                   t.liquidClass)
+            batch = open_batches.get(key)
+            if batch is None or src[2] in batch:
+                batch = open_batches[key] = {}
+                batches.append(batch)
+            batch[src[2]] = t
+
+        for batch in batches:
+            if len(batch) == 1:
+                r.append([(None, t) for t in batch.values()])
+            else:
+                r.append([(1 << i, batch[i]) for i in sorted(batch)])
+    return r
+
+
+def multiDispense(transfers, phases=None):
+    """
+    Group transfers that draw from the same source well with the same liquid
+    class so that they can be done as one aspiration followed by several
+    dispenses (see Worklist.transferMulti). Transfers are only combined
+    within the same phase (see reorder); groups are returned in the order of
+    their first transfer and keep the original order of their members.
+
+    @param transfers: [Transfer]
+    @param phases: [[str]], consecutive groups of source columns [None]
+    @return [[Transfer]], list of transfer groups sharing one source well
+    """
+    r = []
+    for group in splitPhases(transfers, phases):
+        groups = collections.OrderedDict()
+        for t in group:
+            groups.setdefault((t.srcID, t.srcPos, t.liquidClass),
+                              []).append(t)
+        r += groups.values()
+    return r
+
+
+def fromCommands(commands):
+    """
+    Recover transfers from worklist commands (see worklist.iterWorklist).
+    Aspirate, dispense and wash triples as written by Worklist.transfer are
+    converted to Transfer records; all other commands are kept as they are.
+    @param commands: [commands.Aspirate | commands.Dispense | ..]
+    @return [Transfer | commands.*]
+    """
+    commands = list(commands)
+    r = []
+    i = 0
+    while i < len(commands):
+        a, d, w = (commands[i:i + 3] + [None, None])[:3]
+
+        if a.op == C.OP_A and getattr(d, 'op', None) == C.OP_D \
+                and getattr(w, 'op', None) == C.OP_W and not w.scheme \
+                and a.volume == d.volume and a.liquidClass == d.liquidClass \
+                and not any([a.rackID, a.rackType, a.tubeID, d.rackID,
+                             d.rackType, d.tubeID]) \
+                and a.tipMask is None and d.tipMask is None:
+            r.append(Transfer(a.rackLabel, a.position, d.rackLabel,
+                              d.position, a.volume, a.liquidClass or None))
+            i += 3
+        else:
+            r.append(a)
+            i += 1
+    return r
+
+
+def toCommands(items):
+    """
+    Convert transfers back into worklist commands (inverse of fromCommands).
+    @param items: [Transfer | commands.*]
+    @return [commands.*], str() of each command is one worklist line
+    """
+    r = []
+    for t in items:
+        if isinstance(t, Transfer):
+            lc = t.liquidClass or ''
+            r += [C.Aspirate(t.srcID, '', '', t.srcPos, '', t.volume, lc, None),
+                  C.Dispense(t.dstID, '', '', t.dstPos, '', t.volume, lc, None),
+                  C.Wash('')]
+        else:
+            r.append(t)
+    return r
+
+
+def distributeRuns(items, minWells=4, nDitiReuses=1, nMultiDisp=1,
+                   phases=None):
+    """
+    Replace transfers from one source well into a range of destination wells
+    (constant volume and liquid class) by a single reagent distribution
+    (R) command. Destination wells within the range that are not served are
+    listed as excludeWells. Evoware treats the source range of an R command
+    as one reagent, so transfers from different source wells (e.g. plate
+    copies) are left alone.
+
+    With the default nDitiReuses=1 and nMultiDisp=1, every destination well is
+    pipetted with a fresh tip just like the original transfers. Commands
+    other than Transfer records are passed through and split the sequence;
+    transfers are only combined within the same phase (see reorder). Each R
+    command takes the place of the first transfer it replaces.
+
+    @param items: [Transfer | commands.*], e.g. from CherryWorklist.resolve
+                  or fromCommands
+    @param minWells: int, minimum number of transfers per R command [4]
+    @param nDitiReuses: int, tip re-use for the R commands [1]
+    @param nMultiDisp: int, multi-dispensing for the R commands [1]
+    @param phases: [[str]], consecutive groups of source columns [None]
+    @return [Transfer | commands.Distribute | commands.*]
+    """
+    r = []
+    segment = []
+
+    for t in list(items) + [None]:
+        if isinstance(t, Transfer):
+            segment.append(t)
+            continue
+
+        for group in splitPhases(segment, phases):
+            r += _distributeGroup(group, minWells, nDitiReuses, nMultiDisp)
+        segment = []
+        if t is not None:
+            r.append(t)
+    return r
+
+
+def _distributeGroup(transfers, minWells, nDitiReuses, nMultiDisp):
+    """collapse runs within one group of transfers, see distributeRuns"""
+    runs = collections.OrderedDict()
+    for i, t in enumerate(transfers):
+        key = (t.srcID, t.srcPos, t.dstID, t.volume, t.liquidClass)
+        runs.setdefault(key, collections.OrderedDict()).setdefault(t.dstPos, i)
+
+    replaced = {}  ## index of first transfer -> R command
+    skip = set()
+    for key, wells in runs.items():
+        if len(wells) < minWells:
+            continue
+        srcID, srcPos, dstID, volume, liquidClass = key
+        start, end = min(wells), max(wells)
+        exclude = [w for w in range(start, end + 1) if w not in wells]
+
+        replaced[min(wells.values())] = C.Distribute(
+            srcID, '', '', srcPos, srcPos, dstID, '', '', start, end, volume,
+            liquidClass or '', nDitiReuses, nMultiDisp, 0, exclude)
+        skip.update(wells.values())
+
+    r = []
+    for i, t in enumerate(transfers):
+        if i in replaced:
+            r.append(replaced[i])
+        elif i not in skip:
+            r.append(t)
+    return r
+
+
+def estimateSeconds(items, model=None):
+    """
+    Duration estimate of transfers, R commands and other commands.
+    @param items: [Transfer | commands.*]
+    @param model: costmodel.CostModel, cost model [default CostModel()]
+    @return float, seconds
+    """
+    model = model or costmodel.CostModel()
+    return model.estimate(toCommands(items)).total
+
+
+def lineCount(items):
+    """
+    @param items: [Transfer | commands.*]
+    @return int, number of worklist lines needed for items
+    """
+    return sum(3 if isinstance(t, Transfer) else 1 for t in items)
+
+
+class WashDecision(collections.namedtuple('WashDecision',
+                                          'index removed reason')):
+    """
+    Outcome of WashRules for one wash command.
+    index - int, position of the wash in the input command list
+    removed - bool, True if the wash was (or would be) dropped
+    reason - str, explanation
+    """
+    __slots__ = ()
+
+
+class _Tip(object):
+    """state of the tip(s) since the last wash, used by WashRules"""
+
+    def __init__(self, reagent, well, liquidClass):
+        self.reagent = reagent
+        self.well = well
+        self.liquidClass = liquidClass
+        self.aspirations = 0
+        self.contaminated = None  ## first foreign well touched
+        self.multichannel = False
+
+
+class WashRules(object):
+    """
+    Rule engine that decides when a tip may be re-used and drops the
+    corresponding wash (W;) commands:
+
+    >>> rules = WashRules(maxReuse=4, reagents={('primers', 1): 'p1'})
+    >>> commands, decisions = rules.apply(iterWorklist(lines))
+    >>> print(rules.report(decisions))
+
+    A wash between two aspirations is removed if all rules agree. Default
+    rules are:
+    * ruleSource - the next aspiration is from the same source well, or from
+      a well of the same reagent class (see reagents), with the same liquid
+      class
+    * ruleContamination - the tip has not dispensed into a well that already
+      held a different reagent
+    * ruleReuse - the tip has been used for less than maxReuse aspirations
+
+    Each rule is a method or function f(tip, aspirate) returning a tuple of
+    (bool ok, str reason); additional rules can be passed to the constructor.
+    Washes are always kept before R, B and unknown commands, at the end of
+    the worklist and after multi-channel (tip mask) pipetting.
+    """
+
+    def __init__(self, maxReuse=4, reagents=None, rules=None):
+        """
+        @param maxReuse: int, max number of aspirations per tip [4]
+        @param reagents: {(str, int): str}, reagent class of source wells,
+                         keyed by (rack label or ID, position); wells not
+                         listed are their own reagent class [None]
+        @param rules: [callable], replacement for the default rules [None]
+        """
+        self.maxReuse = maxReuse
+        self.reagents = reagents or {}
+        self.rules = rules or [self.ruleSource, self.ruleContamination,
+                               self.ruleReuse]
+
+    @staticmethod
+    def well(cmd):
+        """@return (str, int), (rack label or ID, position) of A/D command"""
+        return (cmd.rackLabel or cmd.rackID, cmd.position)
+
+    def reagent(self, well):
+        """@return reagent class of a source well"""
+        return self.reagents.get(well, well)
+
+    def ruleSource(self, tip, a):
+        """same source well or reagent class and same liquid class"""
+        if a.liquidClass != tip.liquidClass:
+            return False, 'different liquid class'
+        if self.well(a) == tip.well:
+            return True, 'same source well'
+        if self.reagent(self.well(a)) == tip.reagent:
+            return True, 'same reagent class %r' % (tip.reagent,)
+        return False, 'different reagent'
+
+    def ruleContamination(self, tip, a):
+        """no dispense into a well holding another reagent"""
+        if tip.contaminated:
+            return False, 'tip touched contaminated well %s:%i' % \
+                   tip.contaminated
+        return True, 'destinations not contaminated'
+
+    def ruleReuse(self, tip, a):
+        """tip has been used less than maxReuse times"""
+        if tip.aspirations >= self.maxReuse:
+            return False, 'max reuse count %i reached' % self.maxReuse
+        return True, 'reuse %i of %i' % (tip.aspirations + 1, self.maxReuse)
+
+    @staticmethod
+    def _nextAspirates(commands):
+        """
+        @return [commands.Aspirate | None], for each position, the aspirate
+                that follows it (skipping comments and flushes) or None
+        """
+        r = [None] * len(commands)
+        following = None
+        for i in range(len(commands) - 1, -1, -1):
+            r[i] = following
+            op = commands[i].op
+            if op == C.OP_A:
+                following = commands[i]
+            elif op not in (C.OP_C, C.OP_F):
+                following = None
+        return r
+
+    def _decide(self, tip, a):
+        """@return (bool, str), wash can be removed, reason"""
+        if tip is None:
+            return False, 'tip not used'
+        if a is None:
+            return False, 'no aspiration follows'
+        if tip.multichannel or a.tipMask is not None:
+            return False, 'multi-channel pipetting'
+
+        reasons = []
+        for rule in self.rules:
+            ok, reason = rule(tip, a)
+            if not ok:
+                return False, reason
+            reasons.append(reason)
+        return True, ', '.join(reasons)
+
+    def apply(self, commands, dryRun=False):
+        """
+        @param commands: [commands.* | Transfer], e.g. from
+                         worklist.iterWorklist or fromCommands
+        @param dryRun: bool, only report, return all commands unchanged
+        @return ([commands.*], [WashDecision]), remaining commands and one
+                decision per wash command of the input
+        """
+        commands = toCommands(commands)
+        r = []
+        decisions = []
+        contents = {}  ## destination well -> set of reagents dispensed
+        tip = None
+        nextA = self._nextAspirates(commands)
+
+        for i, cmd in enumerate(commands):
+
+            if cmd.op == C.OP_A:
+                if tip is None:
+                    well = self.well(cmd)
+                    tip = _Tip(self.reagent(well), well, cmd.liquidClass)
+                tip.aspirations += 1
+                tip.multichannel |= cmd.tipMask is not None
+
+            elif cmd.op == C.OP_D and tip is not None:
+                well = self.well(cmd)
+                content = contents.setdefault(well, set())
+                if content - set([tip.reagent]) and not tip.contaminated:
+                    tip.contaminated = well
+                content.add(tip.reagent)
+                tip.multichannel |= cmd.tipMask is not None
+
+            elif cmd.op == C.OP_W:
+                removed, reason = self._decide(tip, nextA[i])
+                decisions.append(WashDecision(i, removed, reason))
+                if removed and not dryRun:
+                    continue
+                if not removed:
+                    tip = None
+
+            elif cmd.op not in (C.OP_C, C.OP_F):
+                tip = None  ## R, B or unknown command, start over
+
+            r.append(cmd)
+
+        return r, decisions
+
+    @staticmethod
+    def report(decisions):
+        """
+        @param decisions: [WashDecision], as returned by apply
+        @return str, one line per wash command
+        """
+        return '\n'.join('command %i: %s W; (%s)' %
+                         (d.index + 1, 'removed' if d.removed else 'kept',
+                          d.reason) for d in decisions)
+
+
+class DeckError(Exception):
+    pass
+
+
+class DeckBatch(collections.namedtuple('DeckBatch', 'plates transfers')):
+    """
+    Transfers that can be done with one set of source plates on the deck.
+    plates - [str], source plates used by the batch (fixed plates included)
+    transfers - [Transfer], in their original order
+    """
+    __slots__ = ()
+
+
+def deckBatches(transfers, maxPlates, fixedPlates=()):
+    """
+    Split transfers into the fewest batches that need at most maxPlates
+    source plates on the deck at the same time. All transfers into one
+    target stay in the same batch so that their order is preserved. Finding
+    the optimal partition is a set-cover problem; the greedy heuristic used
+    here fills each batch with the targets that add the most transfers per
+    additional source plate, targets without any new plate first.
+
+    @param transfers: [Transfer]
+    @param maxPlates: int, number of deck positions for source plates
+    @param fixedPlates: [str], plates that are always on the deck; they use
+                        up deck positions in every batch [()]
+    @return [DeckBatch], plates are sorted by first use
+    @raise DeckError, if a target needs more plates than fit on the deck
+    """
+    fixed = set(fixedPlates)
+    capacity = maxPlates - len(fixed)
+    if capacity < 0:
+        raise DeckError('%i fixed plates do not fit into %i deck positions'
+                        % (len(fixed), maxPlates))
+
+    ## targets with the same set of (non-fixed) source plates are one unit
+    transfers = list(transfers)
+    targets = collections.OrderedDict()  ## target -> [transfer index]
+    for i, t in enumerate(transfers):
+        targets.setdefault(t.target, []).append(i)
+
+    units = collections.OrderedDict()
+    for target, tt in targets.items():
+        key = frozenset(transfers[i].srcID for i in tt) - fixed
+        if len(key) > capacity:
+            raise DeckError('target %s needs %i source plates, only %i deck '
+                            'positions are available' % (target, len(key),
+                                                         capacity))
+        units.setdefault(key, []).append(target)
+
+    weight = dict((key, sum(len(targets[x]) for x in v))
+                  for key, v in units.items())
+    byplate = collections.defaultdict(list)
+    for key in units:
+        for plate in key:
+            byplate[plate].append(key)
+
+    ## candidates without overlap to the loaded plates, by number of
+    ## plates needed, most transfers first
+    fresh = collections.defaultdict(list)
+    for key in sorted(units, key=lambda k: -weight[k]):
+        fresh[len(key)].append(key)
+    remaining = set(units)
+    r = []
+
+    while remaining:
+        for n in fresh:
+            fresh[n] = [key for key in fresh[n] if key in remaining]
+        loaded = set()
+        touching = set()  ## remaining units sharing plates with loaded
+        chosen = []
+
+        while True:
+            best, best_score = None, None
+            for key in touching:
+                new = len(key - loaded)
+                if len(loaded) + new <= capacity:
+                    score = weight[key] / float(new) if new else float('inf')
+                    if best is None or score > best_score:
+                        best, best_score = key, score
+
+            for n, keys in fresh.items():
+                if len(loaded) + n > capacity:
+                    continue
+                for key in keys:
+                    if key in remaining and key not in touching:
+                        score = weight[key] / float(n) if n else float('inf')
+                        if best is None or score > best_score:
+                            best, best_score = key, score
+                        break
+
+            if best is None:
+                break
+
+            chosen.append(best)
+            remaining.discard(best)
+            touching.discard(best)
+            for plate in best - loaded:
+                loaded.add(plate)
+                touching.update(k for k in byplate[plate] if k in remaining)
+
+            ## everything that is already covered comes for free
+            free = [key for key in touching if key <= loaded]
+            chosen += free
+            remaining.difference_update(free)
+            touching.difference_update(free)
+
+        index = sorted(i for key in chosen for target in units[key]
+                       for i in targets[target])
+        batch = [transfers[i] for i in index]
+        plates = []
+        for t in batch:
+            if t.srcID not in plates:
+                plates.append(t.srcID)
+        r.append(DeckBatch(plates, batch))
+
+    return r
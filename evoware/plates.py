@@ -18,13 +18,37 @@
 import numpy as np
 import re
 import string
-import math
+import functools
+import itertools
 
 
 class PlateError(Exception):
     pass
 
 
+def _rowname(row):
+    """
+    @param row: int, 1-based row number
+    @return str, row label: 'A'..'Z', then 'AA', 'AB', .. (as on 1536 plates)
+    """
+    r = ''
+    while row > 0:
+        row, i = divmod(row - 1, 26)
+        r = string.ascii_uppercase[i] + r
+    return r
+
+
+def _rownumber(letters):
+    """
+    @param letters: str, row label like 'B' or 'af' (case-insensitive)
+    @return int, 1-based row number ('A'=>1, 'Z'=>26, 'AA'=>27)
+    """
+    r = 0
+    for c in letters.upper():
+        r = r * 26 + string.ascii_uppercase.index(c) + 1
+    return r
+
+
 class PlateFormat(object):
     """
     Describe plate columns : rows dimensions and convert back and for between
@@ -46,9 +70,12 @@ class PlateFormat(object):
 
     """
 
-    ex_position = re.compile('([A-Za-z]{0,1})([0-9]+)')
+    ex_position = re.compile('([A-Za-z]{0,2})([0-9]+)')
+
+    #: interned instances, one per (class, n, nx, ny)
+    _registry = {}
 
-    def __init__(self, n, nx=None, ny=None):
+    def __new__(cls, n, nx=None, ny=None):
         """
         Define Plate format. Number of columns (nx) and rows (ny) is deduced
         from well number (n), assuming a 3 : 2 ratio of columns : rows. This
@@ -56,23 +83,122 @@ class PlateFormat(object):
         96, 384 and 1536 wells. For any format more odd than this, nx and ny
         should be given explicitely.
 
+        PlateFormat instances are immutable and interned -- asking twice for
+        the same dimensions returns the very same object:
+
+        >>> PlateFormat(96) is PlateFormat(96, nx=12, ny=8)
+        True
+
         @param n: int, number of wells (e.g. 96)
         @param nx: int, optionally, number of columns (else calculated from n)
         @param ny: int, optionally, number of rows (else calculated from nx)
         """
-        self.n = int(n)
-        self.nx = int(nx or round(np.sqrt(3. / 2 * self.n)))
-        self.ny = int(ny or round(1.0 * n / self.nx))
+        n = int(n)
+        nx = int(nx or round(np.sqrt(3. / 2 * n)))
+        ny = int(ny or round(1.0 * n / nx))
 
-        if self.nx * self.ny != self.n:
+        key = (cls, n, nx, ny)
+        if key in cls._registry:
+            return cls._registry[key]
+
+        if nx * ny != n:
             raise PlateError('invalid plate format: %r x %r != %r' % \
-                             (self.nx, self.ny, self.n))
+                             (nx, ny, n))
+
+        self = super(PlateFormat, cls).__new__(cls)
+        self._n = n
+        self._nx = nx
+        self._ny = ny
+
+        self._names = None  ## lazy well name array, see wellnames
+        self._index = None  ## lazy well name -> int dict, see wellindex
+        self._lookup = None  ## lazy sorted wellindex arrays, see _get_lookup
+
+        cls._registry[key] = self
+        return self
+
+    def __reduce__(self):
+        """pickle / copy support that preserves interning"""
+        return self.__class__, (self.n, self.nx, self.ny)
+
+    ## dimensions are read-only, the instance is shared by everyone using it
+    n = property(lambda self: self._n, doc='int, number of wells')
+    nx = property(lambda self: self._nx, doc='int, number of columns')
+    ny = property(lambda self: self._ny, doc='int, number of rows')
+
+    def _get_wellnames(self):
+        if self._names is None:
+            letters = np.array([_rowname(i) for i in range(1, self.ny + 1)])
+            rows = np.tile(letters, self.nx)
+            cols = np.repeat(np.arange(1, self.nx + 1), self.ny)
+
+            ## size dtypes explicitly, astype(str) would give 'U21' per well
+            cols = cols.astype('U%i' % len(str(self.nx)))
+            maxlen = len(_rowname(self.ny)) + len(str(self.nx))
+            self._names = np.char.add(rows, cols).astype('U%i' % maxlen)
+            self._names.flags.writeable = False
+
+        return self._names
+
+    wellnames = property(_get_wellnames,
+                         doc='array of human-readable names for wells 1..n '
+                             "(rows after 'Z' are 'AA', 'AB', ..), cached")
+
+    def _get_wellindex(self):
+        if self._index is None:
+            r = dict((str(i), i) for i in range(1, self.n + 1))
+
+            digits = len(str(self.nx))
+            for i, name in enumerate(self.wellnames.tolist()):
+                letter, col = self.str2tuple(name)
+                for width in range(1, digits + 1):
+                    s = '%s%0*i' % (letter, width, col)
+                    r[s] = r[s.lower()] = i + 1
+
+            self._index = r
+
+        return self._index
+
+    wellindex = property(_get_wellindex,
+                         doc='dict mapping every well name (upper and lower '
+                             'case, zero-padded or not) and number string to '
+                             'its Tecan position, cached')
+
+    @staticmethod
+    def _encode(a, width):
+        """
+        Pack ascii strings of up to width characters into one int each (7
+        bits per character) so that they can be looked up with
+        numpy.searchsorted on numbers rather than strings.
+        @param a: numpy.ndarray of str, longer strings are truncated
+        @return numpy.ndarray of int64, -1 for non-ascii strings
+        """
+        codes = a.astype('U%i' % width).view(np.uint32).reshape(a.size, width)
+        r = codes.astype(np.int64) @ (128 ** np.arange(width, dtype=np.int64))
+        r[(codes > 127).any(axis=1)] = -1
+        return r
+
+    def _get_lookup(self):
+        """
+        @return (int, numpy.ndarray of int64, numpy.ndarray of int), length of
+                the longest wellindex key, sorted encoded keys (see _encode)
+                and matching Tecan positions
+        """
+        if self._lookup is None:
+            names = list(self.wellindex)
+            width = max(len(k) for k in names)
+            keys = self._encode(np.array(names), width)
+            order = np.argsort(keys)
+            values = np.array([self.wellindex[k] for k in names])
+            self._lookup = width, keys[order], values[order]
+
+        return self._lookup
 
     def str2tuple(self, pos):
         """
         Normalize position string to tuple.
         @param well: str, like 'A1' or '12'
-        @return (str, int) - uppercase letter or '', number
+        @return (str, int) - uppercase row letter(s) or '', number
         """
         assert isinstance(pos, str)
         match = self.ex_position.match(pos)
@@ -88,22 +214,31 @@ class PlateFormat(object):
         according to Tecan numbering ('A2'=>9)
 
         @raise PlateError, if the resulting position is outside well number
+                           or row / column are outside the plate
         """
         if type(pos) in [int, float]:
             letter, number = '', int(pos)
         else:
+            r = self.wellindex.get(pos)
+            if r:
+                return r
             letter, number = self.str2tuple(pos)
 
+        if number is None:
+            raise PlateError('invalid plate position: %r' % pos)
+
         if letter:
-            row = string.ascii_uppercase.find(letter) + 1
+            row = _rownumber(letter)
             col = number
+            if row > self.ny or not 1 <= col <= self.nx:
+                raise PlateError('invalid plate position: %r' % pos)
             r = (col - 1) * self.ny + row
         else:
             r = number
 
         if r > self.n:
             raise PlateError('plate position %r exceeds number of wells' % r)
-        if not r:
+        if r < 1:
             raise PlateError('invalid plate position: %r' % pos)
 
         return r
@@ -116,14 +251,10 @@ class PlateFormat(object):
         """
         assert type(pos) is int
 
-        col = int((pos - 1) / self.ny)
-        row = int((pos - 1) % self.ny)
-
-        if col + 1 > self.nx or row > self.ny:
+        if pos < 1 or pos > self.n:
             raise PlateError('position outside plate dimensions')
 
-        r = string.ascii_uppercase[row] + str(col + 1)
-        return r
+        return str(self.wellnames[pos - 1])
 
     def gridindex2int(self, row, col):
         """
@@ -189,15 +320,211 @@ class PlateFormat(object):
         :return:
         :rtype:
         """
-        # col = math.floor(cell_int / self.ny)
-        # row = self.ny - (cell_int % self.ny)
-        col = math.ceil(float(cell_int) / self.ny) - 1
-        row_modulus = cell_int % self.ny
-        if row_modulus == 0:
-            row = 7
+        row, col = self.int2gridindex_array(cell_int)
+        return int(row), int(col)
+
+    def human2int_array(self, pos):
+        """
+        Vectorized version of human2int. Convert a whole sequence of well
+        positions to Tecan numbering in one pass.
+
+        >>> f = PlateFormat(96)
+        >>> f.human2int_array(['A1', 'b1', 'A2', 'h12', '5', 7]).tolist()
+        [1, 2, 9, 96, 5, 7]
+
+        @param pos: [str] | [int] | numpy.ndarray, e.g. ['A2', 'a3'] or [2, 3]
+        @return numpy.ndarray of int, plate positions in Tecan numbering
+
+        @raise PlateError, if any position is invalid or exceeds well number
+        """
+        if isinstance(pos, (list, tuple)) and pos and isinstance(pos[0], str):
+            r = self._lookup_human_list(pos)
+            miss = r == 0
+            if miss.any():
+                r[miss] = self._lookup_human_array(
+                    np.asarray(pos, object)[miss].astype(str))
+            self._check_int_array(r, pos)
+            return r
+
+        a = np.asarray(pos)
+
+        if a.dtype.kind in 'iuf':
+            r = a.astype(int)
         else:
-            row = row_modulus - 1
-        return row, col
+            r = self._lookup_human_array(a.astype(str))
+
+        self._check_int_array(r, a)
+        return r
+
+    def _lookup_human_array(self, a):
+        """
+        Look up array of position strings in the sorted wellindex table;
+        only strings not found there are parsed by _parse_human_array.
+        @param a: numpy.ndarray of str
+        @return numpy.ndarray of int (0 for unparsable entries)
+        """
+        if not a.size:
+            return np.zeros(a.shape, int)
+
+        shape = a.shape
+        a = a.ravel()
+        lengths = np.char.str_len(a)
+        ## narrow dtype (np.asarray(['A1', 7]) gives 'U21') so that neither
+        ## encoding nor parsing has to scan padding characters
+        a = a.astype('U%i' % max(1, lengths.max()))
+
+        width, keys, values = self._get_lookup()
+        k = self._encode(a, width)
+        k[lengths > width] = -1  ## truncated by _encode
+        i = np.searchsorted(keys, k).clip(max=len(keys) - 1)
+        hit = keys[i] == k
+        r = np.where(hit, values[i], 0)
+
+        miss = ~hit
+        if miss.any():
+            r[miss] = self._parse_human_array(a[miss])
+
+        return r.reshape(shape)
+
+    def _lookup_human_list(self, pos):
+        """
+        Look up list of position strings in wellindex, without converting
+        the list into a numpy array first (which costs more than the lookup).
+        @param pos: [str]
+        @return numpy.ndarray of int (0 for entries not in wellindex)
+        """
+        return np.fromiter(map(self.wellindex.get, pos, itertools.repeat(0)),
+                           int, len(pos))
+
+    def _parse_human_array(self, a):
+        """
+        Parse array of position strings ('A2', 'b12', '17') into Tecan
+        numbering, equivalent to str2tuple + human2int but without a regex
+        match per well. Strings are viewed as a (n x length) matrix of unicode
+        code points so that each character column is handled in one step.
+        @param a: numpy.ndarray of str
+        @return numpy.ndarray of int (0 for unparsable entries)
+        """
+        shape = a.shape
+        a = a.ravel()
+        if not a.size:
+            return np.zeros(shape, int)
+
+        codes = a.view(np.uint32).reshape(a.size, -1).astype(int)
+
+        ## up to two leading row letters, 'A'=>1 .. 'Z'=>26, 'AA'=>27 ..
+        row = np.zeros(a.size, int)
+        nletters = np.zeros(a.size, int)
+        for i in range(min(2, codes.shape[1])):
+            c = codes[:, i] | 0x20  ## lower-case ascii letters
+            letter = (c >= ord('a')) & (c <= ord('z')) & (nletters == i)
+            row = np.where(letter, row * 26 + c - ord('a') + 1, row)
+            nletters += letter
+        has_letter = nletters > 0
+
+        number = np.zeros(a.size, int)
+        ndigits = np.zeros(a.size, int)
+        running = np.ones(a.size, bool)
+
+        for i in range(codes.shape[1]):
+            c = codes[:, i]
+            started = i >= nletters
+            digit = (c >= ord('0')) & (c <= ord('9'))
+            running &= ~started | digit
+            take = started & running
+            number = np.where(take, number * 10 + c - ord('0'), number)
+            ndigits += take
+
+        r = np.where(has_letter, (number - 1) * self.ny + row, number)
+        r[ndigits == 0] = 0
+        ## row and column must exist, e.g. no 'A0', 'I1' or 'A13' on 96 wells
+        r[has_letter & ((row > self.ny) | (number < 1) |
+                        (number > self.nx))] = 0
+
+        return r.reshape(shape)
+
+    def _check_int_array(self, r, pos):
+        """
+        @raise PlateError, if any position in r is outside 1..n
+        """
+        if (r > self.n).any():
+            raise PlateError('plate position %r exceeds number of wells'
+                             % int(r.max()))
+        invalid = r < 1
+        if invalid.any():
+            raise PlateError('invalid plate position: %r'
+                             % np.asarray(pos)[invalid].tolist()[0])
+
+    def int2human_array(self, pos):
+        """
+        Vectorized version of int2human.
+
+        >>> f = PlateFormat(96)
+        >>> f.int2human_array([1, 2, 9, 96]).tolist()
+        ['A1', 'B1', 'A2', 'H12']
+
+        @param pos: [int] | numpy.ndarray, well positions in Tecan numbering
+        @return numpy.ndarray of str, plate coordinates
+        @raise PlateError, if any position is outside plate dimensions
+        """
+        pos = np.asarray(pos, int)
+        if ((pos < 1) | (pos > self.n)).any():
+            raise PlateError('position outside plate dimensions')
+
+        return self.wellnames[pos - 1]
+
+    def gridindex2int_array(self, row, col):
+        """
+        Vectorized version of gridindex2int.
+
+        >>> f = PlateFormat(96)
+        >>> f.gridindex2int_array([0, 7, 0, 7], [0, 0, 1, 11]).tolist()
+        [1, 8, 9, 96]
+
+        @param row: [int] | numpy.ndarray, 0-based row indices
+        @param col: [int] | numpy.ndarray, 0-based column indices
+        @return numpy.ndarray of int, well positions in Tecan numbering
+        @raise PlateError, if any index is outside plate dimensions
+        """
+        row = np.asarray(row, int)
+        col = np.asarray(col, int)
+
+        if ((row < 0) | (row >= self.ny) | (col < 0) | (col >= self.nx)).any():
+            raise PlateError('grid index outside plate dimensions')
+
+        return col * self.ny + row + 1
+
+    def int2gridindex_array(self, pos):
+        """
+        Vectorized version of int2gridindex.
+
+        >>> f = PlateFormat(96)
+        >>> rows, cols = f.int2gridindex_array([1, 2, 30, 96])
+        >>> rows.tolist(), cols.tolist()
+        ([0, 1, 5, 7], [0, 0, 3, 11])
+
+        @param pos: [int] | numpy.ndarray, well positions in Tecan numbering
+        @return (numpy.ndarray, numpy.ndarray), 0-based row and column indices
+        @raise PlateError, if any position is outside 1..n
+        """
+        pos = np.asarray(pos, int)
+        self._check_int_array(pos, pos)
+
+        return (pos - 1) % self.ny, (pos - 1) // self.ny
+
+    def range2int(self, expr):
+        """
+        Convert plate range expression into Tecan well positions. See
+        compileRange for the syntax. Compiled expressions are cached.
+
+        >>> PlateFormat(96).range2int('A1,A3,C5:D6').tolist()
+        [1, 17, 35, 36, 43, 44]
+
+        @param expr: str, range expression like 'A1:H6' or 'col 3-5, row B'
+        @return numpy.ndarray of int, sorted well positions (read-only)
+        @raise PlateError, if the expression cannot be parsed
+        """
+        return compileRange(self, expr)
 
     def right_on_row(self, cell_int):
         """
@@ -220,12 +547,7 @@ class PlateFormat(object):
         :return:
         :rtype:
         """
-        end_cell = self.gridindex2int(self.int2gridindex(cell_int)[0],
-                                      self.nx)
-
-        # we need to filter out values higher than the highest well number
-        return list(filter(lambda x: x <= self.n,
-                           range(cell_int, end_cell+1, self.ny)))
+        return list(range(cell_int, self.n + 1, self.ny))
 
     def down_on_column(self, cell_int):
         """
@@ -265,3 +587,333 @@ class PlateFormat(object):
     def __eq__(self, o):
         return isinstance(o, PlateFormat) and \
                self.n == o.n and self.nx == o.nx and self.ny == o.ny
+
+    def __ne__(self, o):
+        return not self == o
+
+    def __hash__(self):
+        return hash((self.n, self.nx, self.ny))
+
+
+
+class WellSet(object):
+    """
+    Selection of wells on a plate of given format, stored as boolean mask
+    in Tecan well order. Set operations (|, &, -, ^, ~) work on the whole
+    mask at once and iteration yields the selected wells in Tecan numbering.
+
+    Usage:
+
+    >>> f = PlateFormat(96)
+    >>> s = WellSet.row(f, 'B') & WellSet.rectangle(f, 'A2', 'H4')
+    >>> list(s)
+    [10, 18, 26]
+    >>> s.humans().tolist()
+    ['B2', 'B3', 'B4']
+    >>> len(WellSet.column(f, 3) | WellSet.row(f, 'A'))
+    19
+    >>> WellSet(f, ['A1', 'C1']).excludeWells(1, 4)
+    [2, 4]
+
+    A WellSet can directly be given as excludeWells argument to
+    Worklist.distribute.
+    """
+
+    def __init__(self, plateformat, wells=()):
+        """
+        @param plateformat: PlateFormat | int, plate format or number of wells
+        @param wells: [str] | [int], initial well selection, e.g. ['A1', 12]
+        @raise PlateError, if any well is invalid for this plate format
+        """
+        if not isinstance(plateformat, PlateFormat):
+            plateformat = PlateFormat(plateformat)
+
+        self.plateformat = plateformat
+        self._mask = np.zeros(plateformat.n, bool)
+
+        if len(wells):
+            self._mask[plateformat.human2int_array(wells) - 1] = True
+
+    @classmethod
+    def fromMask(cls, plateformat, mask):
+        """
+        @param plateformat: PlateFormat
+        @param mask: [bool] | numpy.ndarray, one value per well in Tecan order
+        @return WellSet
+        """
+        r = cls(plateformat)
+        mask = np.asarray(mask, bool)
+        if mask.shape != r._mask.shape:
+            raise PlateError('mask does not match %s' % plateformat)
+        r._mask = mask.copy()
+        return r
+
+    @classmethod
+    def fromRange(cls, plateformat, expr):
+        """
+        @param expr: str, range expression like 'A1:H6, row B' (see
+                     compileRange)
+        @return WellSet
+        """
+        r = cls(plateformat)
+        r._mask[compileRange(r.plateformat, expr) - 1] = True
+        return r
+
+    @classmethod
+    def all(cls, plateformat):
+        """@return WellSet, all wells of given plate format"""
+        r = cls(plateformat)
+        r._mask[:] = True
+        return r
+
+    def _grid(self):
+        """@return numpy.ndarray, (columns x rows) view of the mask"""
+        return self._mask.reshape(self.plateformat.nx, self.plateformat.ny)
+
+    @classmethod
+    def _rowindex(cls, plateformat, row):
+        """convert row label ('B', 'AA') or 1-based row number to 0-based"""
+        if isinstance(row, str):
+            letters = row.strip()
+            valid = 0 < len(letters) <= 2 and \
+                all(c in string.ascii_letters for c in letters)
+            r = _rownumber(letters) - 1 if valid else -1
+        else:
+            r = int(row) - 1
+
+        if not (0 <= r < plateformat.ny):
+            raise PlateError('invalid row %r for %s' % (row, plateformat))
+        return r
+
+    @classmethod
+    def _colindex(cls, plateformat, col):
+        """convert 1-based column number to 0-based index"""
+        r = int(col) - 1
+        if not 0 <= r < plateformat.nx:
+            raise PlateError('invalid column %r for %s' % (col, plateformat))
+        return r
+
+    @classmethod
+    def row(cls, plateformat, row):
+        """
+        @param row: str | int, row letter ('B') or 1-based row number (2)
+        @return WellSet, all wells of one plate row
+        """
+        r = cls(plateformat)
+        r._grid()[:, cls._rowindex(r.plateformat, row)] = True
+        return r
+
+    @classmethod
+    def column(cls, plateformat, col):
+        """
+        @param col: int, 1-based column number
+        @return WellSet, all wells of one plate column
+        """
+        r = cls(plateformat)
+        r._grid()[cls._colindex(r.plateformat, col)] = True
+        return r
+
+    @classmethod
+    def rectangle(cls, plateformat, first, last):
+        """
+        @param first: str | int, well at one corner of the rectangle ('A1')
+        @param last: str | int, well at the opposite corner ('C4')
+        @return WellSet, all wells within the rectangle (inclusive)
+        """
+        r = cls(plateformat)
+        rows, cols = r.plateformat.int2gridindex_array(
+            r.plateformat.human2int_array([first, last]))
+
+        r._grid()[cols.min():cols.max() + 1, rows.min():rows.max() + 1] = True
+        return r
+
+    @classmethod
+    def quadrant(cls, plateformat, q):
+        """
+        Interleaved plate quadrant as used for stamping four 96 well plates
+        into one 384 well plate: quadrant 1 starts at A1, 2 at A2, 3 at B1
+        and 4 at B2; each covers every second row and column.
+        @param q: int, quadrant 1..4
+        @return WellSet
+        """
+        if not q in (1, 2, 3, 4):
+            raise PlateError('invalid quadrant %r' % q)
+
+        r = cls(plateformat)
+        row0, col0 = divmod(q - 1, 2)
+        r._grid()[col0::2, row0::2] = True
+        return r
+
+    def _other(self, o):
+        if not isinstance(o, WellSet):
+            o = WellSet(self.plateformat, o)
+        if o.plateformat != self.plateformat:
+            raise PlateError('cannot combine wells of %s and %s'
+                             % (self.plateformat, o.plateformat))
+        return o._mask
+
+    def __or__(self, o):
+        return WellSet.fromMask(self.plateformat, self._mask | self._other(o))
+
+    def __and__(self, o):
+        return WellSet.fromMask(self.plateformat, self._mask & self._other(o))
+
+    def __sub__(self, o):
+        return WellSet.fromMask(self.plateformat, self._mask & ~self._other(o))
+
+    def __xor__(self, o):
+        return WellSet.fromMask(self.plateformat, self._mask ^ self._other(o))
+
+    def __invert__(self):
+        return WellSet.fromMask(self.plateformat, ~self._mask)
+
+    union = __or__
+    intersection = __and__
+    difference = __sub__
+
+    def __eq__(self, o):
+        return isinstance(o, WellSet) and o.plateformat == self.plateformat \
+               and (o._mask == self._mask).all()
+
+    def __ne__(self, o):
+        return not self == o
+
+    __hash__ = None
+
+    def __len__(self):
+        return int(self._mask.sum())
+
+    def __bool__(self):
+        return bool(self._mask.any())
+
+    def __contains__(self, well):
+        """False for wells that do not exist on the plate (e.g. 'A0')"""
+        try:
+            i = self.plateformat.human2int_array([well])[0]
+        except PlateError:
+            return False
+        return bool(self._mask[i - 1])
+
+    def __iter__(self):
+        """iterate over selected wells in Tecan order"""
+        return iter(self.ints().tolist())
+
+    def ints(self):
+        """@return numpy.ndarray of int, selected wells in Tecan numbering"""
+        return np.flatnonzero(self._mask) + 1
+
+    def humans(self):
+        """@return numpy.ndarray of str, selected wells as 'A1', 'B1', ..."""
+        return self.plateformat.int2human_array(self.ints())
+
+    def mask(self):
+        """@return numpy.ndarray of bool, copy of the selection mask"""
+        return self._mask.copy()
+
+    def excludeWells(self, start=1, end=None):
+        """
+        Convert selection into the excludeWells list expected by
+        Worklist.distribute, i.e. all wells between start and end (inclusive)
+        that are *not* part of this selection.
+        @param start: int, first destination well [1]
+        @param end: int, last destination well [last well of plate]
+        @return [int]
+        """
+        end = end or self.plateformat.n
+        return (np.flatnonzero(~self._mask[start - 1:end]) + start).tolist()
+
+    def __str__(self):
+        return '%i of %i wells' % (len(self), self.plateformat.n)
+
+    def __repr__(self):
+        return '<WellSet %s>' % str(self)
+
+
+#: range expression items -- keyword (row / col) and its argument
+ex_range_keyword = re.compile(r'^(rows?|cols?|columns?)\s*(\S+?)(?:\s*-\s*(\S+))?$')
+#: range expression items -- single well or numeric range 'A1:C4', '1-24'
+ex_range_wells = re.compile(r'^([A-Za-z]{0,2}[0-9]+)(?:\s*[:-]\s*([A-Za-z]{0,2}[0-9]+))?$')
+
+
+@functools.lru_cache(maxsize=1024)
+def compileRange(plateformat, expr):
+    """
+    Compile a plate range expression into an array of Tecan well positions.
+    Results are cached per (plateformat, expression) -- repeated calls with
+    the same arguments cost a dictionary look-up.
+
+    Expressions consist of comma- (or semicolon-) separated items:
+
+    * 'A1' or '12' -- single well (human or Tecan numbering)
+    * 'A1:H6' -- rectangle between two corner wells
+    * '1-48' -- consecutive wells in Tecan numbering
+    * 'row B', 'rows B-D', 'row 2' -- one or more complete rows
+    * 'col 3', 'cols 3-5', 'column 3' -- one or more complete columns
+    * 'all' or '*' -- the whole plate
+
+    Usage:
+
+    >>> f = PlateFormat(96)
+    >>> compileRange(f, 'row B, col 2').tolist()
+    [2, 9, 10, 11, 12, 13, 14, 15, 16, 18, 26, 34, 42, 50, 58, 66, 74, 82, 90]
+    >>> compileRange(f, 'A1:B2').tolist()
+    [1, 2, 9, 10]
+
+    @param plateformat: PlateFormat
+    @param expr: str, range expression
+    @return numpy.ndarray of int, sorted well positions without duplicates;
+            the array is shared between callers and therefore read-only
+    @raise PlateError, if the expression cannot be parsed or exceeds plate
+    """
+    mask = np.zeros(plateformat.n, bool)
+    grid = mask.reshape(plateformat.nx, plateformat.ny)
+
+    for item in re.split('[,;]', expr):
+        item = item.strip()
+        keyword = ex_range_keyword.match(item.lower())
+        wells = ex_range_wells.match(item)
+
+        if item.lower() in ('all', '*'):
+            mask[:] = True
+
+        elif keyword:
+            kind, first, last = keyword.groups()
+            last = last or first
+
+            if kind.startswith('row'):
+                i = WellSet._rowindex(plateformat, _rowarg(first))
+                j = WellSet._rowindex(plateformat, _rowarg(last))
+                grid[:, min(i, j):max(i, j) + 1] = True
+            else:
+                i = WellSet._colindex(plateformat, _intarg(first, expr))
+                j = WellSet._colindex(plateformat, _intarg(last, expr))
+                grid[min(i, j):max(i, j) + 1] = True
+
+        elif wells:
+            first, last = wells.groups()
+            if last is None:
+                mask[plateformat.human2int_array([first]) - 1] = True
+            elif first.isdigit() and last.isdigit():
+                i, j = sorted(plateformat.human2int_array([first, last]))
+                mask[i - 1:j] = True
+            else:
+                ws = WellSet.rectangle(plateformat, first, last)
+                mask |= ws._mask
+
+        else:
+            raise PlateError('cannot parse plate range %r in %r' % (item, expr))
+
+    r = np.flatnonzero(mask) + 1
+    r.flags.writeable = False
+    return r
+
+
+def _rowarg(x):
+    """row given as letter or number"""
+    return int(x) if x.isdigit() else x
+
+
+def _intarg(x, expr):
+    if not x.isdigit():
+        raise PlateError('invalid column %r in plate range %r' % (x, expr))
+    return int(x)
@@ -0,0 +1,347 @@
+##  evoware/py -- python modules for Evoware scripting
+##   Copyright 2014 Raik Gruenberg
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+
+"""Dry-run simulation of worklists with per-well volume tracking"""
+
+import collections
+
+import numpy as np
+
+from . import plates
+from . import commands as C
+from . import worklist as W
+
+#: tolerance for volume comparisons (ul)
+EPSILON = 1e-6
+
+
+class SimulationError(Exception):
+    pass
+
+
+class Issue(collections.namedtuple('Issue', 'index kind labware position '
+                                            'volume message')):
+    """
+    Problem found during simulation.
+    index - int, 0-based index of the offending command (worklist line)
+    kind - str, 'empty', 'overfill', 'no aspirate' or 'position'
+    labware - str, labware label or ID ('' for tip problems)
+    position - int, well position (0 for tip problems)
+    volume - float, volume in the well / tip after the command
+    message - str, human readable description
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return 'command %i: %s' % (self.index + 1, self.message)
+
+
+class Simulation(object):
+    """
+    Result of Simulator.run.
+    issues - [Issue], all problems found, sorted by command index
+    volumes - {str: numpy.ndarray}, final volume of every well, as
+              matrix of shape (rows, columns) per labware
+    checked - {str: bool}, True for labware with known initial content
+    """
+
+    def __init__(self, issues, volumes, checked):
+        self.issues = issues
+        self.volumes = volumes
+        self.checked = checked
+
+    @property
+    def ok(self):
+        """True if no problems were found"""
+        return not self.issues
+
+    def report(self):
+        """
+        @return str, final state of each labware followed by all issues
+        """
+        r = []
+        for labware, v in sorted(self.volumes.items()):
+            filled = v > EPSILON
+            r.append('%s: %i of %i wells filled, total %g ul%s' %
+                     (labware, filled.sum(), v.size, v.sum(),
+                      '' if self.checked[labware] else
+                      ' (net change, initial content unknown)'))
+        r += [str(issue) for issue in self.issues]
+        return '\n'.join(r)
+
+
+class Simulator(object):
+    """
+    Execute worklists against a model of the deck and track the volume of
+    every well and tip:
+
+    >>> sim = Simulator(maxVolume=200)
+    >>> sim.addLabware('src', plates.PlateFormat(384), volume=50)
+    >>> result = sim.run(worklist)
+    >>> print(result.report())
+
+    Supported commands are aspirate (A), dispense (D), reagent distribution
+    (R), wash (W), flush (F) and break (B); all other lines are ignored.
+    The simulation flags:
+    * aspiration of more liquid than a well contains ('empty')
+    * dispensing more than a well can hold ('overfill')
+    * dispensing more than the tip has aspirated since the last wash or
+      flush ('no aspirate'); every tip (channel) selected by a tip mask is
+      tracked on its own, so an 8-channel aspirate (mask 255) may well be
+      followed by single-channel dispenses (mask 1, 2, 4, ..); commands
+      without tip mask share one, unspecified, tip
+    * positions outside of the plate format ('position')
+
+    Labware is identified by rack label (or rack ID if there is no label).
+    Labware without declared content starts empty but is not checked for
+    aspirations from empty wells (unless defaultVolume is given); its final
+    volumes are therefore the net change. R commands draw the total volume
+    evenly from all source wells.
+
+    All A and D commands are evaluated at once with numpy (grouped cumulative
+    sums), only R lines are expanded one by one.
+    """
+
+    def __init__(self, plateformats=None, maxVolume=None, defaultVolume=None):
+        """
+        @param plateformats: {str: PlateFormat | int}, plate format by labware
+                             label/ID; undeclared labware is 96 well [None]
+        @param maxVolume: float, default well capacity (ul), None for no
+                          overfill check [None]
+        @param defaultVolume: float, initial volume of undeclared labware,
+                              None for unknown content [None]
+        """
+        self.plateformats = dict(plateformats or {})
+        self.maxVolume = maxVolume
+        self.defaultVolume = defaultVolume
+        self._volume = {}
+        self._maxVolume = {}
+
+    def addLabware(self, labware, plateformat=96, volume=0, maxVolume=None):
+        """
+        Declare labware with known initial content.
+        @param labware: str, rack label or ID as used in the worklist
+        @param plateformat: PlateFormat | int, plate format [96]
+        @param volume: float | array, initial volume of all wells or of each
+                       well (in Tecan well order or as (rows, columns)) [0]
+        @param maxVolume: float, well capacity (ul) [Simulator.maxVolume]
+        """
+        if not isinstance(plateformat, plates.PlateFormat):
+            plateformat = plates.PlateFormat(plateformat)
+        self.plateformats[labware] = plateformat
+        self._volume[labware] = volume
+        self._maxVolume[labware] = maxVolume
+
+    def plateformat(self, labware):
+        """@return PlateFormat of labware"""
+        r = self.plateformats.get(labware, 96)
+        if not isinstance(r, plates.PlateFormat):
+            r = plates.PlateFormat(r)
+        return r
+
+    @staticmethod
+    def _commands(source):
+        """@return commands.CommandBuffer for any worklist source"""
+        if isinstance(source, C.CommandBuffer):
+            return source
+        if isinstance(source, W.Worklist):
+            if source.commands is not None:
+                return source.commands
+            return W.readWorklist(str(source).splitlines())
+        return W.readWorklist(source)
+
+    def _events(self, rec, strings):
+        """
+        @return (order, labware, position, delta), one entry per change of
+                well volume; labware as str array
+        """
+        op = rec['op']
+        transfer = np.flatnonzero((op == C.OP_A) | (op == C.OP_D))
+        t = rec[transfer]
+
+        names = np.array(strings, dtype=object)
+        labware = names[np.where(t['label'] != 0, t['label'], t['rackid'])]
+        delta = np.where(t['op'] == C.OP_A, -t['volume'], t['volume'])
+
+        order = [transfer * 2]
+        lab, pos, dv = [labware], [t['pos']], [delta]
+
+        for i in np.flatnonzero(op == C.OP_R):
+            r = C.parseLine(strings[rec['text'][i]])
+            dst = np.setdiff1d(np.arange(r.dstPosStart, r.dstPosEnd + 1),
+                               r.excludeWells)
+            src = np.arange(r.srcPosStart, r.srcPosEnd + 1)
+            draw = -float(r.volume) * len(dst) / max(len(src), 1)
+
+            order += [np.full(len(src), 2 * i), np.full(len(dst), 2 * i + 1)]
+            lab += [np.full(len(src), r.srcRackLabel or r.srcRackID, object),
+                    np.full(len(dst), r.dstRackLabel or r.dstRackID, object)]
+            pos += [src, dst]
+            dv += [np.full(len(src), draw), np.full(len(dst), float(r.volume))]
+
+        return (np.concatenate(order), np.concatenate(lab).astype(str),
+                np.concatenate(pos), np.concatenate(dv))
+
+    @staticmethod
+    def _running(group, delta, start=None):
+        """
+        @return running total of delta within each group (in original order)
+        """
+        index = np.argsort(group, kind='stable')
+        g, d = group[index], delta[index]
+        total = np.cumsum(d)
+        first = np.ones(len(g), bool)
+        first[1:] = g[1:] != g[:-1]
+        base = (total - d)[first]
+        r = np.empty(len(d))
+        r[index] = total - np.repeat(base, np.diff(
+            np.append(np.flatnonzero(first), len(g))))
+        return r
+
+    def run(self, source, strict=False):
+        """
+        Simulate a worklist.
+        @param source: Worklist | commands.CommandBuffer | str | [str],
+                       worklist, file name or lines
+        @param strict: bool, raise SimulationError if there are issues [False]
+        @return Simulation
+        @raise SimulationError, with strict=True and any issue found
+        """
+        cb = self._commands(source)
+        rec = cb.records
+        issues = []
+
+        order, labware, pos, delta = self._events(rec, cb.strings)
+        index = order // 2  ## command index
+
+        ## well layout: one block of wells per labware
+        names = sorted(set(labware) | set(self._volume))
+        formats = [self.plateformat(name) for name in names]
+        sizes = np.array([f.n for f in formats], dtype=int)
+        offset = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        lab = np.searchsorted(names, labware)
+
+        bad = (pos < 1) | (pos > sizes[lab])
+        for i in np.flatnonzero(bad):
+            issues.append(Issue(int(index[i]), 'position', labware[i],
+                                int(pos[i]), 0.,
+                                'invalid position %i on %s' %
+                                (pos[i], labware[i])))
+        order, index, labware, pos, delta, lab = [
+            x[~bad] for x in (order, index, labware, pos, delta, lab)]
+
+        initial = np.zeros(offset[-1])
+        checked = np.zeros(len(names), bool)
+        capacity = np.full(offset[-1], np.inf)
+        for i, name in enumerate(names):
+            block = slice(offset[i], offset[i + 1])
+            volume = self._volume.get(name, self.defaultVolume)
+            if volume is not None:
+                volume = np.asarray(volume, float)
+                if volume.ndim == 2:  ## (rows, columns) -> Tecan order
+                    volume = volume.T.ravel()
+                initial[block] = volume
+                checked[i] = True
+            maxVolume = self._maxVolume.get(name) or self.maxVolume
+            if maxVolume is not None:
+                capacity[block] = maxVolume
+
+        ## well volumes, in order of execution
+        well = offset[lab] + pos - 1
+        sequence = np.argsort(order, kind='stable')
+        well, delta, index = well[sequence], delta[sequence], index[sequence]
+        volume = initial[well] + self._running(well, delta)
+
+        empty = (delta < 0) & (volume < -EPSILON) & checked[lab[sequence]]
+        for i in np.flatnonzero(empty):
+            name, position = self._well(well[i], names, offset)
+            issues.append(Issue(
+                int(index[i]), 'empty', name, position, float(volume[i]),
+                'aspirating %g ul from %s well %i containing %g ul'
+                % (-delta[i], name, position, volume[i] - delta[i])))
+
+        over = (delta > 0) & (volume > capacity[well] + EPSILON)
+        for i in np.flatnonzero(over):
+            name, position = self._well(well[i], names, offset)
+            issues.append(Issue(
+                int(index[i]), 'overfill', name, position, float(volume[i]),
+                'overfilling %s well %i with %g ul (max %g ul)'
+                % (name, position, volume[i], capacity[well[i]])))
+
+        issues += self._tipIssues(rec)
+        issues.sort(key=lambda x: x.index)
+
+        final = initial + np.bincount(well, weights=delta,
+                                      minlength=len(initial))
+        volumes = dict((name, final[offset[i]:offset[i + 1]].reshape(
+            formats[i].nx, formats[i].ny).T) for i, name in enumerate(names))
+
+        r = Simulation(issues, volumes,
+                       dict(zip(names, [bool(x) for x in checked])))
+        if strict and issues:
+            raise SimulationError(r.report())
+        return r
+
+    @staticmethod
+    def _well(well, names, offset):
+        """@return (str, int), labware and position of global well index"""
+        i = np.searchsorted(offset, well, side='right') - 1
+        return names[i], int(well - offset[i] + 1)
+
+    def _tipIssues(self, rec):
+        """dispense without (sufficient) aspiration, per tip channel"""
+        op = rec['op']
+        cycle = np.cumsum((op == C.OP_W) | (op == C.OP_F))
+        transfer = np.flatnonzero((op == C.OP_A) | (op == C.OP_D))
+        t = rec[transfer]
+        if not len(t):
+            return []
+
+        ## one row per command and tip channel (bit of the tip mask); the
+        ## last channel stands for the tip of commands without tip mask
+        mask = np.maximum(t['tipmask'], 0)
+        nbits = max(int(mask.max()).bit_length(), 1)
+        channels = (mask[:, None] >> np.arange(nbits)) & 1
+        channels = np.hstack([channels, (mask == 0)[:, None]])
+        row, channel = np.nonzero(channels)  ## in order of execution
+
+        delta = np.where(t['op'] == C.OP_A, t['volume'], -t['volume'])[row]
+        tip = cycle[transfer][row] * (nbits + 1) + channel
+        content = self._running(tip, delta)
+
+        r = []
+        failed = np.flatnonzero((delta < 0) & (content < -EPSILON))
+        ## report each command once, for its first failing channel
+        failed = failed[np.unique(row[failed], return_index=True)[1]]
+        for i in failed:
+            before = content[i] - delta[i]
+            if before > EPSILON:
+                msg = 'dispensing %g ul with only %g ul in tip' % (-delta[i],
+                                                                  before)
+            else:
+                msg = 'dispensing %g ul without aspirate' % -delta[i]
+            r.append(Issue(int(transfer[row[i]]), 'no aspirate', '', 0,
+                           float(content[i]), msg))
+        return r
+
+
+def simulate(source, **options):
+    """
+    Simulate a worklist (see Simulator).
+    @param source: Worklist | commands.CommandBuffer | str | [str]
+    @param options: keyword arguments for Simulator
+    @return Simulation
+    """
+    return Simulator(**options).run(source)
@@ -0,0 +1,313 @@
+##  evoware/py -- python modules for Evoware scripting
+##   Copyright 2014 Raik Gruenberg
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+
+"""Part index stored in a SQLite database"""
+
+import itertools
+import json
+import sqlite3
+
+from . import fileutil as F
+from . import plates
+from .cherrypicking import PartIndex, IndexEntry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, main TEXT);
+CREATE TABLE IF NOT EXISTS entries (key TEXT, plate TEXT, well TEXT,
+                                    data TEXT);
+CREATE TABLE IF NOT EXISTS params (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS plates (plate TEXT PRIMARY KEY,
+                                   n INTEGER, nx INTEGER, ny INTEGER);
+CREATE INDEX IF NOT EXISTS keys_main ON keys (main);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key, plate, well);
+CREATE INDEX IF NOT EXISTS entries_plate ON entries (plate, key);
+CREATE INDEX IF NOT EXISTS entries_well ON entries (plate, well);
+"""
+
+INSERT = 'INSERT INTO entries VALUES (?,?,?,?)'
+
+## skip entries already registered for the same part, plate and well
+INSERT_UNIQUE = 'INSERT INTO entries SELECT ?,?,?,? WHERE NOT EXISTS ' \
+                '(SELECT 1 FROM entries WHERE key=? AND plate=? AND well=?)'
+
+
+class SQLitePartIndex(PartIndex):
+    """
+    PartIndex that keeps its entries in a SQLite file instead of memory:
+
+    >>> parts = SQLitePartIndex('~/freezer.sqlite')
+    >>> parts.readExcel('plasmids.xls')  ## only needed once
+    >>> parts.close()
+
+    and in any later session:
+    >>> parts = SQLitePartIndex('~/freezer.sqlite')
+    >>> parts.position('sb0101', plate='SB10')
+    ('SB10', 'A1')
+
+    Opening an existing database only loads parameters and plate formats;
+    every lookup (__getitem__, position, entryAt, filterByPlate, ...) is a
+    query against indices on normalized ID, main ID (for relaxed lookups),
+    plate and well. Lookup results are the same as with the in-memory
+    PartIndex (IndexEntry records), including the order of matches.
+    filterByPlate returns a normal (in-memory) PartIndex.
+
+    With unique=True, entries for a part, plate and well that is already
+    registered are skipped, so that the same table can be read into an
+    existing database again without duplicating positions:
+
+    >>> parts = SQLitePartIndex('~/freezer.sqlite', unique=True)
+    >>> parts.readExcel('plasmids.xls')  ## adds only new positions
+
+    Entries are stored as JSON and must therefore consist of plain values
+    (which readExcel guarantees).
+    """
+
+    def __init__(self, dbfile=':memory:', plateformat=None, relaxedId=True,
+                 columns=None, unique=False):
+        """
+        @param dbfile: str, database file, created if needed [':memory:']
+        @param plateformat: plates.PlateFormat, default microplate format
+                            [PlateFormat(96)]
+        @param relaxedId: bool, fall back to matching by main ID only if
+                          sub-ID is not given (see BaseIndex)
+        @param columns: [str], additional table columns to store (see
+                        BaseIndex) [None, all columns]
+        @param unique: bool, skip entries for a part, plate and well that
+                       is already in the database [False]
+        """
+        super(SQLitePartIndex, self).__init__(plateformat=plateformat,
+                                              relaxedId=relaxedId,
+                                              columns=columns)
+        if dbfile != ':memory:':
+            dbfile = F.absfile(dbfile)
+        self.dbfile = dbfile
+        self.unique = unique
+        self._db = sqlite3.connect(dbfile)
+        self._db.executescript(SCHEMA)
+
+        for name, value in self._db.execute('SELECT name, value FROM params'):
+            self._params[name] = json.loads(value)
+        for plate, n, nx, ny in self._db.execute('SELECT * FROM plates'):
+            self._plates[plate] = plates.PlateFormat(n, nx, ny)
+
+    def close(self):
+        """close database connection"""
+        self._db.close()
+
+    def _rows(self, entries, counter):
+        """generate entries table rows, counting entries in counter[0]"""
+        for d in entries:
+            key = self.convertId((d['id'], d['sub-id']))
+            plate, well = self._wellkey(d.get('plate', ''), d.get('pos', ''))
+            counter[0] += 1
+            if self.unique:
+                yield key, plate, well, json.dumps(dict(d)), key, plate, well
+            else:
+                yield key, plate, well, json.dumps(dict(d))
+
+    def _insert(self, entries, settings=False):
+        """
+        Store entries (streamed, inside the current transaction). If
+        self.unique is set, entries that are already registered for the
+        same part, plate and well are skipped.
+        @param settings: bool, also save parameters and plate formats
+        @return int, number of entries read
+        """
+        last = self._query('SELECT MAX(rowid) FROM entries').fetchone()[0]
+        counter = [0]
+
+        self._db.executemany(INSERT_UNIQUE if self.unique else INSERT,
+                             self._rows(entries, counter))
+
+        ## register new part keys in order of first appearance
+        self._db.execute(
+            "INSERT OR IGNORE INTO keys SELECT key, CASE WHEN instr(key, '#') "
+            "THEN substr(key, 1, instr(key, '#') - 1) ELSE key END "
+            "FROM entries WHERE rowid > ? ORDER BY rowid", (last or 0,))
+
+        if settings:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO params VALUES (?, ?)',
+                [(k, json.dumps(v)) for k, v in self._params.items()])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO plates VALUES (?, ?, ?, ?)',
+                [(k, f.n, f.nx, f.ny) for k, f in self._plates.items()
+                 if k != 'default'])
+
+        return counter[0]
+
+    def addEntry(self, d):
+        """
+        Add new entry to the database (see PartIndex.addEntry).
+        """
+        with self._db:
+            self._insert([d])
+
+    def loadTable(self, preheader, entries):
+        """
+        Add parsed table content to the database, in a single transaction.
+        Entries are streamed into the database.
+        """
+        try:
+            for values in preheader:
+                self.parsePreHeader(values)
+
+            with self._db:
+                return self._insert(entries, settings=True)
+        finally:
+            self.closeEntries(entries)
+
+    def _reindex(self):
+        pass  ## indices are maintained by the database
+
+    def _query(self, sql, *args):
+        return self._db.execute(sql, args)
+
+    @staticmethod
+    def _load(data):
+        """@return IndexEntry, entry stored as JSON"""
+        return json.loads(data, object_hook=IndexEntry.fromDict)
+
+    def _entries(self, sql, *args):
+        """@return [IndexEntry], entries returned by query on data column"""
+        return [self._load(row[0]) for row in self._query(sql, *args)]
+
+    def _exists(self, key):
+        return self._query('SELECT 1 FROM keys WHERE key=?',
+                           key).fetchone() is not None
+
+    def _key(self, item):
+        """
+        @return str, index key matching ID or (ID, sub-ID)
+        @raise KeyError, if given ID doesn't match any registered part
+        """
+        id = self.convertId(item)
+        if self._exists(id):
+            return id
+        if self.relaxedId:
+            r = self._query('SELECT key FROM keys WHERE main=? '
+                            'ORDER BY rowid LIMIT 1', id).fetchone()
+            if r:
+                return r[0]
+        raise KeyError(id)
+
+    def __getitem__(self, item):
+        """
+        PartIndex[partID] -> [ {'plate':str, 'pos':str, 'barcode':str } ]
+        @raise KeyError, if given ID doesn't match any registered part
+        """
+        return self._entries('SELECT data FROM entries WHERE key=? '
+                             'ORDER BY rowid', self._key(item))
+
+    def __len__(self):
+        """len(partindex) -> int, number of registered positions"""
+        return self._query('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def keys(self):
+        return [row[0] for row in
+                self._query('SELECT key FROM keys ORDER BY rowid')]
+
+    def items(self):
+        """iterate over (key, [entries]) without loading the whole table"""
+        rows = self._query('SELECT keys.key, data FROM entries JOIN keys '
+                           'ON entries.key = keys.key '
+                           'ORDER BY keys.rowid, entries.rowid')
+        for key, group in itertools.groupby(rows, lambda row: row[0]):
+            yield key, [self._load(row[1]) for row in group]
+
+    def values(self):
+        return (entries for key, entries in self.items())
+
+    def position(self, id, subid='', plate=None, default=None):
+        """
+        Return plate and position of first match to given ID, and, if given,
+        plate (see PartIndex.position).
+        @param id [, subid]: str, ID and optional sub-ID
+        @param plate: str or [str], optional plate ID or several plate IDs
+        @default: optional default return value
+        @return: (str,str), tuple of (plateID, position)
+        """
+        id = self.convertId((id, subid))
+
+        if default is not None and not self._exists(id):
+            return default
+
+        key = self._key(id)
+
+        if plate:
+            if not type(plate) in [list, tuple]:
+                plate = [plate]
+            plate = [self.clean2str(x) for x in plate]
+
+            r = self._entries(
+                'SELECT data FROM entries WHERE key=? AND plate IN (%s) '
+                'ORDER BY rowid LIMIT 1' % ','.join('?' * len(plate)),
+                key, *plate)
+            if r:
+                return r[0]['plate'], r[0]['pos']
+
+            if default:
+                return default
+
+            raise KeyError('no entry found for ID %s in plate(s) %r'
+                           % (id, plate))
+
+        r = self._entries('SELECT data FROM entries WHERE key=? '
+                          'ORDER BY rowid LIMIT 1', key)
+        return r[0]['plate'], r[0]['pos']
+
+    def entryAt(self, plate, pos, default=None):
+        """
+        Look up which part is stored in a given well (see PartIndex.entryAt).
+        """
+        plate = self.clean2str(plate)
+        sql = 'SELECT data FROM entries WHERE plate=? AND well=? ' \
+              'ORDER BY rowid LIMIT 1'
+        r = self._entries(sql, *self._wellkey(plate, pos))
+
+        if not r and isinstance(pos, int):  ## table may use 'A1' style
+            pos = self.plateFormat(plate).int2human(pos)
+            r = self._entries(sql, *self._wellkey(plate, pos))
+
+        if r:
+            return r[0]
+        if default is None:
+            raise KeyError('no entry found in plate %s, well %s'
+                           % (plate, pos))
+        return default
+
+    def plateIDs(self):
+        """@return [str], IDs of all plates with entries"""
+        return [row[0] for row in self._query(
+            'SELECT plate FROM entries GROUP BY plate ORDER BY MIN(rowid)')]
+
+    def filterByPlate(self, plateID):
+        """
+        @return PartIndex, in-memory sub-index of all partIDs assigned to
+                given plate
+        """
+        p = PartIndex(relaxedId=self.relaxedId, columns=self.columns)
+        p._params = dict(self._params)
+        p._plates = dict(self._plates)
+
+        ## keys in order of first registration, as in PartIndex.filterByPlate
+        for d in self._entries(
+                'SELECT data FROM entries JOIN keys '
+                'ON entries.key = keys.key WHERE plate=? '
+                'ORDER BY keys.rowid, entries.rowid',
+                self.clean2str(plateID)):
+            p.addEntry(d)
+
+        return p
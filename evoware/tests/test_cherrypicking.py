@@ -1,9 +1,16 @@
 import unittest
+import inspect
 from os import path
 import tempfile
+from unittest import mock
 from .. import fileutil as F
-from ..cherrypicking import TargetIndex, PartIndex, CherryWorklist
+from .. import cherrypicking as C
+from ..cherrypicking import TargetIndex, PartIndex, CherryWorklist, \
+    SourceAllocator, SourceShortageError, IndexCache, IndexFileError, \
+    IndexEntry
+from ..sqlindex import SQLitePartIndex
 from .. import plates
+from .. import optimize as O
 
 
 class Test(unittest.TestCase):
@@ -66,3 +73,361 @@ class Test(unittest.TestCase):
         cwl.toWorklist(byLabel=True, volume=10)
 
         cwl.close()
+
+    def test_optimized_worklist(self):
+        parts = PartIndex()
+        parts.readExcel(self.f_parts)
+        parts.readExcel(self.f_primers)
+
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+        t.readExcel(self.f_pcr)
+
+        cwl = CherryWorklist(None, t, parts)
+        transfers = cwl.resolve(volume=10)
+        self.assertEqual(transfers[0].column, 'template')
+        self.assertEqual(transfers[0].volume, 2)
+
+        phases = [['template'], ['primer1', 'primer2']]
+        cwl.toWorklist(volume=10, optimize=True, phases=phases)
+
+        before, after = cwl.report['labware switches']
+        self.assertEqual(before, O.labwareSwitches(transfers))
+        self.assertTrue(after < before)
+
+        ## same transfers, all templates first
+        r = O.reorder(transfers, phases)
+        self.assertEqual(sorted(r), sorted(transfers))
+        self.assertEqual(O.labwareSwitches(r), after)
+        ntemplates = len([x for x in transfers if x.column == 'template'])
+        self.assertTrue(all(x.column == 'template' for x in r[:ntemplates]))
+
+        lines = [l for l in str(cwl.wl).splitlines() if l[0] in 'AD']
+        self.assertEqual(len(lines), 2 * len(transfers))
+        self.assertEqual(lines[0], 'A;%s;;;%i;;2;' % (r[0].srcID, r[0].srcPos))
+
+        self.assertEqual([label for label, t in cwl.estimate().phases],
+                         ['Processing source column template',
+                          'Processing source column primer1, primer2'])
+
+    def test_deck_batches(self):
+        parts = PartIndex()
+        parts.readExcel(self.f_parts)
+        parts.readExcel(self.f_primers)
+
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+        t.readExcel(self.f_pcr)
+
+        cwl = CherryWorklist(None, t, parts)
+        cwl.toWorklist(volume=10, maxPlates=2, fixedPlates=['SBO40'])
+
+        self.assertEqual(cwl.report['deck batches'],
+                         [['SB11', 'SBO40'], ['SB10', 'SBO40']])
+        lines = str(cwl.wl).splitlines()
+        self.assertEqual(lines.count('B;'), 1)
+        self.assertEqual(lines[0],
+                         'C; Batch 1 of 2: load source plates SB11, SBO40')
+
+    def test_source_allocator(self):
+        parts = PartIndex()
+        parts.readExcel(self.f_parts)
+
+        a = SourceAllocator(parts, defaultVolume=20, deadVolume=5)
+        r = [a.allocate('sb0111', volume=5) for i in range(4)]
+        self.assertEqual(r, [('SB10', 'H1'), ('SB10', 'H2')] * 2)
+        a.check()
+        self.assertEqual(a.remaining('SB10', 'H1'), 5)
+
+        a.allocate('sb0111', volume=5)
+        a.allocate('sb0111', volume=10)  ## no single well has enough
+        self.assertRaises(SourceShortageError, a.check)
+        self.assertEqual(a.remaining('SB10', 'H1'), 5)  ## rolled back
+
+        parts.readExcel(self.f_primers)
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+        t.readExcel(self.f_pcr)
+
+        cwl = CherryWorklist(None, t, parts,
+                             allocator=SourceAllocator(parts, 30))
+        try:
+            cwl.toWorklist(volume=10)
+            self.fail('expected SourceShortageError')
+        except SourceShortageError as why:
+            self.assertTrue(why.shortages[0].startswith('sbo0001: '))
+        self.assertEqual(str(cwl.wl), '')
+
+        cwl.allocator = SourceAllocator(parts, 1000)
+        cwl.toWorklist(volume=10)
+        self.assertTrue(str(cwl.wl))
+
+    def test_relaxed_lookup(self):
+        p = PartIndex()
+        p.readExcel(self.f_parts)
+
+        ## first sub-ID registered for main ID
+        self.assertEqual(p['sb0101'], p['sb0101#2'])
+        self.assertEqual(p.position('SB0102'), p.position('sb0102', '1'))
+
+        f = p.filterByPlate('SB10')
+        self.assertEqual(f['sb0101'], p['sb0101#2'])
+
+        p.addEntry({'id': 'new', 'sub-id': 'b', 'plate': 'X', 'pos': 'A1'})
+        p.addEntry({'id': 'new', 'sub-id': 'a', 'plate': 'X', 'pos': 'A2'})
+        self.assertEqual(p.position('new'), ('X', 'A1'))
+
+        p.relaxedId = False
+        self.assertRaises(KeyError, p.__getitem__, 'sb0101')
+
+    def test_plate_index(self):
+        p = PartIndex()
+        p.readExcel(self.f_parts)
+        p.readExcel(self.f_primers)
+
+        self.assertEqual(p.entryAt('SB10', 'a5'), p['sb0102#2'][0])
+        self.assertEqual(p.entryAt('SB10', 33), p['sb0102#2'][0])
+        self.assertEqual(p.entryAt('SB10', 'B2', default={}), {})
+        self.assertRaises(KeyError, p.entryAt, 'SB10', 'B2')
+        self.assertEqual(set(p.plateIDs()), set(['SB10', 'SB11', 'SBO40']))
+
+        f = p.filterByPlate('SB11')
+        self.assertEqual(len(f), sum(len(e) for e in p.values()
+                                     if e[0]['plate'] == 'SB11'))
+        self.assertEqual(f.plateIDs(), ['SB11'])
+        self.assertEqual(f.plateFormat('SB11'), plates.PlateFormat(384))
+        self.assertEqual(len(p.filterByPlate('nothing')), 0)
+
+        self.assertEqual(p.position('sb0111', plate='SB10'), ('SB10', 'H1'))
+        self.assertEqual(p.position('sb0111', plate=['x', 'SB10']),
+                         ('SB10', 'H1'))
+        self.assertRaises(KeyError, p.position, 'sb0111', plate='SB11')
+
+    def test_index_cache(self):
+        import shutil
+        folder = tempfile.mkdtemp(prefix='test_indexcache_')
+        try:
+            cache = IndexCache(folder)
+            ref = PartIndex()
+            ref.readExcel(self.f_parts)
+
+            p = PartIndex()
+            self.assertEqual(p.readExcel(self.f_parts, cache=cache), 27)
+            self.assertEqual(len(cache._entries()), 1)
+
+            p2 = PartIndex()
+            p2.parseExcel = None  ## a cache hit must not parse the file
+            self.assertEqual(p2.readExcel(self.f_parts, cache=cache), 27)
+            for index in (p, p2):
+                self.assertEqual(dict(index.items()), dict(ref.items()))
+                self.assertEqual(index._plates, ref._plates)
+
+            t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+            t.readExcel(self.f_pcr, cache=cache)
+            t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+            t.readExcel(self.f_pcr, cache=cache)
+            self.assertEqual(t._volume['template'], 2)
+            self.assertEqual(len(cache._entries()), 2)
+
+            cache.invalidate(self.f_pcr)
+            self.assertEqual(len(cache._entries()), 1)
+
+            cache.maxSize = cache.size() - 1
+            cache.evict()
+            self.assertEqual(cache.size(), 0)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_readMany(self):
+        ref = PartIndex()
+        ref.readExcel(self.f_parts)
+        ref.readExcel(self.f_primers)
+
+        for workers in (1, 2):
+            p = PartIndex()
+            self.assertEqual(p.readMany([self.f_parts, self.f_primers],
+                                        workers=workers), len(ref))
+            self.assertEqual(list(p.items()), list(ref.items()))
+            self.assertEqual(p._plates, ref._plates)
+            self.assertEqual(p._params, ref._params)
+
+        p = PartIndex()
+        p._plates['SB11'] = plates.PlateFormat(96)
+        self.assertRaises(IndexFileError, p.readMany, [self.f_parts])
+
+        ## a file may re-declare a plate format, the last declaration wins
+        class Redeclared(PartIndex):
+            def parseExcel(self, fname):
+                preheader, entries = PartIndex.parseExcel(self, fname)
+                return [['format', 'SB11', 96]] + preheader, entries
+
+        p, ref = Redeclared(), PartIndex()  ## ref: serial, like readExcel
+        ref.loadTable(*p.parseExcel(self.f_parts))
+        self.assertEqual(p.readMany([self.f_parts], workers=1), len(ref))
+        self.assertEqual(p._plates, ref._plates)
+        self.assertEqual(p.plateFormat('SB11'), plates.PlateFormat(384))
+
+    def test_columns(self):
+        p = PartIndex(columns=[])
+        p.readExcel(self.f_parts)
+        ref = PartIndex()
+        ref.readExcel(self.f_parts)
+        self.assertEqual(len(p), len(ref))
+        for key in ref.keys():
+            for d, d_ref in zip(p[key], ref[key]):
+                self.assertEqual(d, dict((k, d_ref[k]) for k in d_ref
+                                         if k in PartIndex.KEY_COLUMNS))
+
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'],
+                        columns=['size'])
+        t.readExcel(self.f_pcr)
+        d = list(t.values())[0]
+        self.assertEqual(set(d), set(TargetIndex.KEY_COLUMNS) |
+                         set(['template', 'primer1', 'primer2', 'size']))
+        self.assertEqual(t._volume['primer1'], 5)
+
+    def test_close_entries(self):
+        """loadTable releases the input file if the pre-header fails"""
+        for p in (PartIndex(), SQLitePartIndex()):
+            preheader, entries = p.iterExcel(self.f_parts)
+            self.assertRaises(IndexFileError, p.loadTable, [['param']],
+                              entries)
+            self.assertEqual(inspect.getgeneratorstate(entries),
+                             inspect.GEN_CLOSED)
+
+    def test_readCSV(self):
+        ref = PartIndex()
+        ref.readExcel(self.f_parts)
+        p = PartIndex()
+        self.assertEqual(p.readTable(self.f_parts[:-3] + 'csv'), len(ref))
+        self.assertEqual(dict(p.items()), dict(ref.items()))
+        self.assertEqual(p._plates, ref._plates)
+        self.assertEqual(p._params, ref._params)
+
+        ref = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+        ref.readTable(self.f_pcr)
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'],
+                        columns=[])
+        with open(self.f_pcr[:-3] + 'tsv') as f:  ## open file or pipe
+            t.readCSV(f, delimiter='\t')
+        self.assertEqual(list(t.keys()), list(ref.keys()))
+        self.assertEqual(t._volume, ref._volume)
+        self.assertEqual(t['sbf0100']['primer2'], 'sbo0002')
+        self.assertFalse('comment' in t['sbf0100'])
+
+        import io
+        p = PartIndex()
+        p.readCSV(io.StringIO('param,a,nan\nparam,b,1e3\nparam,c,12.0\n'
+                              'ID,plate,pos,sub-id\nx1,P1,A1,\n'))
+        self.assertEqual(p._params, {'a': 'nan', 'b': '1e3', 'c': 12})
+
+        ## table values are cleaned like Excel cells
+        p = PartIndex()
+        p.readCSV(io.StringIO('ID,sub-id,plate,pos,barcode\n'
+                              '12.0, 2.0 ,10,A1,0012.50\n'))
+        self.assertEqual(dict(p['12#2'][0]),
+                         {'id': '12', 'sub-id': '2', 'plate': '10',
+                          'pos': 'A1', 'barcode': '12.5'})
+        self.assertEqual(p.position(12, 2), ('10', 'A1'))
+
+        ## file opened by name is closed if the header cannot be parsed
+        class BadHeader(PartIndex):
+            def parseHeader(self, values):
+                raise IndexFileError('bad header')
+
+        files = []
+        def fopen(*args, **kw):
+            files.append(open(*args, **kw))
+            return files[-1]
+
+        with mock.patch.object(C, 'open', fopen, create=True):
+            self.assertRaises(IndexFileError, BadHeader().readCSV,
+                              self.f_parts[:-3] + 'csv')
+        self.assertTrue(files[0].closed)
+
+    def test_indexEntry(self):
+        import pickle
+        p = PartIndex()
+        p.readExcel(self.f_parts)
+        d = p['sb0101#2'][0]
+
+        self.assertTrue(isinstance(d, IndexEntry))
+        self.assertEqual(d['plate'], 'SB10')
+        self.assertEqual(d.get('nothing', 'x'), 'x')
+        self.assertTrue('pos' in d and not 'x' in d)
+        self.assertRaises(KeyError, d.__getitem__, 'x')
+        self.assertEqual(dict(d), dict(zip(d.keys(), d.values())))
+        self.assertEqual(d, dict(d))
+        self.assertEqual(pickle.loads(pickle.dumps(d)), d)
+        self.assertTrue(type(p['sb0102#2'][0]) is type(d))  ## shared schema
+
+        def modify():
+            d['plate'] = 'x'
+        self.assertRaises(TypeError, modify)  ## read-only
+
+    def test_resolve_pairs(self):
+        t = TargetIndex(srccolumns=['template', 'primer1', 'primer2'])
+        t.readExcel(self.f_pcr)
+
+        parts = PartIndex()
+        parts.readExcel(self.f_primers)
+        for i, d in enumerate(t.values()):  ## templates by (ID, size)
+            parts.addEntry({'id': d['template'], 'sub-id': d['size'],
+                            'plate': 'T1', 'pos': str(i + 1)})
+
+        cwl = CherryWorklist(None, t, parts)
+        transfers = cwl.resolve(srccolumns=[['template', 'size'], 'primer1'])
+        self.assertEqual(len(transfers), 2 * len(t))
+        first = transfers[0]
+        self.assertEqual(first.column, ('template', 'size'))
+        self.assertEqual(first.volume, 2)  ## volume of 'template'
+        self.assertEqual((first.srcID, first.srcPos), ('T1', 1))
+        self.assertEqual(transfers[-1].column, 'primer1')
+
+        cwl.toWorklist(srccolumns=[('template', 'size'), 'primer1'])
+        lines = str(cwl.wl).splitlines()
+        self.assertEqual(len([l for l in lines if l.startswith('A;')]),
+                         2 * len(t))
+
+    def test_distribute_order(self):
+        T = O.Transfer
+        transfers = [T('x', 1, 'dst', 1, 5, column='c'),
+                     T('x', 2, 'dst', 2, 5, column='c')] + \
+                    [T('src', 1, 'dst', i, 5, column='c')
+                     for i in (3, 4, 5, 6)] + \
+                    [T('x', 3, 'dst', 7, 5, column='c')]
+
+        for channels, expected in ((1, 'ADADRAD'), (8, 'AADDRAD')):
+            cwl = CherryWorklist(None, TargetIndex(), PartIndex())
+            cwl._writeTransfers(transfers, ['c'], byLabel=False,
+                                optimize=False, phases=None,
+                                channels=channels, tipVolume=None,
+                                distribute=True)
+            ops = [l[0] for l in str(cwl.wl).splitlines()
+                   if l[0] in 'ADR']
+            self.assertEqual(''.join(ops), expected)
+
+        ## only the transfers that were not replaced by R count
+        self.assertEqual(cwl.report['tip batches'], (3, 2))
+
+    def test_rack_fields(self):
+        """A, D and R lines address racks in the same (RackLabel) field"""
+        T = O.Transfer
+        transfers = [T('x', 1, 'dst', 1, 5, column='c'),
+                     T('x', 1, 'dst', 2, 5, column='c')] + \
+                    [T('src', 1, 'dst', i, 5, column='c')
+                     for i in (3, 4, 5, 6)]
+
+        for byLabel in (False, True):
+            for channels, tipVolume in ((1, None), (8, None), (1, 20)):
+                cwl = CherryWorklist(None, TargetIndex(), PartIndex())
+                cwl._writeTransfers(transfers, ['c'], byLabel=byLabel,
+                                    optimize=False, phases=None,
+                                    channels=channels, tipVolume=tipVolume,
+                                    distribute=True)
+                lines = [l.split(';') for l in str(cwl.wl).splitlines()
+                         if l[0] in 'ADR']
+                self.assertEqual(sorted(set(l[0] for l in lines)),
+                                 ['A', 'D', 'R'])
+                for l in lines:
+                    self.assertTrue(l[1] in ('x', 'src', 'dst'), l)
+                    self.assertEqual(l[2], '')
+                    if l[0] == 'R':
+                        self.assertEqual(l[6:8], ['dst', ''])
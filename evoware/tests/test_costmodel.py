@@ -0,0 +1,37 @@
+import unittest
+
+from ..worklist import Worklist
+from ..costmodel import CostModel, estimate
+
+
+class Test(unittest.TestCase):
+    """Test runtime cost model"""
+
+    def test_estimate(self):
+        model = CostModel(aspirate=3, dispense=2, perUl=0.1, wash=10,
+                          flush=0, labwareSwitch=1,
+                          liquidClasses={'slow': 2.0})
+
+        with Worklist() as wl:
+            wl.comment('first')
+            wl.transfer('src', 1, 'dst', 1, 10)
+            wl.transfer('src', 2, 'dst', 2, 10, liquidClass='slow')
+            wl.write('B;')
+            wl.transferColumn('src', 1, 'dst', 1, 10, parallel=True)
+
+        r = model.estimate(wl)
+        ## A + switch + D + W per transfer, 'slow' doubles A and D
+        first = (4 + 1 + 3 + 10) + (1 + 8 + 1 + 6 + 10)
+        ## 8 tips in parallel, one switch between A and D, one wash
+        parallel = 1 + 4 + 1 + 3 + 10
+        self.assertEqual(r.phases, [('first', first), ('B;', parallel)])
+        self.assertAlmostEqual(r.total, first + parallel)
+        self.assertEqual(r.categories['wash'], 30)
+        self.assertEqual(float(r), r.total)
+
+        lines = str(wl).splitlines()
+        self.assertAlmostEqual(model.estimate(lines).total, r.total)
+
+        with Worklist() as wl:
+            wl.transferColumn('src', 1, 'dst', 1, 10)
+        self.assertTrue(estimate(wl).total > 5 * estimate(lines[-18:]).total)
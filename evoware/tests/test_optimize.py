@@ -0,0 +1,122 @@
+import unittest
+
+from .. import optimize as O
+from .. import commands as C
+from ..worklist import Worklist, iterWorklist
+from ..optimize import WashRules
+
+
+class Test(unittest.TestCase):
+    """Test optimization passes"""
+
+    def test_distributeRuns(self):
+        with Worklist() as wl:
+            for pos in [1, 2, 3, 5, 6]:
+                wl.transfer('src', 1, 'dst', pos, 10)
+            wl.comment('next')
+            for pos in [1, 2, 3, 4, 5]:
+                wl.transfer('src', pos, 'dst', pos, 10)  ## plate copy
+            lines = str(wl).splitlines()
+
+        items = O.fromCommands(iterWorklist(lines))
+        self.assertEqual(len(items), 11)
+        self.assertEqual(items[0], O.Transfer('src', 1, 'dst', 1, 10))
+        self.assertEqual([str(c) for c in O.toCommands(items)], lines)
+
+        r = O.distributeRuns(items)
+        self.assertEqual(len(r), 7)
+        self.assertEqual(str(r[0]), 'R;src;;;1;1;dst;;;1;6;10;;1;1;0;4')
+        self.assertEqual(r[1], C.Comment('next'))
+        self.assertEqual(r[2:], items[6:])
+
+        self.assertEqual(O.lineCount(items), 31)
+        self.assertEqual(O.lineCount(r), 17)
+        self.assertTrue(O.estimateSeconds(r) < O.estimateSeconds(items))
+
+        r = O.distributeRuns(items, nMultiDisp=5)
+        self.assertTrue(O.estimateSeconds(r) < O.estimateSeconds(items))
+
+        with Worklist() as wl:
+            wl.distribute(**r[0]._asdict())
+            self.assertEqual(str(wl).strip(), str(r[0]))
+
+    def test_washRules(self):
+        with Worklist() as wl:
+            wl.transfer('src', 1, 'dst', 1, 10)
+            wl.transfer('src', 1, 'dst', 2, 10)  ## same well
+            wl.transfer('src', 2, 'dst', 3, 10)  ## same reagent class
+            wl.transfer('src', 3, 'dst', 1, 10)  ## other reagent into dst 1
+            wl.transfer('src', 3, 'dst', 4, 10)  ## dst 1 was contaminated
+            wl.transfer('src', 3, 'dst', 5, 10)
+            lines = str(wl).splitlines()
+        commands = list(iterWorklist(lines))
+
+        reagents = {('src', 1): 'buffer', ('src', 2): 'buffer'}
+        rules = WashRules(reagents=reagents)
+        r, decisions = rules.apply(commands, dryRun=True)
+        self.assertEqual(r, commands)
+        self.assertEqual([d.removed for d in decisions],
+                         [True, True, False, False, True, False])
+        self.assertTrue('same reagent class' in decisions[1].reason)
+        self.assertTrue('contaminated well dst:1' in decisions[3].reason)
+        self.assertEqual(len(rules.report(decisions).splitlines()), 6)
+
+        r, decisions = rules.apply(commands)
+        self.assertEqual(len(r), len(commands) - 3)
+        self.assertEqual(r[2], commands[3])
+
+        rules = WashRules(maxReuse=2, reagents=reagents)
+        r, decisions = rules.apply(commands)
+        self.assertEqual([d.removed for d in decisions],
+                         [True, False, False, False, True, False])
+        self.assertTrue('max reuse' in decisions[1].reason)
+
+    def test_washRules_large(self):
+        calls = [0]
+
+        def counted(rule):
+            def f(tip, a):
+                calls[0] += 1
+                return rule(tip, a)
+            return f
+
+        for n in (2000, 20000):
+            with Worklist() as wl:
+                for i in range(n):
+                    wl.transfer('src', i % 4 + 1, 'dst', i % 96 + 1, 10)
+            c = list(iterWorklist(str(wl).splitlines()))
+
+            rules = WashRules()
+            rules.rules = [counted(rule) for rule in rules.rules]
+            calls[0] = 0
+            r, decisions = rules.apply(c)
+
+            ## every wash is decided once, by at most one call per rule
+            self.assertEqual(len(decisions), n)
+            self.assertTrue(0 < calls[0] <= len(rules.rules) * n)
+
+    def test_deckBatches(self):
+        t = [O.Transfer('P1', 1, 'dst', 1, 5, target='a'),
+             O.Transfer('mix', 1, 'dst', 1, 5, target='a'),
+             O.Transfer('P2', 1, 'dst', 2, 5, target='b'),
+             O.Transfer('P1', 2, 'dst', 3, 5, target='c'),
+             O.Transfer('P3', 2, 'dst', 3, 5, target='c'),
+             O.Transfer('P2', 3, 'dst', 4, 5, target='d'),
+             O.Transfer('P3', 3, 'dst', 4, 5, target='d')]
+
+        r = O.deckBatches(t, 3, fixedPlates=['mix'])
+        self.assertEqual(len(r), 2)
+        self.assertEqual(sorted(x for b in r for x in b.transfers), sorted(t))
+        for b in r:
+            self.assertTrue(len(set(b.plates) - set(['mix'])) <= 2)
+
+        self.assertEqual(len(O.deckBatches(t, 4)), 1)
+        self.assertRaises(O.DeckError, O.deckBatches, t, 1)
+        self.assertRaises(O.DeckError, O.deckBatches, t, 2, ['mix', 'x', 'y'])
+
+        ## 3000 targets with two of 200 source plates each
+        t = [O.Transfer('P%i' % ((i * k) % 200), 1, 'dst', 1, 5, target=i)
+             for i in range(3000) for k in (1, 7)]
+        r = O.deckBatches(t, 20)
+        self.assertEqual(sum(len(b.transfers) for b in r), len(t))
+        self.assertTrue(all(len(b.plates) <= 20 for b in r))
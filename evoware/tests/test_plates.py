@@ -1,5 +1,11 @@
 import unittest
-from ..plates import PlateFormat
+import time
+import copy
+import pickle
+
+import numpy as np
+
+from ..plates import PlateFormat, PlateError, WellSet, compileRange
 
 class Test(unittest.TestCase):
     """Test PlateFormat"""
@@ -45,3 +51,163 @@ class Test(unittest.TestCase):
         self.assertTrue(f1 == f2)
         self.assertFalse(f2 == f3)
         self.assertEqual(f1, f2)
+
+    def test_plateformat_arrays(self):
+        f = PlateFormat(384)
+        wells = ['A1', 'b1', 'P1', 'a2', 'P24', 'c07', '17', 'x']
+
+        for w in wells[:-1]:
+            self.assertEqual(f.human2int_array([w])[0], f.human2int(w))
+
+        self.assertRaises(PlateError, f.human2int_array, wells)
+        self.assertRaises(PlateError, f.human2int_array, ['A25'])
+        self.assertRaises(PlateError, f.human2int_array, [0, 1])
+
+        ints = np.arange(1, f.n + 1)
+        names = f.int2human_array(ints)
+        self.assertEqual(names[0], 'A1')
+        self.assertEqual(names[-1], 'P24')
+        self.assertTrue((f.human2int_array(names) == ints).all())
+
+        rows, cols = f.int2gridindex_array(ints)
+        self.assertTrue((f.gridindex2int_array(rows, cols) == ints).all())
+        self.assertRaises(PlateError, f.gridindex2int_array, [16], [0])
+
+    def test_plateformat_scalar_vs_array(self):
+        for n in (96, 384, 1536):
+            f = PlateFormat(n)
+            ints = np.arange(1, n + 1)
+            names = f.int2human_array(ints).tolist()
+
+            rows, cols = f.int2gridindex_array(ints)
+            self.assertEqual([f.int2gridindex(i) for i in ints.tolist()],
+                             list(zip(rows.tolist(), cols.tolist())))
+            self.assertEqual([f.human2int(x) for x in names],
+                             f.human2int_array(names).tolist())
+
+            beyond = {96: 'I1', 384: 'Q1', 1536: 'AG1'}[n]  ## row ny + 1
+            invalid = ['A0', beyond, 'A%i' % (f.nx + 1), '0', str(n + 1),
+                       'x', -1]
+            for pos in invalid:
+                self.assertRaises(PlateError, f.human2int, pos)
+                self.assertRaises(PlateError, f.human2int_array, [pos])
+
+    def test_plateformat_array_lookup(self):
+        f = PlateFormat(384)
+        names = np.tile(f.wellnames, 200)
+        ref = [f.human2int(x) for x in names.tolist()]
+
+        ## wide dtype, list, mixed case / zero padding and non-table entries
+        self.assertEqual(f.human2int_array(names.astype('U22')).tolist(), ref)
+        self.assertEqual(f.human2int_array(names.tolist()).tolist(), ref)
+        mixed = ['a01', 'P024', 7, '17', 'b3 ', 'A1']
+        self.assertEqual(f.human2int_array(mixed).tolist(),
+                         [f.human2int(x) for x in mixed])
+        self.assertEqual(f.human2int_array(np.array([['A2'], ['b1']])).shape,
+                         (2, 1))
+        self.assertRaises(PlateError, f.human2int_array, ['A1', 'A1000'])
+
+        ## the point of the array version: faster than a loop of human2int
+        t = time.perf_counter()
+        f.human2int_array(names)
+        t_array = time.perf_counter() - t
+
+        t = time.perf_counter()
+        [f.human2int(x) for x in names.tolist()]
+        t_loop = time.perf_counter() - t
+        self.assertLess(t_array, t_loop)
+
+    def test_plateformat_1536(self):
+        f = PlateFormat(1536)  ## 32 rows: A..Z, AA..AF
+        self.assertEqual(f.int2human(26), 'Z1')
+        self.assertEqual(f.int2human(27), 'AA1')
+        self.assertEqual(f.int2human(1536), 'AF48')
+        self.assertEqual(f.human2int('ab2'), 60)
+        self.assertEqual(f.human2int('AF48'), 1536)
+
+        ints = np.arange(1, f.n + 1)
+        names = f.int2human_array(ints)
+        self.assertEqual([f.human2int(x) for x in names], ints.tolist())
+        self.assertTrue((f.human2int_array(names) == ints).all())
+        self.assertTrue(
+            (f.human2int_array(np.char.lower(names)) == ints).all())
+
+        self.assertEqual(list(WellSet.row(f, 'af'))[:2], [32, 64])
+        self.assertRaises(PlateError, WellSet.row, f, 'AG')
+        self.assertEqual(len(f.range2int('rows AA-AF')), 6 * 48)
+
+    def test_plateformat_registry(self):
+        f = PlateFormat(96)
+        self.assertTrue(f is PlateFormat(96, nx=12, ny=8))
+        self.assertFalse(f is PlateFormat(96, nx=1, ny=96))
+        self.assertTrue(pickle.loads(pickle.dumps(f)) is f)
+        self.assertTrue(copy.deepcopy(f) is f)
+
+        ## interned instances are shared and must not change
+        for attr in ('n', 'nx', 'ny'):
+            self.assertRaises(AttributeError, setattr, f, attr, 3)
+        self.assertEqual((f.n, f.nx, f.ny), (96, 12, 8))
+
+        d = {f: 'a', PlateFormat(384): 'b'}
+        self.assertEqual(d[PlateFormat(96)], 'a')
+
+        self.assertEqual(f.human2int('B07'), f.human2int('B7'))
+        self.assertEqual(f.human2int('b07'), 50)
+        self.assertEqual(f.wellindex['h12'], 96)
+        self.assertEqual(f.int2human(50), 'B7')
+
+        f = PlateFormat(1536)
+        self.assertEqual(f.int2human(1536 - 32 + 26), 'Z48')
+        self.assertEqual(f.int2human(1536), 'AF48')
+
+        ## cached name tables are sized to the longest well name
+        self.assertEqual(PlateFormat(96).wellnames.dtype.itemsize, 3 * 4)
+        self.assertEqual(f.wellnames.dtype.itemsize, 4 * 4)
+
+    def test_wellset(self):
+        f = PlateFormat(384)
+        quadrants = [WellSet.quadrant(f, q) for q in (1, 2, 3, 4)]
+
+        self.assertEqual([len(q) for q in quadrants], [96] * 4)
+        self.assertEqual(quadrants[0] | quadrants[1] | quadrants[2] |
+                         quadrants[3], WellSet.all(f))
+        self.assertFalse(quadrants[0] & quadrants[3])
+        self.assertTrue('B2' in quadrants[3])
+        self.assertEqual(list(quadrants[2])[:2], [2, 4])
+
+        s = WellSet.rectangle(f, 'C5', 'B3') - WellSet.row(f, 'C')
+        self.assertEqual(s.humans().tolist(), ['B3', 'B4', 'B5'])
+        self.assertEqual(~~s, s)
+        self.assertEqual(s ^ ['B3', 'A1'], WellSet(f, ['A1', 'B4', 'B5']))
+        self.assertEqual(len(WellSet.column(f, 24)), 16)
+
+        self.assertRaises(PlateError, WellSet.row, f, 'Q')
+        self.assertRaises(PlateError, WellSet.column, f, 25)
+        self.assertRaises(PlateError, s.union, WellSet.all(PlateFormat(96)))
+
+        self.assertEqual(WellSet(f, range(3, 17)).excludeWells(1, 18),
+                         [1, 2, 17, 18])
+
+        w = WellSet(PlateFormat(96), ['A12', 'H1'])
+        self.assertTrue('A12' in w and 89 in w and 'h1' in w)
+        for well in ['A0', 'I1', 'A13', 0, -8, 97, 'x']:
+            self.assertFalse(well in w)
+
+    def test_compileRange(self):
+        f = PlateFormat(96)
+
+        self.assertEqual(f.range2int('A1:H6').tolist(), list(range(1, 49)))
+        self.assertEqual(f.range2int('1-48').tolist(), list(range(1, 49)))
+        self.assertEqual(f.range2int('cols 3-5').tolist(), list(range(17, 41)))
+        self.assertEqual(len(f.range2int('rows B-D; all')), 96)
+        self.assertEqual(f.range2int('row b').tolist(), list(range(2, 97, 8)))
+        self.assertEqual(f.range2int('A1,A3,C5:D8').tolist(),
+                         [1, 17, 35, 36, 43, 44, 51, 52, 59, 60])
+        self.assertEqual(WellSet.fromRange(f, 'row 2'), WellSet.row(f, 'B'))
+
+        self.assertTrue(compileRange(f, 'C5:D8') is f.range2int('C5:D8'))
+        self.assertRaises(ValueError, f.range2int('A1').fill, 0)
+
+        for expr in ['A13', 'A0', 'I1', '0', '97', 'I1:J2', 'A0:B2', 'A1:A13',
+                     'row I', 'col 0', 'cols A-B', 'A1 to A2', '']:
+            self.assertRaises(PlateError, f.range2int, expr)
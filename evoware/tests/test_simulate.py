@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from ..worklist import Worklist
+from ..simulate import Simulator, SimulationError, simulate
+
+
+class Test(unittest.TestCase):
+    """Test worklist simulation"""
+
+    def test_simulate(self):
+        with Worklist() as wl:
+            wl.transfer('src', 'A1', 'dst', 'A1', 30)
+            wl.transfer('src', 'A1', 'dst', 'B1', 30)  ## src A1 is empty
+            wl.transfer('src', 'B1', 'dst', 'B1', 30)  ## dst B1 overflows
+            wl.aspirate(rackLabel='src', position=3, volume=10)
+            wl.dispense(rackLabel='dst', position=3, volume=10, wash=False)
+            wl.dispense(rackLabel='dst', position=4, volume=10)  ## tip empty
+            wl.distribute(srcRackLabel='trough', srcPosStart=1, srcPosEnd=2,
+                          dstRackLabel='dst', dstPosStart=9, dstPosEnd=16,
+                          volume=5, excludeWells=[10])
+            wl.dispense(rackLabel='dst', position=97, volume=1)
+
+        sim = Simulator(maxVolume=50)
+        sim.addLabware('src', 96, volume=40)
+        r = sim.run(wl)
+
+        self.assertEqual([(i.kind, i.index) for i in r.issues],
+                         [('empty', 3), ('overfill', 7), ('no aspirate', 11),
+                          ('position', 14), ('no aspirate', 14)])
+        self.assertEqual((r.issues[0].labware, r.issues[0].position),
+                         ('src', 1))
+
+        dst = r.volumes['dst']
+        self.assertEqual(dst.shape, (8, 12))
+        self.assertEqual(list(dst[:4, 0]), [30, 60, 10, 10])
+        self.assertEqual(list(dst[:, 1]), [5, 0, 5, 5, 5, 5, 5, 5])
+        self.assertEqual(r.volumes['trough'].sum(), -35)
+        self.assertEqual(r.volumes['src'][0, 0], -20)
+        self.assertTrue(r.checked['src'] and not r.checked['dst'])
+        self.assertFalse(r.ok)
+
+        self.assertRaises(SimulationError, sim.run, wl, strict=True)
+
+        ## same result from worklist text
+        r2 = simulate(str(wl).splitlines(), maxVolume=50)
+        self.assertTrue(np.all(r2.volumes['dst'] == dst))
+        self.assertEqual(len(r2.issues), 4)  ## src not declared
+
+    def test_tipChannels(self):
+        with Worklist() as wl:
+            wl.aspirate(rackLabel='src', position=1, volume=10, tipMask=255)
+            for i in range(8):  ## 8-channel aspirate, one dispense per tip
+                wl.dispense(rackLabel='dst', position=i + 1, volume=10,
+                            tipMask=1 << i, wash=False)
+            wl.dispense(rackLabel='dst', position=9, volume=5, tipMask=1)
+            wl.aspirate(rackLabel='src', position=1, volume=10, tipMask=3)
+            wl.dispense(rackLabel='dst', position=10, volume=10, tipMask=6)
+
+        r = simulate(wl)
+        self.assertEqual([(i.kind, i.index) for i in r.issues],
+                         [('no aspirate', 9), ('no aspirate', 12)])
+        self.assertTrue('without aspirate' in r.issues[0].message)
+
+    def test_empty(self):
+        for lines in ([], ['C;only a comment', 'W;', 'B;']):
+            r = simulate(lines)
+            self.assertTrue(r.ok)
+            self.assertEqual(r.volumes, {})
+            self.assertEqual(r.report(), '')
@@ -0,0 +1,97 @@
+import unittest
+import shutil
+import tempfile
+from os import path
+
+from ..cherrypicking import PartIndex, IndexEntry
+from ..sqlindex import SQLitePartIndex
+from .. import plates
+
+
+class Test(unittest.TestCase):
+    """Test SQLite part index"""
+
+    def setUp(self):
+        testdata_dir = path.join(path.dirname(__file__), 'testdata')
+        self.files = [path.join(testdata_dir, 'partslist.xls'),
+                      path.join(testdata_dir, 'primers.xls')]
+        self.folder = tempfile.mkdtemp(prefix='test_sqlindex_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_sqlindex(self):
+        ref = PartIndex()
+        dbfile = path.join(self.folder, 'parts.sqlite')
+        p = SQLitePartIndex(dbfile)
+        for f in self.files:
+            ref.readExcel(f)
+            p.readExcel(f)
+        p.close()
+
+        p = SQLitePartIndex(dbfile)  ## re-open
+        self.assertEqual(len(p), len(ref))
+        self.assertEqual(list(p.keys()), list(ref.keys()))
+        self.assertEqual(dict(p.items()), dict(ref.items()))
+        self.assertEqual(p._plates['SB11'], plates.PlateFormat(384))
+        self.assertEqual(p.plateFormat('SB11'), ref.plateFormat('SB11'))
+
+        for key in ref.keys():
+            main = key.split('#')[0]
+            self.assertEqual(p[key], ref[key])
+            self.assertEqual(p[main], ref[main])
+            self.assertEqual(p.position(main), ref.position(main))
+        self.assertEqual(p['sb0101', 2], ref['sb0101#2'])
+        self.assertEqual(type(p['sb0101#2'][0]), type(ref['sb0101#2'][0]))
+        self.assertEqual(type(p.entryAt('SB10', 'A1')),
+                         type(ref.entryAt('SB10', 'A1')))
+        self.assertTrue(isinstance(next(p.values())[0], IndexEntry))
+        self.assertRaises(KeyError, p.__getitem__, 'nothing')
+
+        self.assertEqual(p.position('sb0111', plate='SB10'), ('SB10', 'H1'))
+        self.assertEqual(p.position('sb0111', plate=['x', 'SB10']),
+                         ('SB10', 'H1'))
+        self.assertRaises(KeyError, p.position, 'sb0111', plate='SB11')
+        self.assertEqual(p.position('nothing', default=('a', 'b')),
+                         ('a', 'b'))
+
+        self.assertEqual(p.entryAt('SB10', 33), ref.entryAt('SB10', 'A5'))
+        self.assertEqual(p.entryAt('SB10', 'B2', default={}), {})
+        self.assertEqual(p.plateIDs(), ref.plateIDs())
+
+        f, f_ref = p.filterByPlate('SB11'), ref.filterByPlate('SB11')
+        self.assertEqual(dict(f.items()), dict(f_ref.items()))
+        self.assertEqual(f._mainindex, f_ref._mainindex)
+        self.assertEqual(f.plateFormat('SB11'), plates.PlateFormat(384))
+        p.close()
+
+    def test_duplicates(self):
+        """duplicate positions are kept, as in PartIndex"""
+        ref = PartIndex()
+        p = SQLitePartIndex()
+        n = ref.readExcel(self.files[0])
+        for i in range(2):
+            self.assertEqual(p.readExcel(self.files[0]), n)
+        ref.readExcel(self.files[0])
+
+        self.assertEqual(len(p), len(ref))
+        self.assertEqual(len(p), 2 * n)
+        self.assertEqual(dict(p.items()), dict(ref.items()))
+        p.close()
+
+    def test_unique(self):
+        p = SQLitePartIndex(unique=True)
+        n = p.readExcel(self.files[0])
+        self.assertEqual(p.readExcel(self.files[0]), n)  ## entries read
+        self.assertEqual(len(p), n)  ## ... but not stored twice
+
+        entries = ({'id': 'x%i' % i, 'sub-id': '', 'plate': 'P1',
+                    'pos': str(i + 1)} for i in range(10))
+        self.assertEqual(p.loadTable([], entries), 10)
+        self.assertEqual(len(p), n + 10)
+        self.assertEqual(p.position('x9'), ('P1', '10'))
+        p.addEntry({'id': 'x9', 'sub-id': '', 'plate': 'P1', 'pos': '10'})
+        self.assertEqual(len(p['x9']), 1)
+        p.addEntry({'id': 'x9', 'sub-id': '', 'plate': 'P1', 'pos': '11'})
+        self.assertEqual(len(p['x9']), 2)
+        p.close()
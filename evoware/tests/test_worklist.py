@@ -1,8 +1,15 @@
 import unittest
 import tempfile
+from decimal import Decimal
+
+import numpy as np
 
 from .. import fileutil as F
-from ..worklist import Worklist
+from ..worklist import (Worklist, WorklistException, readWorklist,
+                        iterWorklist)
+from .. import commands as C
+from .. import optimize as O
+from .. import plates
 
 
 class Test(unittest.TestCase):
@@ -74,3 +81,296 @@ class Test(unittest.TestCase):
                           volume=100,
                           nDitiReuses=2, nMultiDisp=12,
                           excludeWells=[1, 96])
+
+    def test_worklist_positions(self):
+        with Worklist() as wl:
+            wl.transfer('src1', 'B1', 'dst1', 'h12', 10, wash=False)
+            wl.distribute(srcRackLabel='src1', srcPosStart='A1',
+                          srcPosEnd='H1', dstRackLabel='dst1',
+                          excludeWells='row A, col 12, C5:D6', volume=5)
+
+            self.assertEqual(wl.positions('col 2'), list(range(9, 17)))
+            self.assertRaises(WorklistException, wl.position, 'A1:A2')
+            self.assertRaises(WorklistException, wl.positions, 'row Z')
+            for pos in ['A0', 'I1', 'A13']:
+                self.assertRaises(WorklistException, wl.transfer,
+                                  'src1', pos, 'dst1', 1, 5)
+
+        lines = str(wl).split('\n')
+        self.assertEqual(lines[0], 'A;src1;;;2;;10;')
+        self.assertEqual(lines[1], 'D;dst1;;;96;;10;')
+
+        excluded = [int(x) for x in lines[2].split(';')[16:]]
+        self.assertEqual(len(excluded), 12 + 7 + 4)
+        self.assertEqual(excluded[:3], [1, 9, 17])
+
+    def test_distribute_volume(self):
+        for volume, field in ((20, '20'), (20.0, '20'), (np.float32(20), '20'),
+                              (12.5, '12.5'), (np.int64(7), '7')):
+            with Worklist() as wl:
+                wl.distribute(srcRackLabel='src1', srcPosStart=1, srcPosEnd=8,
+                              dstRackLabel='dst1', volume=volume)
+            self.assertEqual(str(wl).split(';')[11], field)
+
+    def test_worklistStream(self):
+        with open(self.fname, 'w') as f:
+            wl = Worklist(f, stream=True, chunksize=100)
+            for i in range(1, 25):
+                wl.transfer('src1', i, 'dst1', i, 10)
+
+            self.assertTrue(0 < f.tell() < 1000)
+            self.assertRaises(WorklistException, str, wl)
+            wl.close()
+
+        with open(self.fname, 'w') as f, \
+                Worklist(f, stream=True, capture=True, chunksize=100) as wl2:
+            for i in range(1, 25):
+                wl2.transfer('src1', i, 'dst1', i, 10)
+
+        with Worklist() as wl3:
+            for i in range(1, 25):
+                wl3.transfer('src1', i, 'dst1', i, 10)
+
+        self.assertEqual(open(self.fname).read(), str(wl3))
+        self.assertEqual(str(wl2), str(wl3))
+        self.assertRaises(WorklistException, Worklist, stream=True)
+
+    def _fill(self, wl):
+        wl.comment('columnar test')
+        wl.transferColumn('src3', 2, 'dst3', 12, 120, wash=True)
+        wl.transferColumn('src3', 1, 'dst3', 1, 2.5, tipMask=3,
+                          liquidClass='Water')
+        wl.transfer('src1', 'B1', 'dst1', 'h12', 10, wash=False)
+        wl.multidiswithflush('src2', 1, 'dst2', 'col 1', volume=20,
+                             tipVolume=50)
+        wl.distribute(srcRackLabel='src1', srcPosStart=1, srcPosEnd=8,
+                      dstRackLabel='dst1', volume=100,
+                      excludeWells=[1, 96])
+        wl.B()
+        wl.write('W;')
+
+    def test_worklistColumnar(self):
+        with Worklist() as wl:
+            self._fill(wl)
+
+        with open(self.fname, 'w') as f, Worklist(f, columnar=True) as wl2:
+            self._fill(wl2)
+            self.assertEqual(len(wl2.commands), len(str(wl).split('\n')) - 1)
+
+        self.assertEqual(str(wl2), str(wl))
+        self.assertEqual(open(self.fname).read(), str(wl))
+
+        lines = str(wl).split('\n')
+        self.assertEqual(next(wl2.commands.chunks(size=7)),
+                         '\n'.join(lines[:7]) + '\n')
+
+    def test_columnarVolumes(self):
+        volumes = [np.float32(0.1), 2.5, 1 / 3., 7, np.int32(4), 10.0,
+                   np.float64(0.3), np.float16(0.1), np.float32(1e-7)]
+
+        def fill(wl):
+            for i, v in enumerate(volumes):
+                wl.aspirate(rackLabel='src', position=i + 1, volume=v)
+                wl.dispense(rackLabel='dst', position=i + 1, volume=v)
+
+        with Worklist() as wl, Worklist(columnar=True) as wl2:
+            fill(wl)
+            fill(wl2)
+
+        self.assertEqual(str(wl2), str(wl))
+        self.assertTrue('A;;src;;1;;0.1;' in str(wl))  ## str(float32)
+        ## text mode writes str(volume), as it always did
+        self.assertEqual([l.split(';')[6] for l in str(wl).splitlines()
+                          if l[0] in 'AD'],
+                         [str(v) for v in volumes for i in (0, 1)])
+        self.assertTrue('D;;dst;;5;;4;' in str(wl))
+        self.assertTrue('A;;src;;6;;10.0;' in str(wl))
+
+        commands = list(iterWorklist(str(wl).splitlines()))
+        cb = C.CommandBuffer()
+        for cmd in commands:
+            cb.append(cmd)
+        self.assertEqual(cb.render(), str(wl))
+
+    def test_transfer_many(self):
+        volumes = [10, 2.5, 20] * 32
+
+        for columnar in (False, True):
+            with Worklist(columnar=columnar) as wl:
+                for i in range(96):
+                    wl.transfer('src1', i + 1, 'dst%i' % (i % 2), 96 - i,
+                                volumes[i], liquidClass='Water')
+                wl.transfer('src1', 'A1', 'dst1', 'B1', 5, wash=False)
+
+            with Worklist(columnar=columnar) as wl2:
+                n = wl2.transfer_many('src1', 'A1:H12',
+                                      ['dst0', 'dst1'] * 48,
+                                      np.arange(96, 0, -1),
+                                      volumes, liquidClass='Water')
+                wl2.transfer_many(['src1'], ['A1'], 'dst1', 2, 5, wash=False)
+
+            self.assertEqual(n, 96)
+            self.assertEqual(str(wl2), str(wl))
+
+        wl = Worklist()
+        self.assertRaises(WorklistException, wl.transfer_many, 'src1',
+                          [1, 2], 'dst1', [1, 2, 3], 10)
+        self.assertRaises(WorklistException, wl.transfer_many, 'src1',
+                          [1, 2], '', 1, 10)
+        self.assertRaises(WorklistException, wl.transfer_many, 'src1',
+                          ['A1', 'A13'], 'dst1', 1, 10)
+        for pos in ([200], [0, 1], np.array([1, 97]), [1.0, 97.0]):
+            self.assertRaises(WorklistException, wl.transfer_many, 'src1',
+                              pos, 'dst1', 1, 10)
+            self.assertRaises(WorklistException, wl.transfer_many, 'src1',
+                              1, 'dst1', pos, 10)
+
+    def test_transfer_many_fractional(self):
+        for dtype in (np.float32, np.float64):
+            volumes = (np.arange(1, 25) / 3.).astype(dtype)
+
+            for columnar in (False, True):
+                with Worklist(columnar=columnar) as wl:
+                    for i, v in enumerate(volumes):
+                        wl.transfer('src', i + 1, 'dst', i + 1, v)
+
+                with Worklist(columnar=columnar) as wl2:
+                    wl2.transfer_many('src', range(1, 25), 'dst',
+                                      range(1, 25), volumes)
+
+                self.assertEqual(str(wl2).encode(), str(wl).encode())
+
+        volumes = [np.float32(0.1), 0.1, 3, np.float32(2), 1 / 3.]
+        for columnar in (False, True):
+            with Worklist(columnar=columnar) as wl:
+                wl.transfer_many('src', range(1, 6), 'dst', 1, volumes)
+            lines = str(wl).splitlines()
+            self.assertEqual([l.split(';')[6] for l in lines[::3]],
+                             ['0.1', '0.1', '3', '2.0', str(1 / 3.)])
+
+    def test_transfer_many_dtypes(self):
+        for dtype in (int, float, np.int8, np.uint16, np.int64, np.float32,
+                      np.float64):
+            volumes = np.array([1, 2, 3, 100]).astype(dtype)
+            if np.dtype(dtype).kind == 'f':
+                volumes = volumes / np.array(10, dtype)
+
+            for vol in (volumes, volumes.tolist(), list(volumes)):
+                for columnar in (False, True):
+                    with self.subTest(dtype=dtype, vol=type(vol[0]),
+                                      columnar=columnar):
+                        with Worklist(columnar=columnar) as wl:
+                            for i, v in enumerate(vol):
+                                wl.transfer('src', i + 1, 'dst', 1, v)
+
+                        with Worklist(columnar=columnar) as wl2:
+                            wl2.transfer_many('src', [1, 2, 3, 4], 'dst', 1,
+                                              vol)
+
+                        self.assertEqual(str(wl2), str(wl))
+
+        wl = Worklist()
+        for vol in (np.array([0.1], np.float16), [np.float16(0.1)],
+                    [True, 2], np.array([1, 0], bool), [Decimal('0.1')],
+                    np.array([1], object)):
+            self.assertRaises(WorklistException, wl.transfer_many, 'src', 1,
+                              'dst', 1, vol)
+
+    def test_readWorklist(self):
+        with open(self.fname, 'w') as f, Worklist(f) as wl:
+            self._fill(wl)
+            wl.write('A;src1;;;1;;10;Water;;3;')
+            wl.write('W2;')
+            wl.write('some custom line')
+
+        cb = readWorklist(self.fname)
+        self.assertEqual(cb.render(), str(wl))
+
+        cmds = list(iterWorklist(str(wl).splitlines()))
+        self.assertEqual(len(cmds), len(cb))
+        self.assertEqual('\n'.join(str(c) for c in cmds[:-3]),
+                         '\n'.join(str(wl).splitlines()[:-3]))
+        self.assertEqual(cmds[-3].tipMask, 3)
+        self.assertEqual(cmds[-2], C.Wash('2'))
+
+        r = [c for c in cmds if c.op == C.OP_R][0]
+        self.assertEqual(r.excludeWells, [1, 96])
+
+        a = cb.records[cb.records['op'] == C.OP_A]
+        self.assertEqual(a['volume'].sum(),
+                         sum(c.volume for c in cmds if c.op == C.OP_A))
+
+        self.assertRaises(WorklistException, readWorklist, ['A;src;;;x;;1;'])
+
+    def test_tipBatches(self):
+        with Worklist() as wl:
+            self.assertEqual(wl.transferColumn('src', 2, 'dst', 3, 10,
+                                               parallel=True), 8)
+            cmds = list(iterWorklist(str(wl).splitlines()))
+        self.assertEqual(len(cmds), 17)
+        self.assertEqual([c.tipMask for c in cmds[:8]],
+                         [1, 2, 4, 8, 16, 32, 64, 128])
+        self.assertEqual(cmds[8], C.Dispense('dst', '', '', 17, '', 10, '', 1))
+
+        t = [O.Transfer('src', 1, 'dst', 1, 10),  ## A1 -> A1
+             O.Transfer('src', 2, 'dst', 2, 10),  ## B1 -> B1
+             O.Transfer('src', 3, 'dst', 4, 10),  ## C1 -> D1, other row
+             O.Transfer('src', 4, 'dst', 4, 5),  ## D1 -> D1, other volume
+             O.Transfer('src', 9, 'dst', 9, 10),  ## A2 -> A2, other column
+             O.Transfer('src', 20, 'dst', 20, 5)]  ## D3 -> D3, other column
+        batches = O.batchTips(t)
+        self.assertEqual(batches[0], [(1, t[0]), (2, t[1])])
+        self.assertEqual([len(b) for b in batches], [2, 1, 1, 1, 1])
+        self.assertEqual(batches[1], [(None, t[2])])
+
+        ## 384 well plates: neighbouring tips are two rows apart
+        formats = {'src': plates.PlateFormat(384)}
+        t = [O.Transfer('src', 1, 'dst', 1, 10),
+             O.Transfer('src', 2, 'dst', 1, 10),
+             O.Transfer('src', 3, 'dst', 2, 10)]
+        self.assertEqual(O.batchTips(t, formats),
+                         [[(1, t[0]), (2, t[2])], [(None, t[1])]])
+
+        with Worklist() as wl:
+            wl.transferBatch([(1, t[0]), (2, t[2])])
+            lines = str(wl).splitlines()
+        self.assertEqual(lines, ['A;src;;;1;;10;;1', 'A;src;;;3;;10;;2',
+                                 'D;dst;;;1;;10;;1', 'D;dst;;;2;;10;;2',
+                                 'W;'])
+
+    def test_multiDispense(self):
+        t = [O.Transfer('src', 1, 'dst', 1, 10),
+             O.Transfer('src', 2, 'dst', 2, 10),
+             O.Transfer('src', 1, 'dst', 3, 10),
+             O.Transfer('src', 1, 'dst', 4, 5, column='b'),
+             O.Transfer('src', 1, 'dst', 5, 10, liquidClass='DMSO')]
+        groups = O.multiDispense(t)
+        self.assertEqual(groups, [[t[0], t[2], t[3]], [t[1]], [t[4]]])
+        self.assertEqual(len(O.multiDispense(t, phases=[['']])), 4)
+
+        with Worklist() as wl:
+            self.assertEqual(wl.transferMulti(groups[0], tipVolume=20), 2)
+            self.assertEqual(wl.transferMulti(groups[1], tipVolume=20), 1)
+            lines = str(wl).splitlines()
+        self.assertEqual(lines, ['A;src;;;1;;20;', 'D;dst;;;1;;10;',
+                                 'D;dst;;;3;;10;', 'F;', 'A;src;;;1;;5;',
+                                 'D;dst;;;4;;5;', 'W;', 'A;src;;;2;;10;',
+                                 'D;dst;;;2;;10;', 'W;'])
+
+        ## oversized transfers are split into several aspirations
+        with Worklist() as wl:
+            self.assertEqual(wl.transferMulti([t[0]._replace(volume=45)],
+                                              tipVolume=20), 3)
+            lines = str(wl).splitlines()
+        self.assertEqual(lines, ['A;src;;;1;;20;', 'D;dst;;;1;;20;', 'F;',
+                                 'A;src;;;1;;20;', 'D;dst;;;1;;20;', 'F;',
+                                 'A;src;;;1;;5;', 'D;dst;;;1;;5;', 'W;'])
+
+        with Worklist() as wl:
+            self.assertRaises(WorklistException, wl.transferMulti, t[:1],
+                              tipVolume=0)
+
+        dst = [1, 2, 3]
+        with Worklist() as wl:
+            wl.multidiswithflush('src', 1, 'dst', dst, 10, tipVolume=20)
+        self.assertEqual(dst, [1, 2, 3])
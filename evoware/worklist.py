@@ -16,8 +16,14 @@
 """Generate Evoware pipetting worklists"""
 
 import io
+import numbers
+
+import numpy as np
 
 from . import fileutil as F
+from . import plates
+from . import commands as C
+from . import optimize as O
 # from . import dialogs as D
 
 
@@ -25,6 +31,59 @@ class WorklistException(Exception):
     pass
 
 
+class ChunkedWriter(object):
+    """
+    Minimal file-like output buffer that collects worklist lines and passes
+    them on to a target file handle in chunks of (at least) chunksize
+    characters. Only the current chunk is kept in memory unless capture is
+    switched on, in which case everything written is also kept for
+    getvalue().
+    """
+
+    def __init__(self, fh, chunksize=65536, capture=False):
+        """
+        @param fh: file handle, writable target
+        @param chunksize: int, number of characters to collect before writing
+        @param capture: bool, keep a copy of the complete output [False]
+        """
+        self.fh = fh
+        self.chunksize = chunksize
+        self._lines = []
+        self._size = 0
+        self._capture = io.StringIO() if capture else None
+
+    def write(self, s):
+        self._lines.append(s)
+        self._size += len(s)
+
+        if self._size >= self.chunksize:
+            self.flush()
+
+    def flush(self):
+        """write pending lines to target file handle"""
+        if not self._lines:
+            return
+
+        chunk = ''.join(self._lines)
+        self._lines = []
+        self._size = 0
+
+        self.fh.write(chunk)
+        if self._capture is not None:
+            self._capture.write(chunk)
+
+    def getvalue(self):
+        """
+        @return str, complete output written so far
+        @raise WorklistException, if output has not been captured
+        """
+        if self._capture is None:
+            raise WorklistException(
+                'streamed worklist output is not captured (use capture=True)')
+
+        return self._capture.getvalue() + ''.join(self._lines)
+
+
 class Worklist(object):
     """
     Basic Evoware worklist generator.
@@ -50,8 +109,25 @@ class Worklist(object):
         finally:    
             wl.close()
 
-    The file (handle) will be created and opened only with the first "write" 
-    statement (wl.A() in the above example). There are two properties:
+    By default, all worklist lines are collected in memory and only written
+    to the file handle when the worklist is closed. For very long worklists,
+    use streaming mode instead, which passes lines on to the file handle in
+    chunks (of chunksize characters) as they are generated:
+
+    >>> with Worklist(open('long.gwl', 'w'), stream=True) as wl:
+            for i in range(1, 97):
+                wl.transfer('src1', i, 'dst1', i, 10)
+
+    In streaming mode, the worklist content is not kept in memory and
+    str(wl) is only available if the Worklist was created with capture=True.
+
+    Alternatively, Worklist(fh, columnar=True) records all commands in a
+    compact commands.CommandBuffer (numpy arrays rather than text lines),
+    which is rendered into worklist text in one bulk pass on close() or
+    str(). The buffer is accessible as wl.commands, e.g. for statistics or
+    validation passes.
+
+    There are two properties:
     
     * f -- gives access to the writable file handle (a readonly property,
             first access will create and open the file)
@@ -76,6 +152,9 @@ class Worklist(object):
     
     transferColumn -- generate an aspirate and a dispense command for each
                       well in a given column (Note: replace this by R?)
+
+    transfer_many -- generate aspirate, dispense (and wash) commands for
+                     many transfers given as arrays, in one vectorized step
     
     wash -- insert wash / tip replacement statement
     flush -- insert flush statement
@@ -119,6 +198,13 @@ class Worklist(object):
         
     'W;' is added by default, after each dispense command. This behaviour can
     be switched off by passing `wash=False` to dispense(), D(), or transfer().
+
+    Well positions can be given in Tecan numbering (int) or as well name
+    or range expression (str) which is interpreted according to the
+    current plateformat (see plates.compileRange):
+    >>> wl.transfer('Src1', 'A1', 'Dst1', 'h12', 25)
+        wl.distribute(srcRackLabel='Src1', srcPosStart='A1', srcPosEnd='H1',
+                      dstRackLabel='Dst1', excludeWells='row A, col 12')
     
     Other methods:
     ==============
@@ -150,23 +236,44 @@ class Worklist(object):
                   384: 16,
                   1536: 32}
 
-    def __init__(self, fh=None, liquidClass=None, reportErrors=False):
+    def __init__(self, fh=None, liquidClass=None, reportErrors=False,
+                 stream=False, capture=False, chunksize=65536,
+                 columnar=False):
         """
-        @param fname - str, file name for output worklist (will be created)
+        @param fh - file handle, writable output file for worklist
         @param reportErrors - bool, report certain exceptions via dialog box
                               to user [True]
+        @param stream - bool, write lines to fh in chunks while they are
+                        generated instead of only on close [False]
+        @param capture - bool, keep a copy of streamed output for str() [False]
+        @param chunksize - int, characters collected per write in stream mode
+        @param columnar - bool, record commands in a commands.CommandBuffer
+                          and render text only on close [False]
         """
         #self.fname = F.absfile(fname)
         self._target_fh = fh
         self.fname = getattr(self._target_fh, 'name', None)
-        self._output_str = io.StringIO()  ## file handle
+        self.stream = stream
+        self.commands = C.CommandBuffer() if columnar else None
+
+        if columnar:
+            self._output_str = None
+        elif stream:
+            if fh is None:
+                raise WorklistException('stream mode requires a file handle')
+            self._output_str = ChunkedWriter(fh, chunksize, capture)
+        else:
+            self._output_str = io.StringIO()  ## file handle
         self.reportErrors = reportErrors
         self._plateformat = 96
+        self._format = plates.PlateFormat(96)
         self.rows = 8
         self.columns = 12
         self.defaultLiquidClass = liquidClass
 
     def __str__(self):
+        if self.commands is not None:
+            return self.commands.render()
         return self._output_str.getvalue()
 
     def __repr__(self):
@@ -181,6 +288,7 @@ class Worklist(object):
         if not wells in self.ALLOWED_PLATES:
             raise WorklistException('plate format %r is not supported' % wells)
         self._plateformat = wells
+        self._format = plates.PlateFormat(wells)
         self.rows = self.PLATE_ROWS[wells]
         self.columns = wells / self.rows
 
@@ -190,14 +298,58 @@ class Worklist(object):
     plateformat = property(_get_plateformat, _set_plateformat,
                            doc='default plate format for column transfers')
 
+    def position(self, pos):
+        """
+        Resolve a single well position given as Tecan number or well name.
+        @param pos: int | str, e.g. 10 or 'B2' (or range expr. for one well)
+        @return int, well position in Tecan numbering
+        @raise WorklistException, if pos doesn't translate into a single well
+        """
+        if not isinstance(pos, str):
+            return pos
+
+        r = self.positions(pos)
+        if len(r) != 1:
+            raise WorklistException('%r is not a single well position' % pos)
+        return int(r[0])
+
+    def positions(self, expr):
+        """
+        Resolve several well positions given as range expression (see
+        plates.compileRange), list of well names / numbers or WellSet.
+        @param expr: str | [int|str] | plates.WellSet, e.g. 'A1:H6, col 8'
+        @return [int], well positions in Tecan numbering
+        @raise WorklistException, if the expression cannot be interpreted
+        """
+        try:
+            if isinstance(expr, str):
+                return self._format.range2int(expr).tolist()
+
+            if isinstance(expr, plates.WellSet):
+                return list(expr)
+
+            return [self.position(p) for p in expr]
+
+        except plates.PlateError as why:
+            raise WorklistException(str(why))
+
     def close(self):
         """
-        Close file handle. This method will be called automatically by 
-        __del__ or the with statement.
+        Write any pending output and close file handle. This method will be
+        called automatically by the with statement.
         """
         if self._target_fh:
-            self._target_fh.close()
-            self._target_fh = None
+            try:
+                if self.commands is not None:
+                    for chunk in self.commands.chunks():
+                        self._target_fh.write(chunk)
+                elif self.stream:
+                    self._output_str.flush()
+                else:
+                    self._target_fh.write(self._output_str.getvalue())
+            finally:
+                self._target_fh.close()
+                self._target_fh = None
 
     def __enter__(self):
         """Context guard for entering ``with`` statement"""
@@ -205,10 +357,6 @@ class Worklist(object):
 
     def __exit__(self, type, value, traceback):
         """Context guard for exiting ``with`` statement"""
-        if self._target_fh:
-            with self._target_fh as fh:
-                fh.write(self._output_str.getvalue())
-
         self.close()
 
     def _transfer_op(self, transferType, rackLabel='', rackID='', rackType='',
@@ -219,12 +367,21 @@ class Worklist(object):
             raise WorklistException(
                 'Specify either source labware ID or rack label.')
 
+        if isinstance(position, str):
+            position = self.position(position)
+
         # tipMask = str(tipMask or '')
         if liquidClass is None:
             liquidClass = self.defaultLiquidClass
         if liquidClass is None:
             liquidClass = ''
 
+        if self.commands is not None:
+            self.commands.transfer(ord(transferType), rackLabel, rackID,
+                                   rackType, position, tubeID, volume,
+                                   liquidClass, tipMask)
+            return
+
         fields = [rackLabel, rackID, rackType, position, tubeID, volume,
                   liquidClass, tipMask]
         fields = [str(f) for f in fields]
@@ -241,7 +398,7 @@ class Worklist(object):
         """
         Generate a single aspirate command. Required parameters are:
         @param rackLabel or rackID - str, source rack label or barcode ID
-        @param position - int, well position (default:1)
+        @param position - int | str, well position, e.g. 2 or 'B1' (default:1)
         @param volume - int, volume in ul
         
         Optional parameters are:
@@ -258,7 +415,7 @@ class Worklist(object):
         """
         aspirate shortcut with only the three core parameters
         @param rackID - str, source labware ID (or rack ID if labware lacks ID)
-        @param position - int, source well position
+        @param position - int | str, source well position
         @param volume - int, aspiration volume
         @param byLabel - bool, use rack label instead of labware / rack ID
         """
@@ -268,11 +425,12 @@ class Worklist(object):
             self.aspirate(rackLabel=rackID, position=position, volume=volume)
 
     def dispense(self, rackLabel='', rackID='', rackType='', position=1,
-                 tubeID='', volume=0, liquidClass=None, tipMask=None, wash=True):
+                 tubeID='', volume=0, liquidClass=None, tipMask=None,
+                 wash=True):
         """
         Generate a single dispense command. Required parameters are:
         @param rackLabel or rackID - str, source rack label or barcode ID
-        @param position - int, well position (default:1)
+        @param position - int | str, well position, e.g. 2 or 'B1' (default:1)
         @param volume - int, volume in ul
         
         Optional parameters are:
@@ -289,14 +447,14 @@ class Worklist(object):
                           volume, liquidClass, tipMask)
 
         if wash:
-            self._out.write('W;\n')
+            self.wash()
 
     def D(self, rackID, position, volume, liquidClass=None, wash=True,
           byLabel=False):
         """
         dispense shortcut with only the three core parameters
         @param rackID - str, dest. labware ID (or rack ID if labware lacks ID)
-        @param position - int, destination well position
+        @param position - int | str, destination well position
         @param volume - int, aspiration volume
         @param wash - bool, include 'W' statement for tip replacement after
                       dispense (default: True)
@@ -321,14 +479,15 @@ class Worklist(object):
         
         Required parameters:
         @param srcRackID or srcRackLabel - str, source barcode or rack label
-        @param srcPosStart - int, source starting well position (default:1)
-        @param srcPosEnd - int, source ending well position (default:96)
+        @param srcPosStart - int | str, source starting well position [1]
+        @param srcPosEnd - int | str, source ending well position [96]
 
-        @param dstRackID or dstRackLabel - str, destination barcode or rack label
-        @param dstPosStart - int, destination starting well position (default:1)
-        @param dstPosEnd - int, destination ending well position (default:96)
+        @param dstRackID or dstRackLabel - str, destination barcode or label
+        @param dstPosStart - int | str, destination start well position [1]
+        @param dstPosEnd - int | str, destination ending well position [96]
 
-        @param volume - int, volume in ul
+        @param volume - int | float, volume in ul; integral floats are
+                        written as integer (20.0 => '20')
         
         Optional parameters are:
         @param srcRackType - str, validate that source rack has this type
@@ -339,7 +498,8 @@ class Worklist(object):
         @param nMultiDisp - int, (default:1, no multi-dispensing)
         @direction - int, pipetting direction (default:0 from left to right)
         
-        @param exlcudeWells - [int], list of destination wells to skip []
+        @param exlcudeWells - [int] | str | plates.WellSet, destination wells
+                              to skip, e.g. [1, 96] or 'row A' []
         """
         if not (srcRackLabel or srcRackID):
             raise WorklistException('Specify either source rack label or ID.')
@@ -347,29 +507,40 @@ class Worklist(object):
             raise WorklistException(
                 'Specify either destination rack label or ID.')
 
+        srcPosStart, srcPosEnd, dstPosStart, dstPosEnd = \
+            [self.position(p) for p in
+             (srcPosStart, srcPosEnd, dstPosStart, dstPosEnd)]
+
+        if isinstance(excludeWells, str):
+            excludeWells = self.positions(excludeWells)
+
         r = 'R;%s;%s;%s;%i;%i;' % (srcRackLabel, srcRackID, srcRackType,
                                    srcPosStart, srcPosEnd)
         r += '%s;%s;%s;%i;%i;' % (dstRackLabel, dstRackID, dstRackType,
                                   dstPosStart, dstPosEnd)
 
-        r += '%i;%s;%i;%i;%i;' % (volume, liquidClass, nDitiReuses, nMultiDisp,
+        ## integral volumes are written as before ('20', not '20.0'),
+        ## fractional volumes as given rather than truncated
+        if not isinstance(volume, numbers.Integral) and \
+                float(volume).is_integer():
+            volume = int(volume)
+
+        r += '%s;%s;%i;%i;%i;' % (volume, liquidClass, nDitiReuses, nMultiDisp,
                                   direction)
 
         if excludeWells:
             r += ';'.join([str(x) for x in excludeWells])
 
-        r += '\n'
-
-        self._out.write(r)
+        self.write(r)
 
     def transfer(self, srcID, srcPosition, dstID, dstPosition, volume,
                  srcRackType='', dstRackType='', liquidClass=None,
                  wash=True, byLabel=False):
         """
         @param srcID - str, source labware ID (or rack label if missing)
-        @param srcPosition - int, source well position
+        @param srcPosition - int | str, source well position ('A1' or 1)
         @param dstID - str, destination labware ID (or rack label if missing)
-        @param dstPosition - int, destination well position
+        @param dstPosition - int | str, destination well position
         @param volume - int, aspiration volume
         @param wash - bool, include 'W' statement for tip replacement after
                       dispense (default: True)
@@ -388,9 +559,129 @@ class Worklist(object):
                       liquidClass=liquidClass,
                       wash=wash)
 
+    def _positionarray(self, pos):
+        """
+        Convert positions for transfer_many into integer array.
+        @param pos: int | str | [int|str] | numpy.ndarray | plates.WellSet
+        @raise WorklistException, if any position is not on the plate
+        """
+        if isinstance(pos, str) or isinstance(pos, plates.WellSet):
+            return np.array(self.positions(pos), int)
+
+        try:
+            return self._format.human2int_array(np.asarray(pos))
+        except plates.PlateError as why:
+            raise WorklistException(str(why))
+
+    def transfer_many(self, srcIDs, srcPositions, dstIDs, dstPositions,
+                      volumes, srcRackType='', dstRackType='',
+                      liquidClass=None, wash=True):
+        """
+        Vectorized version of transfer(): generate aspirate, dispense and
+        (optionally) wash commands for many transfers at once. All input
+        sequences must have the same length; scalar values (or range
+        expressions resolving to a single well) are broadcast.
+
+        >>> wl.transfer_many('src1', 'A1:H12', 'dst1', range(1, 97), 20)
+
+        ... copies 20 ul from every well of plate 'src1' into plate 'dst1'.
+        The generated lines are identical to calling transfer() for each
+        transfer in turn.
+
+        @param srcIDs - str | [str], source labware ID(s)
+        @param srcPositions - int | str | [int|str], source well positions
+                              or range expression (e.g. 'A1:H12')
+        @param dstIDs - str | [str], destination labware ID(s)
+        @param dstPositions - int | str | [int|str], destination positions
+        @param volumes - int | float | [int|float], transfer volume(s); numpy
+                         volumes must be integers, float32 or float64
+        @param srcRackType - str, validate that source rack has this type
+        @param dstRackType - str, validate that destination rack has this type
+        @param liquidClass - str | [str], alternative liquid class(es)
+        @param wash - bool, include 'W' statement after each dispense [True]
+
+        @return int, number of transfers generated
+        @raise WorklistException, if inputs are empty, invalid or don't match
+        """
+        if liquidClass is None:
+            liquidClass = self.defaultLiquidClass
+        if liquidClass is None:
+            liquidClass = ''
+
+        ## only volume types that the buffer renders like str(volume) does in
+        ## transfer(); e.g. np.float16(0.1) would come out as 0.0999755859375
+        types = set(map(type, volumes)) if type(volumes) in [list, tuple] \
+            else set([np.asarray(volumes).dtype.type])
+        for t in types:
+            if not (t in (float, np.float64, np.float32) or
+                    (issubclass(t, numbers.Integral) and
+                     not issubclass(t, (bool, np.bool_)))):
+                raise WorklistException(
+                    'transfer_many: unsupported volume type %s' % t.__name__)
+
+        ## keep integer (and float32) volumes in mixed lists formatted as such
+        if type(volumes) in [list, tuple]:
+            intvol = [isinstance(v, numbers.Integral) for v in volumes]
+            f4vol = [type(v) is np.float32 for v in volumes]
+        else:
+            intvol = np.asarray(volumes).dtype.kind in 'iu'
+            f4vol = np.asarray(volumes).dtype == np.float32
+
+        try:
+            src, srcpos, dst, dstpos, volumes, intvol, f4vol, lc = [
+                np.atleast_1d(x) for x in np.broadcast_arrays(
+                    np.asarray(srcIDs, str), self._positionarray(srcPositions),
+                    np.asarray(dstIDs, str), self._positionarray(dstPositions),
+                    np.asarray(volumes), np.asarray(intvol), np.asarray(f4vol),
+                    np.asarray(liquidClass, str))]
+        except ValueError:
+            raise WorklistException('transfer_many: input sequences differ in '
+                                    'length')
+
+        if volumes.dtype.kind not in 'iuf':
+            raise WorklistException('transfer_many: volumes must be numbers')
+        if (src == '').any() or (dst == '').any():
+            raise WorklistException(
+                'Specify either source labware ID or rack label.')
+        if (srcpos < 1).any() or (dstpos < 1).any():
+            raise WorklistException('transfer_many: invalid well position')
+        if (volumes < 0).any():
+            raise WorklistException('transfer_many: negative volume')
+
+        commands = self.commands if self.commands is not None \
+            else C.CommandBuffer(capacity=0)
+
+        n = len(src)
+        r = np.zeros((n, 3 if wash else 2), C.CMD_DTYPE)
+        r['tipmask'] = -1
+        r['volume'][:, :2] = volumes[:, None]
+        r['intvol'][:, :2] = intvol[:, None]
+        r['f4vol'][:, :2] = f4vol[:, None]
+        r['liquid'][:, :2] = commands.internArray(lc)[:, None]
+
+        r['op'][:, 0] = C.OP_A
+        r['label'][:, 0] = commands.internArray(src)
+        r['racktype'][:, 0] = commands.intern(srcRackType)
+        r['pos'][:, 0] = srcpos
+
+        r['op'][:, 1] = C.OP_D
+        r['label'][:, 1] = commands.internArray(dst)
+        r['racktype'][:, 1] = commands.intern(dstRackType)
+        r['pos'][:, 1] = dstpos
+
+        if wash:
+            r['op'][:, 2] = C.OP_W
+
+        commands.extend(r.ravel())
+
+        if commands is not self.commands:
+            self._out.write(commands.render())
+
+        return n
+
     def transferColumn(self, srcID, srcCol, dstID, dstCol, volume,
                        liquidClass=None, tipMask=None, wash=True,
-                       byLabel=False):
+                       byLabel=False, parallel=False):
         """
         Generate Aspirate & Dispense commands for a whole plate column
         @param srcID - str, source labware ID (or rack label if missing)
@@ -402,12 +693,24 @@ class Worklist(object):
         @param tipMask - int, alternative tip mask (1 - 128, 8 bit encoded)
         @param wash - bool, include 'W' statement for tip replacement after
                       dispense (default: True)
+        @param parallel - bool, assign one tip per row and aspirate / dispense
+                          all rows in parallel, followed by a single wash;
+                          only used if no tipMask is given (default: False)
         
         @return n - int, number of aspiration / dispense pairs written
         """
         pos_src = (srcCol - 1) * self.rows + 1
         pos_dst = (dstCol - 1) * self.rows + 1
 
+        if parallel and tipMask is None:
+            transfers = [O.Transfer(srcID, pos_src + i, dstID, pos_dst + i,
+                                    volume, liquidClass)
+                         for i in range(0, self.rows)]
+            formats = {srcID: self._format, dstID: self._format}
+            for batch in O.batchTips(transfers, formats):
+                self.transferBatch(batch, wash=wash)
+            return self.rows
+
         for i in range(0, self.rows):
             self.aspirate(rackID=srcID,
                           position=pos_src + i,
@@ -418,21 +721,116 @@ class Worklist(object):
                           volume=volume,
                           liquidClass=liquidClass, tipMask=tipMask,
                           wash=wash)
-        return i
+        return self.rows
+
+    def transferBatch(self, batch, srcRackType='', dstRackType='',
+                      wash=True):
+        """
+        Generate commands for a group of transfers pipetted in parallel: all
+        aspirations, then all dispenses (each with its own tip mask) and a
+        single wash at the end.
+        @param batch - [(int, optimize.Transfer)], (tip mask, transfer)
+                       tuples as returned by optimize.batchTips
+        @param wash - bool, include 'W' statement for tip replacement after
+                      the last dispense (default: True)
+        """
+        for tipMask, t in batch:
+            self.aspirate(rackType=srcRackType,
+                          position=t.srcPos, volume=t.volume,
+                          liquidClass=t.liquidClass, tipMask=tipMask,
+                          rackID=t.srcID)
+        for tipMask, t in batch:
+            self.dispense(rackType=dstRackType,
+                          position=t.dstPos, volume=t.volume,
+                          liquidClass=t.liquidClass, tipMask=tipMask,
+                          wash=False, rackID=t.dstID)
+        if wash:
+            self.wash()
+
+    def transferMulti(self, transfers, tipVolume=900, srcRackType='',
+                      dstRackType='', flush=True, wash=True):
+        """
+        Generate multi-dispense commands for transfers sharing one source
+        well: aspirate the volume of as many transfers as fit into the tip,
+        dispense them one by one, flush the tip and continue with the next
+        aspiration. A single transfer is written as normal transfer.
+        Transfers larger than tipVolume are split into several aspirations
+        of at most tipVolume each.
+        @param transfers - [optimize.Transfer], transfers from the same source
+                           well and with the same liquid class
+        @param tipVolume - int, maximum volume per aspiration [900]
+        @param flush - bool, include 'F' statement between aspirations [True]
+        @param wash - bool, replace tip *after* all multi-dispense actions.
+        @return int, number of aspirations written
+        @raise WorklistException, if tipVolume is not positive
+        """
+        if tipVolume <= 0:
+            raise WorklistException('invalid tip volume %r' % tipVolume)
+
+        if len(transfers) == 1 and transfers[0].volume <= tipVolume:
+            t = transfers[0]
+            self.transfer(t.srcID, t.srcPos, t.dstID, t.dstPos, t.volume,
+                          srcRackType=srcRackType, dstRackType=dstRackType,
+                          liquidClass=t.liquidClass, wash=wash)
+            return 1
+
+        pieces = []
+        for t in transfers:
+            volume = t.volume
+            while volume > tipVolume:
+                pieces.append(t._replace(volume=tipVolume))
+                volume -= tipVolume
+                if isinstance(volume, float):
+                    volume = round(volume, 6)
+            pieces.append(t._replace(volume=volume) if volume != t.volume
+                          else t)
+
+        chunks = [[]]
+        for t in pieces:
+            if chunks[-1] and \
+                    sum(x.volume for x in chunks[-1]) + t.volume > tipVolume:
+                chunks.append([])
+            chunks[-1].append(t)
+
+        for i, chunk in enumerate(chunks):
+            if i and flush:
+                self.flush()
+
+            volume = sum(x.volume for x in chunk)
+            if isinstance(volume, float):
+                volume = round(volume, 6)  ## avoid 0.30000000000000004
+
+            t = chunk[0]
+            self.aspirate(rackType=srcRackType,
+                          position=t.srcPos, volume=volume,
+                          liquidClass=t.liquidClass, rackID=t.srcID)
+            for t in chunk:
+                self.dispense(rackType=dstRackType,
+                              position=t.dstPos, volume=t.volume,
+                              liquidClass=t.liquidClass, wash=False,
+                              rackID=t.dstID)
+        if wash:
+            self.wash()
+        return len(chunks)
 
     def multidiswithflush(self, srcLabel='', srcPos=1, dstLabel='', dstPos=[],
                           volume=0, tipVolume=900, liquidClass=None,
                           tipMask=None, wash=True, flush=True):
         """
         
+        @param dstPos - [int] | str, destination wells or range expression
         @param wash - bool, replace tip *after* all multi-dispense actions.
 
         """
+        if isinstance(dstPos, str):
+            dstPos = self.positions(dstPos)
+
+        dstPos = list(dstPos)[::-1]  # private copy, first entry is last now
+
         n_dispense = len(dstPos)
         totalVolume = volume * n_dispense
-        tipVolume = tipVolume - tipVolume % volume  # reduce tip volume to nearest multiple of dispense volume
-
-        dstPos.reverse()  # first entry is last now
+        ## reduce tip volume to nearest multiple of dispense volume
+        tipVolume = tipVolume - tipVolume % volume
 
         while totalVolume > 0:
             aspVolume = totalVolume if totalVolume <= tipVolume else tipVolume
@@ -444,8 +842,8 @@ class Worklist(object):
 
             n_next_dispense = int(aspVolume / volume)
 
-            assert n_next_dispense <= len(
-                dstPos), 'missmatch between aspiration volume and dispense actions left'
+            assert n_next_dispense <= len(dstPos), \
+                'missmatch between aspiration volume and dispense actions left'
 
             for i in range(0, n_next_dispense):
                 well = dstPos.pop()
@@ -464,17 +862,24 @@ class Worklist(object):
         if wash:
             self.wash()
 
+    def _command(self, op):
+        """write single-letter command like 'W;'"""
+        if self.commands is not None:
+            self.commands.command(ord(op))
+        else:
+            self._out.write(op + ';\n')
+
     def wash(self):
         """generate 'W;' wash / tip replacement command"""
-        self._out.write('W;\n')
+        self._command('W')
 
     def flush(self):
         """generate 'F;' tip flushing command"""
-        self._out.write('F;\n')
+        self._command('F')
 
     def B(self):
         """Generate break command forcing execution of all previous lines"""
-        self._out.write('B;\n')
+        self._command('B')
 
     def comment(self, comment):
         """Insert a work list comment"""
@@ -485,7 +890,83 @@ class Worklist(object):
         Directly write a custom line to worklist. A line break is added 
         automatically (i.e. don't add it to the input).
         """
-        line.replace('\n', '')
-        line.replace('\r', '')
+        line = line.replace('\n', '').replace('\r', '')
+
+        if self.commands is not None:
+            try:
+                self.commands.append(C.parseLine(line), line)
+            except ValueError:
+                self.commands.command(C.OP_TEXT, line)
+            return
 
         self._out.write(line + '\n')
+
+
+def _worklistLines(source):
+    """
+    @param source: str | file handle | [str], file name, open file or lines
+    @return generator of (int, str), line number and line without line break
+    """
+    if isinstance(source, str):
+        with open(F.absfile(source)) as f:
+            for i, line in enumerate(f):
+                yield i + 1, line.rstrip('\r\n')
+    else:
+        for i, line in enumerate(source):
+            yield i + 1, line.rstrip('\r\n')
+
+
+def iterWorklist(source):
+    """
+    Parse an existing worklist lazily, one line at a time. Only the current
+    line is held in memory.
+
+    >>> for cmd in iterWorklist('transfer_plate.gwl'):
+            if cmd.op == commands.OP_A:
+                print(cmd.rackLabel, cmd.position, cmd.volume)
+
+    @param source: str | file handle | [str], file name, open file handle or
+                   any iterable of lines (e.g. str(wl).splitlines())
+    @return generator of commands.Aspirate, Dispense, Distribute, Wash,
+            Flush, Break, Comment or Line objects (empty lines are skipped)
+    @raise WorklistException, if an A, D or R line cannot be parsed
+    """
+    for i, line in _worklistLines(source):
+        if not line.strip():
+            continue
+        try:
+            yield C.parseLine(line)
+        except ValueError as why:
+            raise WorklistException('line %i: %s' % (i, why))
+
+
+def readWorklist(source):
+    """
+    Parse a complete worklist into a columnar commands.CommandBuffer. The
+    buffer renders back into the original text (except for empty lines).
+    Use this bulk mode for speed, use iterWorklist to keep memory constant.
+
+    >>> cb = readWorklist('transfer_plate.gwl')
+    >>> cb.records['volume'][cb.records['op'] == commands.OP_A].sum()
+
+    @param source: str | file handle | [str], file name, open file handle or
+                   any iterable of lines
+    @return commands.CommandBuffer
+    @raise WorklistException, if an A, D or R line cannot be parsed
+    """
+    if isinstance(source, str):
+        with open(F.absfile(source)) as f:
+            lines = f.read().splitlines()
+    elif hasattr(source, 'read'):
+        lines = source.read().splitlines()
+    else:
+        lines = [line.rstrip('\r\n') for line in source]
+
+    r = C.CommandBuffer()
+
+    try:
+        r.extendLines(lines)
+    except ValueError as why:
+        raise WorklistException('line %s' % why)
+
+    return r